@@ -19,10 +19,6 @@ TODO LIST
 
  CONDITION TARGET EVENTS / BUFFABLES VALIDATIONM
 
- HANDLE INFINITE DERIVATION LOOP
-
- MAKE BUFFABLE TYPE - STOP USING CLASS NAMES
-
  PROPAGATION MAP CONTEXT
 
  BUFFABLE VERSIONING - UPDATE BUFF SPECS -> UPDATE BUFFABLES
@@ -1,24 +1,120 @@
+import time
+
 from utils.arrays import copy_triggers, delete_triggers
 
 import buffspecs
 from debug import strack_tracer
 
-from models import AddBuffEvent, EventResult, BuffPropagatedEvent
+from models import AddBuffEvent, EventResult, BuffPropagatedEvent, EMPTY_EVENT_RESULT
 
 from events import get_buff_specs_triggered_by_event, handle_event_conditions
-from propagation import get_buff_propagation_events, get_propagation_target_buffables_including_self
+from propagation import (
+    get_buff_propagation_events, get_propagation_target_buffables_including_self, unindex_propagated_derivations
+)
 from buffable import (
-    activate_buff, inactivate_buff, remove_all_buff_modifications, has_reached_max_stacks
+    activate_buff, inactivate_buff, remove_all_buff_modifications, has_reached_max_stacks, expire_buffs
 )
+from expiry import cancel_expiry_times, get_due_buffables, get_timestamp
+from derivation import start_derivation_batch, flush_derivation_batch
+import attributes
+import metrics
 from errors import BuffException, BuffErrorCodes
 
-@strack_tracer.Track
+class BuffTransaction(object):
+    """ Coalesces the changes of several call_event and add_buff calls. While in context, attribute final values are
+    only calculated when read and derivation updates are queued, then applied once per buffable attribute on exit.
+    Results of the calls are merged into a single EventResult.
+    Conditions evaluated inside the transaction might read derivated values that are not updated yet.
+    """
+    def __init__(self):
+        self.result = EventResult()
+        # Amount of buff calls running, only results of calls made directly inside the transaction are merged
+        self.depth = 0
+        self.previous_deferred_calculation = False
+
+    def merge_call(self, function, *args):
+        """ Runs a buff call made directly inside the transaction, merging its result into the transaction result.
+
+        :rtype: EventResult
+        """
+        self.depth += 1
+        try:
+            result = function(*args)
+        finally:
+            self.depth -= 1
+        self.result.merge(result)
+        return result
+
+    def __enter__(self):
+        global _transaction
+        if _transaction is not None:
+            # Nested transactions are part of the outer one
+            return _transaction
+        _transaction = self
+        self.previous_deferred_calculation = attributes._deferred_calculation
+        attributes.set_deferred_calculation(True)
+        start_derivation_batch()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        global _transaction
+        if _transaction is not self:
+            return
+        _transaction = None
+        try:
+            flush_derivation_batch()
+        finally:
+            attributes.set_deferred_calculation(self.previous_deferred_calculation)
+
+
+_transaction = None
+
+
+def buff_transaction():
+    """ Opens a transaction coalescing changes of buff calls, see BuffTransaction.
+
+    :rtype: BuffTransaction
+    """
+    return BuffTransaction()
+
+
+@strack_tracer.TrackSampled
 def call_event(event):
     """ Calls an event and try to trigger any remaining triggers on the event buffable.
 
     :param BuffEvent event:
     :rtype EventResult
     :returns An event result with all added, removed and propagated modifications.
+        The shared EMPTY_EVENT_RESULT is returned when the buffable has no trigger for this event.
+    """
+    collector = metrics._collector
+    if collector is not None:
+        start_ns = time.perf_counter_ns()
+
+    buffable = event.buffable
+    event_type_id = event.event_type_id
+    if event_type_id not in buffable.activation_triggers and event_type_id not in buffable.deactivation_triggers \
+            and event_type_id not in buffable.propagation_triggers:
+        if collector is not None:
+            collector.observe(metrics.CALL_EVENT, event.__class__.__name__, start_ns)
+        return EMPTY_EVENT_RESULT
+
+    transaction = _transaction
+    if transaction is not None and not transaction.depth:
+        result = transaction.merge_call(_call_triggers, event)
+    else:
+        result = _call_triggers(event)
+
+    if collector is not None:
+        collector.observe(metrics.CALL_EVENT, event.__class__.__name__, start_ns)
+    return result
+
+
+def _call_triggers(event):
+    """ Activates, inactivates and propagates the buffs triggered by an event.
+
+    :param BuffEvent event:
+    :rtype: EventResult
     """
     buffable = event.buffable
     result = EventResult()
@@ -33,16 +129,24 @@ def call_event(event):
 
     # Propagation Triggers
     for triggered_buff_spec in get_buff_specs_triggered_by_event(event, buffable.propagation_triggers, propagation=True):
+        targets = 0
         for propagation_event in get_buff_propagation_events(buffable, triggered_buff_spec, event):
-            buff_spec = buffspecs.get_buff_spec(propagation_event.buff_id)
+            targets += 1
+            buff_spec = buffspecs.get_compiled_spec(propagation_event.buff_id)
             result.propagated_modifications[propagation_event.buffable.id].append(
                 add_buff(propagation_event.buffable,buff_spec, propagation_event, propagated=True)
              )
             # In case this buff spec has no propagation triggers and was just propagated by "AddBuffEvent"
             # means this buff wont be able to re-propagate ever again.
-            if not buff_spec.propagation_triggers:
-                delete_triggers(propagation_event.buff_id, ["AddBuffEvent"], buffable.propagation_triggers)
+            if buff_spec.auto_propagates:
+                delete_triggers(
+                    propagation_event.buff_id, [AddBuffEvent.event_type_id], buffable.propagation_triggers
+                )
 
+        collector = metrics._collector
+        if collector is not None:
+            collector.increment(metrics.PROPAGATIONS, triggered_buff_spec.buff_id)
+            collector.increment(metrics.PROPAGATION_FANOUT, triggered_buff_spec.buff_id, targets)
     return result
 
 
@@ -57,15 +161,70 @@ def add_buff(buffable, buff_spec, source_event, propagated=False):
     :param bool propagated:
     :rtype: EventResult
     """
+    transaction = _transaction
+    if transaction is not None and not transaction.depth:
+        return transaction.merge_call(_add_buff, buffable, buff_spec, source_event, propagated)
+    return _add_buff(buffable, buff_spec, source_event, propagated)
+
+
+def _add_buff(buffable, buff_spec, source_event, propagated):
+    collector = metrics._collector
+    if collector is not None:
+        start_ns = time.perf_counter_ns()
+
+    buff_spec = buffspecs.get_compiled_spec(buff_spec.buff_id)
+
     # If this buff can propagate, copy its propagation triggers (or AddBuffEvent if there's none)
     if not propagated and buff_spec.propagates:
-        copy_triggers(buff_spec.buff_id, buff_spec.get_propagation_triggers(), buffable.propagation_triggers)
+        copy_triggers(buff_spec.buff_id, buff_spec.propagation_triggers, buffable.propagation_triggers)
 
     # We add the buff triggers or AddBuffEvent trigger if theres no trigger so it auto triggers
-    copy_triggers(buff_spec.buff_id, buff_spec.get_triggers(), buffable.activation_triggers)
+    copy_triggers(buff_spec.buff_id, buff_spec.triggers, buffable.activation_triggers)
 
     # Call add buff event, auto triggering the buff if needed
-    return call_event(AddBuffEvent(buffable, buff_spec.buff_id, source_event))
+    result = call_event(AddBuffEvent(buffable, buff_spec.buff_id, source_event))
+
+    if collector is not None:
+        collector.observe(metrics.ADD_BUFF, buff_spec.buff_id, start_ns)
+    return result
+
+
+@strack_tracer.Track
+def add_buff_many(buffables, buff_spec, source_event):
+    """ Adds the same buff to many buffables, like calling add_buff for each one of them, but resolving the buff
+        triggers and conditions only once. Metrics are recorded per buffable, the same as add_buff.
+
+    :param list[Buffable] buffables:
+    :param BuffSpec buff_spec:
+    :param BuffEvent source_event:
+    :rtype: EventResult
+    :returns A single event result with the modifications of all buffables
+    """
+    transaction = _transaction
+    if transaction is not None and not transaction.depth:
+        return transaction.merge_call(_add_buff_many, buffables, buff_spec, source_event)
+    return _add_buff_many(buffables, buff_spec, source_event)
+
+
+def _add_buff_many(buffables, buff_spec, source_event):
+    buff_spec = buffspecs.get_compiled_spec(buff_spec.buff_id)
+    propagation_triggers = buff_spec.propagation_triggers if buff_spec.propagates else ()
+    triggers = buff_spec.triggers
+
+    result = EventResult()
+    for buffable in buffables:
+        collector = metrics._collector
+        if collector is not None:
+            start_ns = time.perf_counter_ns()
+
+        copy_triggers(buff_spec.buff_id, propagation_triggers, buffable.propagation_triggers)
+        copy_triggers(buff_spec.buff_id, triggers, buffable.activation_triggers)
+        result.merge(call_event(AddBuffEvent(buffable, buff_spec.buff_id, source_event)))
+
+        # Recorded per buffable, as adding them one by one would
+        if collector is not None:
+            collector.observe(metrics.ADD_BUFF, buff_spec.buff_id, start_ns)
+    return result
 
 
 @strack_tracer.Track
@@ -77,15 +236,16 @@ def remove_buff(buffable, buff_id):
     """
     if buff_id in buffable.active_buffs:
 
-        buff_spec = buffspecs.get_buff_spec(buff_id)
-        if buffable.name in buff_spec.propagates_to:
+        buff_spec = buffspecs.get_compiled_spec(buff_id)
+        if buff_spec.propagates and buff_spec.is_target(buffable):
             raise BuffException(BuffErrorCodes.REMOVING_BUFF_NOT_FROM_SOURCE)
 
         del buffable.active_buffs[buff_id]
-        buff_spec = buffspecs.get_buff_spec(buff_id)
-        delete_triggers(buff_id, buff_spec.get_triggers(), buffable.activation_triggers)
-        delete_triggers(buff_id, buff_spec.get_propagation_triggers(), buffable.propagation_triggers)
-        delete_triggers(buff_id, buff_spec.get_remove_triggers(), buffable.deactivation_triggers)
+        unindex_propagated_derivations(buffable, buff_spec)
+        cancel_expiry_times(buffable, buff_id)
+        delete_triggers(buff_id, buff_spec.triggers, buffable.activation_triggers)
+        delete_triggers(buff_id, buff_spec.propagation_triggers, buffable.propagation_triggers)
+        delete_triggers(buff_id, buff_spec.remove_triggers, buffable.deactivation_triggers)
         for target in get_propagation_target_buffables_including_self(buffable, buff_spec):
             remove_all_buff_modifications(target, buff_spec)
 
@@ -102,13 +262,41 @@ def pull_propagated_buffs(source_buffable, destination_buffable, source_event):
     """
     event_results = []
     for buff_id in source_buffable.active_buffs:
-        buff_spec = buffspecs.get_buff_spec(buff_id)
+        buff_spec = buffspecs.get_compiled_spec(buff_id)
 
         # If the destination contains any buff that targets my buffable type and is auto triggered, propagate
-        if buff_spec.auto_triggers and destination_buffable.name in buff_spec.propagates_to:
+        if buff_spec.auto_triggers and buff_spec.propagates and buff_spec.is_target(destination_buffable):
             propagation_event = BuffPropagatedEvent(destination_buffable, source_buffable, buff_id, source_event)
+            collector = metrics._collector
+            if collector is not None and buff_spec.conditions:
+                collector.increment(metrics.CONDITIONS_EVALUATED, buff_id)
             if handle_event_conditions(propagation_event, buff_spec.conditions):
                 event_results.append(
                     add_buff(destination_buffable, buff_spec, propagation_event, propagated=True)
                 )
     return event_results
+
+
+@strack_tracer.Track
+def tick(now=None, max_buffables=None):
+    """ Expires all due buffs across buffables tracked by the global expiry scheduler.
+    Requires expiry.enable_global_expiry, so a game loop can spread expiry work instead of paying it when reading.
+
+    :param float now: Current timestamp, read from the clock if not given
+    :param int max_buffables: Max amount of buffables to process in this tick, the remaining ones wait for the next
+    :rtype list[EventResult]
+    :returns One event result per buffable that had buffs expired, containing the removed modifications
+    """
+    if now is None:
+        now = get_timestamp()
+
+    event_results = []
+    for buffable in get_due_buffables(now, max_buffables):
+        removed_modifications = expire_buffs(buffable, now)
+        # Its buffs might have been expired already by reading its attributes
+        if not removed_modifications:
+            continue
+        result = EventResult()
+        result.removed_modifications = removed_modifications
+        event_results.append(result)
+    return event_results
@@ -1,7 +1,17 @@
-import buffspecs
-
 from debug import strack_tracer
 
+# When deferred, applying modifiers only marks attributes as dirty and final values are calculated when read
+_deferred_calculation = False
+
+
+def set_deferred_calculation(deferred):
+    """ Toggles deferred calculation of attribute final values.
+
+    :param bool deferred:
+    """
+    global _deferred_calculation
+    _deferred_calculation = deferred
+
 
 def apply_attributes_modification(buffable_attributes, buff_modification):
     """ Applies a buff modification to attributes, calculating the final values.
@@ -29,6 +39,10 @@ def apply_attributes_modification(buffable_attributes, buff_modification):
     # This modification is stored in this attribute data history
     attribute_data.history[buff_modification.id] = buff_modification
 
+    # And indexed by its buff and stack
+    buff_stacks = buffable_attributes.buff_modifications.setdefault(buff_modification.buff_id, {})
+    buff_stacks.setdefault(buff_modification.stack_count, {})[buff_modification.id] = buff_modification
+
 
 def remove_attribute_modification(buffable_attributes, buff_modification):
     """ Removes a buff modification from attributes, calculating the final attributes and updating any required
@@ -47,27 +61,36 @@ def remove_attribute_modification(buffable_attributes, buff_modification):
     # And remove from history of that attribute
     del attr_data.history[buff_modification.id]
 
+    # The source attribute of a derivation should not link to this modification anymore
+    if buff_modification.derivated_modifier:
+        source_attribute_data = buffable_attributes.attribute_data[buff_modification.modifier.attribute_id]
+        source_attribute_data.derivations.remove_from_list(modifier.attribute_id, buff_modification.id)
+
+    # As well from the buff index, cleaning up empty stacks so the index only holds what is applied
+    buff_stacks = buffable_attributes.buff_modifications[buff_modification.buff_id]
+    stack_modifications = buff_stacks[buff_modification.stack_count]
+    del stack_modifications[buff_modification.id]
+    if not stack_modifications:
+        del buff_stacks[buff_modification.stack_count]
+        if not buff_stacks:
+            del buffable_attributes.buff_modifications[buff_modification.buff_id]
 
-def get_all_buff_modifications(buffable_attributes, buff_id):
+
+def get_all_buff_modifications(buffable_attributes, buff_id, stack=None):
     """ Gets all buff_modifications that buff is causing to attributes
 
     :param BuffableAttributes buffable_attributes:
     :param int buff_id:
+    :param int stack: When given, only the modifications of that specific stack
     :rtype: list[BuffModification]
     """
-    modifications = []
-    buff = buffspecs.get_buff_spec(buff_id)
-    for modifier in buff.modifiers:
-
-        # The changed attribute we looking for can be the derivated attribute or the modifier itself
-        # TODO: Make propagates_to_attribute works with to_attribute, could it be useful ?
-        affected_attribute_id = buff.to_attribute or buff.propagates_to_attribute or modifier.attribute_id
-
-        attr_data = buffable_attributes.attribute_data[affected_attribute_id]
-        for buff_modification in attr_data.history.values():
-            if buff_modification.buff_id == buff_id:
-                modifications.append(buff_modification)
-    return modifications
+    buff_stacks = buffable_attributes.buff_modifications.get(buff_id)
+    if not buff_stacks:
+        return []
+    if stack is not None:
+        return list(buff_stacks.get(stack, {}).values())
+    return [modification for stack_modifications in buff_stacks.values()
+            for modification in stack_modifications.values()]
 
 
 def _apply_modifier_to_attributes(buffable_attributes, modifier, inverse=False):
@@ -77,6 +100,7 @@ def _apply_modifier_to_attributes(buffable_attributes, modifier, inverse=False):
     :param Modifier modifier:
     :param bool inverse:
     :rtype int
+    :returns The final value of the attribute, or None when the calculation is deferred
     """
     attr_data = buffable_attributes.attribute_data[modifier.attribute_id]
     value = modifier.value if not inverse else -modifier.value
@@ -84,5 +108,10 @@ def _apply_modifier_to_attributes(buffable_attributes, modifier, inverse=False):
         attr_data.mod_add += value
     elif modifier.operator == "%":
         attr_data.mod_mult += value
+
+    if _deferred_calculation:
+        attr_data.dirty = True
+        return None
+
     attr_data.calculate()
     return attr_data.final_value
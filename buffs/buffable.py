@@ -1,16 +1,27 @@
 from debug import strack_tracer
 import buffspecs
+import metrics
 
-from models import BuffModification, ActiveBuff
+from models import BuffModification, ActiveBuff, AttributeColumns
 from utils.arrays import delete_triggers, copy_triggers
 
-from propagation import get_propagation_source, get_propagation_target_buffables_including_self
+from propagation import (
+    get_propagation_source, get_propagation_target_buffables_including_self, index_propagated_derivations,
+    unindex_propagated_derivations
+)
 from attributes import get_all_buff_modifications, remove_attribute_modification, apply_attributes_modification
 from derivation import create_derivation_modifier, update_derivated_attributes
-from expiry import get_timestamp, register_expiry_time, get_expired_buffs
+from expiry import get_timestamp, register_expiry_time, get_expired_buffs, cancel_expiry_times
 
 from errors import BuffErrorCodes, BuffException
 
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def create_buff_modifications(buffable, buff_id, source_event, current_stack=1):
     """ Generates a list of buff modifications a buff will have to apply a buffable.
@@ -24,7 +35,7 @@ def create_buff_modifications(buffable, buff_id, source_event, current_stack=1):
     :rtype: list[BuffModification]
     """
     modifications = []
-    buff_spec = buffspecs.get_buff_spec(buff_id)
+    buff_spec = buffspecs.get_compiled_spec(buff_id)
     for modifier in buff_spec.modifiers:
         buff_modification = BuffModification(modifier, source_event, buff_id)
 
@@ -54,14 +65,71 @@ def get_attributes(buffable):
     :param Buffable buffable:
     :rtype: BuffableAttributes
     """
-    for buff_spec in get_expired_buffs(buffable):
-        inactivate_buff(buffable, buff_spec, None)
+    if buffable.expiry_times:
+        expire_buffs(buffable, get_timestamp())
+    return buffable._attributes
+
+
+def get_attributes_batch(buffables, attribute_ids):
+    """ Reads the final values of the given attributes of many buffables at once, expiring buffs once per buffable.
+    Values are copied into columns and calculated as a single vectorized operation. Requires numpy.
+
+    :param list[Buffable] buffables:
+    :param list attribute_ids:
+    :rtype: numpy.ndarray
+    :returns A matrix of final values with one row per buffable and one column per attribute
+    """
+    if numpy is None:
+        raise ImportError("get_attributes_batch requires numpy")
+
+    now = get_timestamp()
+    mod_add = numpy.zeros((len(buffables), len(attribute_ids)))
+    mod_mult = numpy.zeros((len(buffables), len(attribute_ids)))
+
+    # Column indexes of the attributes for each attribute set, so array backed rows are copied in one go
+    column_indexes = {}
+
+    for row, buffable in enumerate(buffables):
+        if buffable.expiry_times:
+            expire_buffs(buffable, now)
+
+        attribute_data = buffable._attributes.attribute_data
+        if isinstance(attribute_data, AttributeColumns):
+            indexes = column_indexes.get(id(attribute_data.indexes))
+            if indexes is None:
+                indexes = numpy.array([attribute_data.indexes[attribute_id] for attribute_id in attribute_ids])
+                column_indexes[id(attribute_data.indexes)] = indexes
+            mod_add[row] = numpy.frombuffer(attribute_data.mod_add)[indexes]
+            mod_mult[row] = numpy.frombuffer(attribute_data.mod_mult)[indexes]
+        else:
+            for column, attribute_id in enumerate(attribute_ids):
+                # Not using the defaultdict item getter, reading should not create attributes
+                attribute = attribute_data.get(attribute_id)
+                if attribute is not None:
+                    mod_add[row, column] = attribute.mod_add
+                    mod_mult[row, column] = attribute.mod_mult
+
+    return mod_add * (1 + mod_mult)
+
+
+def expire_buffs(buffable, now):
+    """ Inactivates all buffs from the buffable that have expired by the given time.
+
+    :param Buffable buffable:
+    :param float now:
+    :rtype: list[ BuffModification ]
+    :returns All modifications removed by the expired buffs
+    """
+    modifications_removed = []
+    for expired_buff_spec in get_expired_buffs(buffable, now):
+        buff_spec = buffspecs.get_compiled_spec(expired_buff_spec.buff_id)
+        modifications_removed += inactivate_buff(buffable, buff_spec, None)
 
         # If this buff has not activation triggers he should never be activated again if expired
-        if not buff_spec.activation_triggers:
-            delete_triggers(buff_spec.buff_id, buff_spec.get_triggers(), buffable.activation_triggers)
+        if buff_spec.auto_triggers:
+            delete_triggers(buff_spec.buff_id, buff_spec.triggers, buffable.activation_triggers)
 
-    return buffable._attributes
+    return modifications_removed
 
 
 def has_reached_max_stacks(buffable, buff_spec):
@@ -86,24 +154,34 @@ def activate_buff(buffable, buff_spec, source_event):
     :param BuffEvent source_event:
     :rtype: list[ BuffModification ]
     """
+    collector = metrics._collector
+    if collector is not None:
+        start_ns = time.perf_counter_ns()
+
+    buff_spec = buffspecs.get_compiled_spec(buff_spec.buff_id)
     modifications = []
     if has_reached_max_stacks(buffable, buff_spec):
+        if collector is not None:
+            collector.observe(metrics.ACTIVATE_BUFF, buff_spec.buff_id, start_ns)
         return modifications
 
-    active_buff = buffable.active_buffs.get(buff_spec.buff_id) or ActiveBuff(buff_spec.buff_id, source_event)
-    buffable.active_buffs[buff_spec.buff_id] = active_buff
+    active_buff = buffable.active_buffs.get(buff_spec.buff_id)
+    if not active_buff:
+        active_buff = ActiveBuff(buff_spec.buff_id, source_event)
+        buffable.active_buffs[buff_spec.buff_id] = active_buff
+        index_propagated_derivations(buffable, buff_spec)
 
     # Remove the activation triggers because we just used em to activate this buff
-    delete_triggers(buff_spec.buff_id, buff_spec.get_triggers(), buffable.activation_triggers)
+    delete_triggers(buff_spec.buff_id, buff_spec.triggers, buffable.activation_triggers)
 
     active_buff.stack += 1
 
-    if buff_spec.can_target(buffable.name):
+    if buff_spec.can_target(buffable):
 
         # Just in case this is the first stack
         if active_buff.stack == 1:
             # Copy the remove triggers so this buff could potentially be inactivated
-            copy_triggers(buff_spec.buff_id, buff_spec.get_remove_triggers(), buffable.deactivation_triggers)
+            copy_triggers(buff_spec.buff_id, buff_spec.remove_triggers, buffable.deactivation_triggers)
 
         # Add an expiry time if needed
         register_expiry_time(buffable, buff_spec)
@@ -116,6 +194,9 @@ def activate_buff(buffable, buff_spec, source_event):
             apply_attributes_modification(buffable.attributes, modification)
             update_derivated_attributes(buffable, modification.applied_modifier.attribute_id)
 
+    if collector is not None:
+        collector.observe(metrics.ACTIVATE_BUFF, buff_spec.buff_id, start_ns)
+        collector.increment(metrics.MODIFICATIONS_ADDED, buff_spec.buff_id, len(modifications))
     return modifications
 
 
@@ -127,11 +208,16 @@ def inactivate_buff(buffable, buff_spec, source_event):
     :param BuffEvent source_event:
     :rtype: list[ BuffModification ]
     """
+    collector = metrics._collector
+    if collector is not None:
+        start_ns = time.perf_counter_ns()
+
+    buff_spec = buffspecs.get_compiled_spec(buff_spec.buff_id)
 
     only_remove_stack = None
 
     # Code should only remove 1 stack if im the owner of the buff (propagates and im not a target)
-    if not buff_spec.propagates or not buff_spec.can_target(buffable.name):
+    if not buff_spec.propagates or not buff_spec.can_target(buffable):
         only_remove_stack = buffable.active_buffs[buff_spec.buff_id].stack
 
     modifications_removed = []
@@ -143,11 +229,16 @@ def inactivate_buff(buffable, buff_spec, source_event):
     # In case there are no stacks left, buff becomes inactive
     if buffable.active_buffs[buff_spec.buff_id].stack == 0:
         del buffable.active_buffs[buff_spec.buff_id]
-        delete_triggers(buff_spec.buff_id, buff_spec.get_remove_triggers(), buffable.deactivation_triggers)
+        unindex_propagated_derivations(buffable, buff_spec)
+        cancel_expiry_times(buffable, buff_spec.buff_id)
+        delete_triggers(buff_spec.buff_id, buff_spec.remove_triggers, buffable.deactivation_triggers)
 
-        if buff_spec.can_be_reactivated():
-            copy_triggers(buff_spec.buff_id, buff_spec.get_triggers(), buffable.activation_triggers)
+        if buff_spec.can_be_reactivated:
+            copy_triggers(buff_spec.buff_id, buff_spec.triggers, buffable.activation_triggers)
 
+    if collector is not None:
+        collector.observe(metrics.INACTIVATE_BUFF, buff_spec.buff_id, start_ns)
+        collector.increment(metrics.MODIFICATIONS_REMOVED, buff_spec.buff_id, len(modifications_removed))
     return modifications_removed
 
 
@@ -160,11 +251,10 @@ def remove_all_buff_modifications(buffable, buff_spec, specific_stack=None):
     :return:
     """
     modifications_removed = []
-    modifications_to_remove = get_all_buff_modifications(buffable.attributes, buff_spec.buff_id)
+    modifications_to_remove = get_all_buff_modifications(buffable.attributes, buff_spec.buff_id, specific_stack)
     for modification in modifications_to_remove:
-        if specific_stack is None or modification.stack_count == specific_stack:
-            remove_attribute_modification(buffable.attributes, modification)
-            update_derivated_attributes(buffable, modification.applied_modifier.attribute_id)
-            modifications_removed.append(modification)
+        remove_attribute_modification(buffable.attributes, modification)
+        update_derivated_attributes(buffable, modification.applied_modifier.attribute_id)
+        modifications_removed.append(modification)
     return modifications_removed
 
@@ -1,5 +1,57 @@
 from collections import defaultdict
 from functools import wraps
+import weakref
+
+from errors import BuffException, BuffErrorCodes
+
+
+class TypeRegistry(object):
+    """ Gives classes small integer type ids, cached on each class under the given attribute name.
+    Classes with the same name get different ids, so their name can't be resolved anymore.
+    Names of classes not created yet reserve an id that the class will take once registered.
+    A class declaring its own id keeps it, the buff lib events do so to be found by name.
+    """
+    def __init__(self, id_attribute):
+        self.id_attribute = id_attribute
+        # Classes indexed by their type id, None for ids that were only reserved by name so far
+        self.types = []
+        # Map of class name to the type id names resolve to
+        self.names = {}
+        # Names of more than one registered class
+        self.ambiguous_names = set()
+
+    def register(self, type_class):
+        type_id = type_class.__dict__.get(self.id_attribute)
+        if type_id is None:
+            type_id = self.names.get(type_class.__name__)
+            if type_id is None or self.types[type_id] is not None:
+                if type_id is not None:
+                    self.ambiguous_names.add(type_class.__name__)
+                type_id = self._new_type_id()
+                self.names.setdefault(type_class.__name__, type_id)
+            setattr(type_class, self.id_attribute, type_id)
+        if self.types[type_id] is None:
+            self.types[type_id] = type_class
+        return type_id
+
+    def get_type_id(self, type_class_or_name):
+        """
+        :param type|str type_class_or_name:
+        :rtype: int
+        :raises BuffException: AMBIGUOUS_TYPE_NAME if more than one class has this name
+        """
+        if not isinstance(type_class_or_name, str):
+            return getattr(type_class_or_name, self.id_attribute)
+        if type_class_or_name in self.ambiguous_names:
+            raise BuffException(BuffErrorCodes.AMBIGUOUS_TYPE_NAME)
+        type_id = self.names.get(type_class_or_name)
+        if type_id is None:
+            type_id = self.names[type_class_or_name] = self._new_type_id()
+        return type_id
+
+    def _new_type_id(self):
+        self.types.append(None)
+        return len(self.types) - 1
 
 
 class SpecCache(object):
@@ -8,10 +60,22 @@ class SpecCache(object):
         self.buff_specs = {}
         # Map of condition names (function names) and the function reference
         self.conditions = {}
-        # Map of propagator to propagable and the propagation function
+        # Map of buff_id to the compiled runtime form of its spec, dropped when its conditions might have changed
+        self.compiled_specs = {}
+        # Map of (propagator type id, propagable type id) and the propagation functions
         self.propagation_map = defaultdict(list)
-        # Map of target buffable class and the list of buffables
-        self.propagation_contexts = {}
+        # Map of buffable to its cached propagation targets per target type id, None when not caching
+        self.propagation_targets = None
+        # Map of closed attribute sets to a map of attribute and its column index
+        self.attribute_sets = {}
+        # Map of buff_id to the (source attribute, derivated attribute) edges its derivations create
+        self.derivation_edges = {}
+        # Map of source attribute to a map of derivated attribute and the amount of buffs deriving it, of all specs
+        self.derivation_graph = defaultdict(dict)
+        # Type ids of event classes, used as trigger keys
+        self.event_types = TypeRegistry("event_type_id")
+        # Type ids of buffable classes, used to target propagations
+        self.buffable_types = TypeRegistry("buffable_type_id")
 
 
 _cache = SpecCache()
@@ -19,6 +83,9 @@ _cache = SpecCache()
 
 def clear():
     _cache.buff_specs = {}
+    _cache.compiled_specs = {}
+    _cache.derivation_edges = {}
+    _cache.derivation_graph = defaultdict(dict)
 
 
 #################
@@ -26,15 +93,203 @@ def clear():
 #################
 
 def register_buff(buff_spec):
+    # The spec might have changed since the last registration, it will be compiled again on first use
+    register_derivations(buff_spec)
     _cache.buff_specs[buff_spec.buff_id] = buff_spec
+    _cache.compiled_specs.pop(buff_spec.buff_id, None)
+
+
+def compile_buff(buff_spec):
+    """ Freezes a buff spec and compiles it into its runtime form. Buff specs are compiled on first use, so
+    there's no need to call this from game code.
+    Its derivations are checked again, the spec might have changed since it was registered.
+
+    :param BuffSpec buff_spec:
+    :rtype: CompiledBuffSpec
+    :raises BuffException: DERIVATION_LOOP if the derivations would create a loop with the registered specs
+    """
+    register_derivations(buff_spec)
+    compiled = CompiledBuffSpec(buff_spec)
+    buff_spec.freeze()
+    _cache.compiled_specs[buff_spec.buff_id] = compiled
+    return compiled
+
+
+def finalize():
+    """ Compiles all registered buff specs, so the first buff calls don't pay for it.
+    Registered specs can't be changed anymore after this.
+    """
+    for buff_spec in list(_cache.buff_specs.values()):
+        if buff_spec.buff_id not in _cache.compiled_specs:
+            compile_buff(buff_spec)
+
+
+def get_compiled_spec(buff_id):
+    """ Gets the runtime form of a registered buff spec, compiling it on first use.
+
+    :param int buff_id:
+    :rtype: CompiledBuffSpec
+    """
+    compiled = _cache.compiled_specs.get(buff_id)
+    if compiled is None:
+        compiled = compile_buff(_cache.buff_specs[buff_id])
+    return compiled
+
+
+def register_derivations(buff_spec):
+    """ Adds the derivations of a buff spec to the derivation graph of all specs, refusing derivation loops.
+    Only the paths starting from the new derivations are walked, so registering many specs stays linear.
+
+    :param BuffSpec buff_spec:
+    :raises BuffException: DERIVATION_LOOP if the derivations would create a loop with the registered specs
+    """
+    edges = []
+    if buff_spec.to_attribute:
+        edges = [(modifier.attribute_id, buff_spec.to_attribute) for modifier in buff_spec.modifiers]
+
+    old_edges = _cache.derivation_edges.get(buff_spec.buff_id, [])
+    if edges == old_edges:
+        return
+
+    _remove_derivation_edges(old_edges)
+    for index, (source_attribute_id, derivated_attribute_id) in enumerate(edges):
+        # Adding source -> derivated creates a loop if the source can already be reached from the derivated attribute
+        if _is_reachable(derivated_attribute_id, source_attribute_id):
+            _remove_derivation_edges(edges[:index])
+            _add_derivation_edges(old_edges)
+            raise BuffException(BuffErrorCodes.DERIVATION_LOOP)
+        _add_derivation_edges([(source_attribute_id, derivated_attribute_id)])
+
+    if edges:
+        _cache.derivation_edges[buff_spec.buff_id] = edges
+    else:
+        _cache.derivation_edges.pop(buff_spec.buff_id, None)
+
+
+def _add_derivation_edges(edges):
+    graph = _cache.derivation_graph
+    for source_attribute_id, derivated_attribute_id in edges:
+        derivated_attributes = graph[source_attribute_id]
+        derivated_attributes[derivated_attribute_id] = derivated_attributes.get(derivated_attribute_id, 0) + 1
+
+
+def _remove_derivation_edges(edges):
+    graph = _cache.derivation_graph
+    for source_attribute_id, derivated_attribute_id in edges:
+        derivated_attributes = graph[source_attribute_id]
+        derivated_attributes[derivated_attribute_id] -= 1
+        if not derivated_attributes[derivated_attribute_id]:
+            del derivated_attributes[derivated_attribute_id]
+
+
+def _is_reachable(from_attribute_id, to_attribute_id):
+    graph = _cache.derivation_graph
+    to_visit = [from_attribute_id]
+    visited = set()
+    while to_visit:
+        attribute_id = to_visit.pop()
+        if attribute_id == to_attribute_id:
+            return True
+        if attribute_id not in visited:
+            visited.add(attribute_id)
+            to_visit.extend(graph.get(attribute_id, ()))
+    return False
+
+
+####################
+# REGISTERED TYPES #
+####################
+
+def register_event_type(event_class):
+    """ Gives an event class a small integer type id, cached on the class as event_type_id.
+    Events are registered when their class is created, so there's no need to call this from game code.
+
+    :param type event_class:
+    :rtype: int
+    """
+    return _cache.event_types.register(event_class)
+
+
+def get_event_type_id(event_type):
+    """ Obtains the type id of an event class or of an event class name, used when loading specs from data.
+
+    :param type|str event_type:
+    :rtype: int
+    :raises BuffException: AMBIGUOUS_TYPE_NAME if more than one event class has this name
+    """
+    return _cache.event_types.get_type_id(event_type)
+
+
+def get_event_type_ids(event_types):
+    return [get_event_type_id(event_type) for event_type in event_types]
+
+
+def register_buffable_type(buffable_class):
+    """ Gives a buffable class a small integer type id, cached on the class as buffable_type_id.
+    The class also caches buffable_type_ids, its id followed by the ids of its buffable base classes, and
+    buffable_type_mask, with the bits of all those ids, so buffs targeting a class also target its subclasses.
+    Buffables are registered when their class is created, so there's no need to call this from game code.
+
+    :param type buffable_class:
+    :rtype: int
+    """
+    type_id = _cache.buffable_types.register(buffable_class)
+    type_ids = [type_id]
+    for base_class in buffable_class.__mro__[1:]:
+        base_type_id = base_class.__dict__.get("buffable_type_id")
+        if base_type_id is not None:
+            type_ids.append(base_type_id)
+    buffable_class.buffable_type_ids = tuple(type_ids)
+    buffable_class.buffable_type_mask = get_type_mask(type_ids)
+    return type_id
+
+
+def get_buffable_type_id(buffable_type):
+    """ Obtains the type id of a buffable class or of a buffable class name, used when loading specs from data.
+
+    :param type|str buffable_type:
+    :rtype: int
+    :raises BuffException: AMBIGUOUS_TYPE_NAME if more than one buffable class has this name
+    """
+    return _cache.buffable_types.get_type_id(buffable_type)
+
+
+def get_type_mask(type_ids):
+    mask = 0
+    for type_id in type_ids:
+        mask |= 1 << type_id
+    return mask
 
 
 def register_condition_function(condition_function, event_class=None, buffable_class=None):
     _cache.conditions[condition_function.__name__] = condition_function
+    # Compiled specs bound the previous condition functions
+    _cache.compiled_specs = {}
 
 
 def register_propagation_function(propagation_function, from_class, to_class):
-    _cache.propagation_map[from_class.__name__].append((to_class.__name__, propagation_function))
+    _cache.propagation_map[(get_buffable_type_id(from_class), get_buffable_type_id(to_class))].append(
+        propagation_function
+    )
+    invalidate_propagation()
+
+
+def register_attribute_set(attribute_set):
+    """ Registers a closed set of attributes, like an Enum, mapping each attribute to a column index.
+
+    :param iterable attribute_set:
+    :rtype: dict
+    """
+    indexes = {attribute_id: index for index, attribute_id in enumerate(attribute_set)}
+    _cache.attribute_sets[attribute_set] = indexes
+    return indexes
+
+
+def get_attribute_indexes(attribute_set):
+    indexes = _cache.attribute_sets.get(attribute_set)
+    if indexes is None:
+        indexes = register_attribute_set(attribute_set)
+    return indexes
 
 
 def get_buff_spec(buff_id):
@@ -53,14 +308,96 @@ def get_condition(condition_spec_string):
     return condition_function, condition_args, should_be_true
 
 
-def get_propagation_targets(buffable, target_class_name):
-    targets = []
-    for class_name, get_targets_function in _cache.propagation_map[buffable.__class__.__name__]:
-        if class_name == target_class_name:
-            targets += get_targets_function(buffable)
+def compile_condition(condition_spec_string):
+    """ Parses a condition string once into a callable that only needs the event to be evaluated.
+
+    :param str condition_spec_string:
+    :rtype: CompiledCondition
+    """
+    return CompiledCondition(*get_condition(condition_spec_string))
+
+
+def get_compiled_conditions(buff_spec, propagation=False):
+    """ Gets the compiled activation (or propagation) conditions of a buff spec.
+
+    :param BuffSpec buff_spec:
+    :param bool propagation: If we want the propagation conditions instead of the activation conditions
+    :rtype: tuple[CompiledCondition]
+    """
+    compiled = get_compiled_spec(buff_spec.buff_id)
+    if propagation:
+        return compiled.propagation_conditions
+    return compiled.conditions
+
+
+def get_propagation_targets(buffable, target_type_id):
+    """ Gets the buffables of a given type a buffable propagates to. When caching propagation targets, the
+    returned list is shared and should not be changed.
+
+    :param Buffable buffable:
+    :param int target_type_id:
+    :rtype: list[Buffable]
+    """
+    cache = _cache.propagation_targets
+    if cache is None:
+        return _find_propagation_targets(buffable, target_type_id)
+
+    buffable_targets = cache.get(buffable)
+    if buffable_targets is None:
+        buffable_targets = cache[buffable] = {}
+    targets = buffable_targets.get(target_type_id)
+    if targets is None:
+        targets = buffable_targets[target_type_id] = _find_propagation_targets(buffable, target_type_id)
     return targets
 
 
+def _find_propagation_targets(buffable, target_type_id):
+    # Propagation functions registered for base classes of the propagator apply to it as well.
+    # Without functions registered for the target class, the ones for its closest base class are used, keeping only
+    # the instances of the target class
+    target_class = _cache.buffable_types.types[target_type_id]
+    function_target_type_ids = target_class.buffable_type_ids if target_class is not None else (target_type_id,)
+    for function_target_type_id in function_target_type_ids:
+        targets = []
+        found_functions = False
+        for source_type_id in buffable.buffable_type_ids:
+            for get_targets_function in _cache.propagation_map.get((source_type_id, function_target_type_id), ()):
+                found_functions = True
+                targets += get_targets_function(buffable)
+        if found_functions:
+            if function_target_type_id != target_type_id:
+                target_mask = 1 << target_type_id
+                targets = [target for target in targets if target.buffable_type_mask & target_mask]
+            return targets
+    return []
+
+
+def set_propagation_cache(enabled):
+    """ Toggles caching propagation targets per buffable. While caching, game code has to call
+    invalidate_propagation whenever an ownership or membership used by a propagation function changes.
+
+    :param bool enabled:
+    """
+    if not enabled:
+        _cache.propagation_targets = None
+    elif _cache.propagation_targets is None:
+        _cache.propagation_targets = weakref.WeakKeyDictionary()
+
+
+def invalidate_propagation(buffable=None):
+    """ Drops the cached propagation targets of a buffable, or of every buffable if none is given.
+
+    :param Buffable buffable:
+    """
+    cache = _cache.propagation_targets
+    if cache is None:
+        return
+    if buffable is None:
+        cache.clear()
+    else:
+        cache.pop(buffable, None)
+
+
 #####################
 # INTEGRATION SUGAR #
 #####################
@@ -85,20 +422,96 @@ def AddPropagation(from_class, to_class):
     return decorator
 
 
+class CompiledCondition(object):
+    """ A condition string already parsed, with its function and arguments bound. """
+    def __init__(self, condition_function, condition_args, should_be_true):
+        self.condition_function = condition_function
+        self.condition_args = condition_args
+        self.should_be_true = should_be_true
+
+    def __call__(self, event):
+        return self.condition_function(event, *self.condition_args) == self.should_be_true
+
+
+class CompiledBuffSpec(object):
+    """ Immutable runtime form of a buff spec, with triggers resolved to event type ids, conditions bound to their
+    functions, targets resolved to a mask of buffable type ids, and every other derived field precomputed.
+    """
+    __slots__ = (
+        "buff_id", "name", "modifiers", "to_attribute", "propagates_to_attribute", "max_stack", "duration_seconds",
+        "triggers", "remove_triggers", "propagation_triggers", "auto_triggers", "auto_propagates", "propagates",
+        "can_be_reactivated", "conditions", "propagation_conditions", "target_type_ids", "target_mask"
+    )
+
+    def __init__(self, buff_spec):
+        set_field = super(CompiledBuffSpec, self).__setattr__
+        set_field("buff_id", buff_spec.buff_id)
+        set_field("name", buff_spec.name)
+        set_field("modifiers", tuple(buff_spec.modifiers))
+        set_field("to_attribute", buff_spec.to_attribute)
+        set_field("propagates_to_attribute", buff_spec.propagates_to_attribute)
+        set_field("max_stack", buff_spec.max_stack)
+        set_field("duration_seconds", buff_spec.duration_seconds)
+
+        # Buffs without triggers are triggered as soon as they are added
+        add_buff_triggers = (get_event_type_id("AddBuffEvent"),)
+        activation_triggers = tuple(get_event_type_ids(buff_spec.activation_triggers))
+        deactivation_triggers = tuple(get_event_type_ids(buff_spec.deactivation_triggers))
+        propagation_triggers = tuple(get_event_type_ids(buff_spec.propagation_triggers))
+        set_field("triggers", activation_triggers or add_buff_triggers)
+        # If i have conditions by default my remove trigger is the activation trigger
+        if buff_spec.conditions and not deactivation_triggers:
+            set_field("remove_triggers", activation_triggers)
+        else:
+            set_field("remove_triggers", deactivation_triggers)
+        set_field("propagation_triggers", propagation_triggers or add_buff_triggers)
+        set_field("auto_triggers", not activation_triggers)
+        set_field("auto_propagates", not propagation_triggers)
+
+        set_field("conditions", tuple(compile_condition(condition) for condition in buff_spec.conditions))
+        set_field("propagation_conditions", tuple(
+            compile_condition(condition) for condition in buff_spec.propagation_conditions
+        ))
+        set_field("can_be_reactivated", bool(buff_spec.conditions or deactivation_triggers))
+
+        set_field("target_type_ids", tuple(
+            get_buffable_type_id(buffable_type) for buffable_type in buff_spec.propagates_to
+        ))
+        set_field("target_mask", get_type_mask(self.target_type_ids))
+        set_field("propagates", bool(self.target_type_ids))
+
+    def __setattr__(self, name, value):
+        raise BuffException(BuffErrorCodes.SPEC_FROZEN)
+
+    def can_target(self, buffable):
+        return not self.propagates or self.is_target(buffable)
+
+    def is_target(self, buffable):
+        return bool(self.target_mask & buffable.buffable_type_mask)
+
+
 class ConditionHandlerContext(object):
     def __init__(self, condition_handler):
         self.condition_handler = condition_handler
 
 
 class PropagationTargets(object):
-    def __init__(self, targets):
-        self.targets = targets
+    """ Caches propagation targets while in context, for code that does not change ownership or membership
+    inside of it. If caching was already enabled it is kept as it is.
+    """
+    def __init__(self):
+        self.owns_cache = False
 
     def __enter__(self):
-        _cache.propagation_contexts[self.buffable_class] = self.buffable_instances
+        if _cache.propagation_targets is None:
+            self.owns_cache = True
+            set_propagation_cache(True)
+        return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        del _cache.propagation_contexts[self.buffable_class]
+        if self.owns_cache:
+            set_propagation_cache(False)
+            self.owns_cache = False
 
 
 # TODO: JUST FOR TESTS... MOVE TO TESTS !
@@ -3,8 +3,38 @@ from models import Modifier
 
 from debug import strack_tracer
 import buffspecs
+import metrics
 
 from propagation import get_propagated_targets_of_given_attribute, get_propagation_source
+from errors import BuffException, BuffErrorCodes
+
+import time
+
+
+# While batching, derivation updates are queued once per (buffable, attribute) until the batch is flushed
+_pending_updates = None
+
+
+def start_derivation_batch():
+    """ Starts queueing derivation updates instead of applying them.
+
+    :rtype: bool
+    :returns If a new batch was started, False if there was one already
+    """
+    global _pending_updates
+    if _pending_updates is not None:
+        return False
+    _pending_updates = {}
+    return True
+
+
+def flush_derivation_batch():
+    """ Stops queueing derivation updates and applies the queued ones, once per buffable attribute.
+    """
+    global _pending_updates
+    pending_updates, _pending_updates = _pending_updates, None
+    for buffable, source_attribute_id in pending_updates or ():
+        update_derivated_attributes(buffable, source_attribute_id)
 
 
 def create_derivation_modifier(buffable_attributes, modifier, to_attribute_id):
@@ -34,54 +64,156 @@ def update_derivated_attributes(buffable, source_attribute_id):
     :param BuffableAttribute buffable_attributes:
     :param int source_attribute_id:  The attribute source of the derivations
     """
+    if _pending_updates is not None:
+        _pending_updates[(buffable, source_attribute_id)] = None
+        return
 
     # Check if the current buffable has any derivations based on the changing attribute
     _recalculate_derivated_values_from_attribute(buffable, source_attribute_id)
 
     # Check if i have any propagations that affect this attribute and update the target buffable
     for buffable_target in get_propagated_targets_of_given_attribute(buffable, source_attribute_id):
-        _recalculate_derivated_values_from_attribute(buffable_target, source_attribute_id)
+        _recalculate_propagated_derivated_values(buffable_target, source_attribute_id)
+
+
+def _recalculate_propagated_derivated_values(buffable, source_attribute_id):
+    """ Recalculates the derivations a buffable recieved by propagation from the source attribute of the propagator,
+    then the derivations of the buffable own attributes that changed because of them.
+
+    :param Buffable buffable:  The propagation target
+    :param int source_attribute_id:  The attribute of the propagator that changed
+    """
+    changed_attribute_ids = set()
+    for modification in list(_get_modifications_derived_by_attribute(buffable.attributes, source_attribute_id)):
+        if _is_propagated_derivation(modification) and _recalculate_derivated_modification(buffable, modification):
+            changed_attribute_ids.add(modification.derivated_modifier.attribute_id)
+
+    for attribute_id in changed_attribute_ids:
+        _recalculate_derivated_values_from_attribute(buffable, attribute_id)
 
 
 def _recalculate_derivated_values_from_attribute(buffable, source_attribute_id):
     """ For existing derivated modifications on the buffable that are based on the source attribute ID,
     Recalculate the derivation modifiers by removing and re-appliyng them, updating the derivated values.
+    Derivated attributes are visited in topological order, so each one is only recalculated once, after all of its
+    changed sources.
 
     :param Buffable buffable:
     :param int source_attribute_id:  The attribute that changed
     """
+    buffable_attributes = buffable.attributes
+    changed_attribute_ids = {source_attribute_id}
+    for attribute_id in _get_derivation_order(buffable_attributes, source_attribute_id):
+        if attribute_id not in changed_attribute_ids:
+            continue
 
-    # Get all modifications this attribute we are changing derivates to on this buffable
-    for modification in _get_modifications_derived_by_attribute(buffable.attributes, source_attribute_id):
-
-        # In case this modification is a derivation from a propagation, we need to calculate the derived value
-        # with basis on the source buffable attributes
-        buff_spec = buffspecs.get_buff_spec(modification.buff_id)
-        buffable_propagator = buffable
-        if buff_spec.propagates_to_attribute:
-            buffable_propagator = get_propagation_source(modification.source_event)
+        # Get all modifications this attribute we are changing derivates to on this buffable
+        for modification in list(_get_modifications_derived_by_attribute(buffable_attributes, attribute_id)):
+            # Propagated derivations come from the propagator attribute, not from this one
+            if _is_propagated_derivation(modification):
+                continue
+            if _recalculate_derivated_modification(buffable, modification):
+                changed_attribute_ids.add(modification.derivated_modifier.attribute_id)
 
-        # Recalculate the derivated value
-        new_derivated_modifier = create_derivation_modifier(
-            buffable_propagator.attributes, modification.modifier, modification.derivated_modifier.attribute_id
-        )
 
-        # Keeping track of old derivated value because we will need to check it changed
-        old_derivated_value = modification.derivated_modifier.value
+def _is_propagated_derivation(modification):
+    return bool(buffspecs.get_compiled_spec(modification.buff_id).propagates_to_attribute)
 
-        if old_derivated_value != new_derivated_modifier.value:
 
-            # Undo the changes, just apply inversed
-            _apply_modifier_to_attributes(buffable.attributes, modification.derivated_modifier, inverse=True)
+def _recalculate_derivated_modification(buffable, modification):
+    """ Recalculates the derivated value of a modification, re-applying it if the value changed.
 
-            # Apply again with updated modifier
-            _apply_modifier_to_attributes(buffable.attributes, new_derivated_modifier)
+    :param Buffable buffable:
+    :param BuffModification modification:
+    :rtype: bool
+    :returns If the derivated value changed
+    """
+    collector = metrics._collector
+    if collector is not None:
+        start_ns = time.perf_counter_ns()
+
+    # In case this modification is a derivation from a propagation, we need to calculate the derived value
+    # with basis on the source buffable attributes
+    buff_spec = buffspecs.get_compiled_spec(modification.buff_id)
+    buffable_propagator = buffable
+    if buff_spec.propagates_to_attribute:
+        buffable_propagator = get_propagation_source(modification.source_event)
+
+    # Recalculate the derivated value
+    new_derivated_modifier = create_derivation_modifier(
+        buffable_propagator.attributes, modification.modifier, modification.derivated_modifier.attribute_id
+    )
+
+    # Keeping track of old derivated value because we will need to check it changed
+    old_derivated_value = modification.derivated_modifier.value
+    if old_derivated_value == new_derivated_modifier.value:
+        if collector is not None:
+            collector.observe(metrics.DERIVATION, modification.buff_id, start_ns)
+        return False
+
+    # Undo the changes, just apply inversed
+    _apply_modifier_to_attributes(buffable.attributes, modification.derivated_modifier, inverse=True)
+
+    # Apply again with updated modifier
+    _apply_modifier_to_attributes(buffable.attributes, new_derivated_modifier)
+
+    # The final modifier of the derivated value is stored in derivated modifier, keeping the original intact
+    modification.derivated_modifier = new_derivated_modifier
+    if collector is not None:
+        collector.observe(metrics.DERIVATION, modification.buff_id, start_ns)
+    return True
+
+
+def _get_derivation_order(buffable_attributes, source_attribute_id):
+    """ Gets the source attribute and all attributes derivated from it on the buffable, directly or not, in
+    topological order. Propagated derivations are not followed, their source is an attribute of the propagator.
 
-            # The final modifier of the derivated value is stored in derivated modifier, keeping the original intact
-            modification.derivated_modifier = new_derivated_modifier
+    :param BuffableAttributes buffable_attributes:
+    :param int source_attribute_id:
+    :rtype: list
+    :raises BuffException: DERIVATION_LOOP if an attribute ends up derivating from itself
+    """
+    post_order = []
+    visiting = {source_attribute_id}
+    visited = set()
+
+    # Iterative depth first search, each stack entry is an attribute and an iterator of its derivated attributes
+    stack = [(source_attribute_id, iter(_get_derivated_attribute_ids(buffable_attributes, source_attribute_id)))]
+    while stack:
+        attribute_id, derivated_attribute_ids = stack[-1]
+        for derivated_attribute_id in derivated_attribute_ids:
+            if derivated_attribute_id in visiting:
+                raise BuffException(BuffErrorCodes.DERIVATION_LOOP)
+            if derivated_attribute_id not in visited:
+                visiting.add(derivated_attribute_id)
+                derivated_ids = _get_derivated_attribute_ids(buffable_attributes, derivated_attribute_id)
+                stack.append((derivated_attribute_id, iter(derivated_ids)))
+                break
+        else:
+            stack.pop()
+            visiting.discard(attribute_id)
+            visited.add(attribute_id)
+            post_order.append(attribute_id)
+
+    post_order.reverse()
+    return post_order
+
+
+def _get_derivated_attribute_ids(buffable_attributes, source_attribute_id):
+    """ Gets the attributes of the buffable that have derivations from its own source attribute.
 
-            # Since we changed an attribute, we need to chain derivation modifiers recalculation
-            _recalculate_derivated_values_from_attribute(buffable, new_derivated_modifier.attribute_id)
+    :param BuffableAttributes buffable_attributes:
+    :param int source_attribute_id:
+    :rtype: list
+    """
+    derivated_attribute_ids = []
+    for target_attribute_id, modification_ids in buffable_attributes.get_derivations(source_attribute_id).items():
+        history = buffable_attributes.get_data(target_attribute_id).history
+        for modification_id in modification_ids:
+            if not _is_propagated_derivation(history[modification_id]):
+                derivated_attribute_ids.append(target_attribute_id)
+                break
+    return derivated_attribute_ids
 
 
 @strack_tracer.Track
@@ -93,7 +225,6 @@ def _get_modifications_derived_by_attribute(buffable_attributes, source_attribut
     :param int source_attribute_id:
     :rtype: generator[BuffModification]
     """
-    attribute_data = buffable_attributes.get_data(source_attribute_id)
-    for target_attribute_id, modification_ids in attribute_data.derivations.items():
+    for target_attribute_id, modification_ids in buffable_attributes.get_derivations(source_attribute_id).items():
         for modification_id in modification_ids:
             yield buffable_attributes.get_data(target_attribute_id).history[modification_id]
\ No newline at end of file
@@ -1,5 +1,6 @@
 
 import buffspecs
+import metrics
 from debug import strack_tracer
 
 
@@ -10,14 +11,24 @@ def get_buff_specs_triggered_by_event(event, possible_trigger_list, condition_in
     first one is processed to evaluate possible condition changes, allowing buff dependency out of the box.
 
     :param BuffEvent event:
-    :param dict[str, list [ int ]] possible_trigger_list:  A dictionary of triggers to a list of buffs ids to trigger
+    :param dict[int, dict [ int ]] possible_trigger_list:  A dictionary of event type ids to the buffs ids to trigger
     :param bool condition_inverse:
     :param bool propagation:
-    :rtype: generator[BuffSpec]
+    :rtype: generator[CompiledBuffSpec]
     """
-    for buff_id in reversed(possible_trigger_list[event.get_name()]):
-        buff_spec = buffspecs.get_buff_spec(buff_id)
-        conditions = buff_spec.conditions if not propagation else buff_spec.propagation_conditions
+    buff_ids = possible_trigger_list.get(event.event_type_id)
+    if not buff_ids:
+        return
+
+    # Triggers can be added or removed while the buffs are processed, so we go through a copy of them
+    for buff_id in reversed(list(buff_ids)):
+        if buff_id not in buff_ids:
+            continue
+        buff_spec = buffspecs.get_compiled_spec(buff_id)
+        conditions = buff_spec.propagation_conditions if propagation else buff_spec.conditions
+        collector = metrics._collector
+        if collector is not None and conditions:
+            collector.increment(metrics.CONDITIONS_EVALUATED, buff_id)
         if handle_event_conditions(event, conditions) is not condition_inverse:
             yield buff_spec
 
@@ -26,11 +37,10 @@ def handle_event_conditions(event, conditions):
     """ Check if all conditions match for a given event.
 
     :param BuffEvent event:
-    :param list[str] conditions:
+    :param tuple[CompiledCondition] conditions:
     :rtype bool
     """
     for condition in conditions:
-        condition_function, condition_args, should_be_true = buffspecs.get_condition(condition)
-        if not condition_function(event, *condition_args) == should_be_true:
+        if not condition(event):
             return False
     return True
\ No newline at end of file
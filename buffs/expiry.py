@@ -2,8 +2,10 @@ import buffspecs
 
 from debug import strack_tracer
 
+import heapq
+import itertools
 import time
-import sys
+import weakref
 
 
 def register_expiry_time(buffable, buff_spec):
@@ -14,20 +16,67 @@ def register_expiry_time(buffable, buff_spec):
     """
     if buff_spec.duration_seconds != -1:
         now = get_timestamp()
-        expires_at = now + buff_spec.duration_seconds
-        _add_expiry_time_to_fifo_list(buffable, expires_at, buff_spec.buff_id)
+        add_expiry_time(buffable, buff_spec.buff_id, now + buff_spec.duration_seconds)
 
 
-def get_expired_buffs(buffable):
-    """ Get a generator of all buffs that already have expired and removes them from the expiry list.
+def add_expiry_time(buffable, buff_id, expires_at):
+    """ Registers when a buff of this buffable expires, also in the global scheduler if it is enabled.
 
     :param Buffable buffable:
-    :rtype: generator[BuffSpec]
+    :param int buff_id:
+    :param float expires_at:
+    """
+    _push_expiry_time(buffable, expires_at, buff_id)
+    if _scheduler is not None:
+        _scheduler.register(buffable, expires_at, buff_id)
+
+
+def get_pending_expiry_times(buffable):
+    """ Gets the expiry times not cancelled yet, in no particular order.
+
+    :param Buffable buffable:
+    :rtype: list[tuple[float, int]]
+    :returns Tuples of (expiry time, buff id)
+    """
+    expiry_generations = buffable.expiry_generations
+    return [
+        (expiry_time, buff_id) for expiry_time, buff_id, generation in buffable.expiry_times
+        if generation == expiry_generations.get(buff_id)
+    ]
+
+
+def cancel_expiry_times(buffable, buff_id):
+    """ Cancels all pending expiry times of a buff, when its last stack is gone.
+    Cancellation is lazy, cancelled expiry times stay in the queue and are discarded when they are reached.
+    The buff generation is dropped, so buffs that come and go don't pile up generations on the buffable.
+
+    :param Buffable buffable:
+    :param int buff_id:
+    """
+    buffable.expiry_generations.pop(buff_id, None)
+
+
+def get_expired_buffs(buffable, now=None):
+    """ Get a list of all buffs that already have expired and removes them from the expiry queue.
+
+    :param Buffable buffable:
+    :param float now: Current timestamp, read from the clock if not given
+    :rtype: list[BuffSpec]
     """
     expired_buffs = []
-    while buffable.expiry_times and get_timestamp() >= _get_next_expiry_time(buffable):
-        next_expiry_time, buff_id = buffable.expiry_times.pop(0)
-        expired_buffs.append(buffspecs.get_buff_spec(buff_id))
+    expiry_times = buffable.expiry_times
+    if not expiry_times:
+        return expired_buffs
+
+    if now is None:
+        now = get_timestamp()
+
+    while expiry_times and now >= expiry_times[0][0]:
+        next_expiry_time, buff_id, generation = heapq.heappop(expiry_times)
+
+        # Expiry times cancelled when the buff was removed early are just discarded
+        if generation == buffable.expiry_generations.get(buff_id):
+            expired_buffs.append(buffspecs.get_buff_spec(buff_id))
     return expired_buffs
 
 
@@ -42,22 +91,111 @@ def _get_next_expiry_time(buffable):
         return buffable.expiry_times[0][0]
 
 
-def _add_expiry_time_to_fifo_list(buffable, expiry_time_to_add, buff_id_to_add):
-    """ Adds an expiry time to the expiry time list. It will add lower expiry times earlier in order, so the
-        first element is always the next to expire.
+_generations = itertools.count()
+
+
+def _push_expiry_time(buffable, expiry_time_to_add, buff_id_to_add):
+    """ Adds an expiry time to the expiry queue. The queue is a heap, so the first element is always the next
+        to expire.
 
     :param Buffable buffable:
     :param int expiry_time_to_add:
     :param int buff_id_to_add:
     """
-    index = len(buffable.expiry_times)
-    for i in range(len(buffable.expiry_times)):
-        expiry_time, buff_id = buffable.expiry_times[i]
-        if expiry_time_to_add < expiry_time:
-            index = i
-            break
-    expiry_time = (expiry_time_to_add, buff_id_to_add)
-    buffable.expiry_times.insert(index, expiry_time)
+    generation = buffable.expiry_generations.get(buff_id_to_add)
+    if generation is None:
+        # Generations are never reused, so expiry times cancelled before can't match a later generation
+        generation = buffable.expiry_generations[buff_id_to_add] = next(_generations)
+    heapq.heappush(buffable.expiry_times, (expiry_time_to_add, buff_id_to_add, generation))
+
+
+class ExpiryScheduler(object):
+    """ Tracks the expiry times of every buffable, so a game loop can expire them in batches instead of waiting
+    for someone to read the buffable attributes.
+    It only knows when to look at a buffable, the buffable own expiry queue remains the source of truth.
+    """
+    def __init__(self):
+        # Heap of tuples (expiry_time, sequence, buffable weak reference, buff_id, expiry generation)
+        self.expiry_times = []
+        self.sequence = itertools.count()
+        # Map of buffable to the last time it was popped, its expiry times up to then were handled with it
+        self.popped_at = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self.expiry_times)
+
+    def register(self, buffable, expires_at, buff_id):
+        """
+        :param Buffable buffable:
+        :param float expires_at:
+        :param int buff_id: Buff with this expiry time, the entry is dropped if its expiry times get cancelled
+        """
+        # An expiry time before the last pop would be taken as already handled
+        popped_at = self.popped_at.get(buffable)
+        if popped_at is not None and expires_at <= popped_at:
+            del self.popped_at[buffable]
+        generation = buffable.expiry_generations[buff_id]
+        entry = (expires_at, next(self.sequence), weakref.ref(buffable), buff_id, generation)
+        heapq.heappush(self.expiry_times, entry)
+
+    def pop_due_buffables(self, now, limit=None):
+        """ Pops the buffables that have expiry times due, oldest first. The caller must expire all buffs of the
+        popped buffables due by now, their remaining entries due by then are dropped.
+
+        :param float now:
+        :param int limit: Max amount of buffables to pop, the remaining ones are kept for the next call
+        :rtype: list[Buffable]
+        """
+        buffables = []
+        expiry_times = self.expiry_times
+        popped_at = self.popped_at
+        while expiry_times and now >= expiry_times[0][0]:
+            if limit is not None and len(buffables) >= limit:
+                break
+            expires_at, sequence, buffable_reference, buff_id, generation = heapq.heappop(expiry_times)
+            buffable = buffable_reference()
+
+            # Buffable might have been garbage collected, its buff removed before expiring, or already popped at a
+            # later time, by this call or by a previous one
+            if buffable is None or buffable.expiry_generations.get(buff_id) != generation:
+                continue
+            last_popped_at = popped_at.get(buffable)
+            if last_popped_at is not None and expires_at <= last_popped_at:
+                continue
+            popped_at[buffable] = now
+            buffables.append(buffable)
+        return buffables
+
+
+_scheduler = None
+
+
+def enable_global_expiry():
+    """ Starts tracking every registered expiry time in a global scheduler, see api.tick.
+
+    :rtype: ExpiryScheduler
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ExpiryScheduler()
+    return _scheduler
+
+
+def disable_global_expiry():
+    global _scheduler
+    _scheduler = None
+
+
+def get_due_buffables(now, limit=None):
+    """ Gets buffables with expiry times due from the global scheduler, if it is enabled.
+
+    :param float now:
+    :param int limit:
+    :rtype: list[Buffable]
+    """
+    if _scheduler is None:
+        return []
+    return _scheduler.pop_due_buffables(now, limit)
 
 
 def get_timestamp():
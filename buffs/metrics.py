@@ -0,0 +1,220 @@
+import bisect
+import time
+
+"""
+Counters and timing histograms of buff calls, keyed by buff id or event name. Metrics are only collected while
+enabled, they are pulled from the collector or exported in the Prometheus text format.
+"""
+
+# Measured calls, with the label of their key and a description
+CALL_EVENT = "call_event"
+ADD_BUFF = "add_buff"
+ACTIVATE_BUFF = "activate_buff"
+INACTIVATE_BUFF = "inactivate_buff"
+DERIVATION = "derivation_recalculation"
+
+# Counters of modifications
+MODIFICATIONS_ADDED = "modifications_added"
+MODIFICATIONS_REMOVED = "modifications_removed"
+
+# Counters of buff condition checks, and of propagations with the targets they reached, their ratio is the fan-out
+CONDITIONS_EVALUATED = "conditions_evaluated"
+PROPAGATIONS = "propagations"
+PROPAGATION_FANOUT = "propagation_fanout"
+
+METRICS = {
+    CALL_EVENT: ("event", "Events called"),
+    ADD_BUFF: ("buff_id", "Buffs added"),
+    ACTIVATE_BUFF: ("buff_id", "Buff activations"),
+    INACTIVATE_BUFF: ("buff_id", "Buff inactivations"),
+    DERIVATION: ("buff_id", "Derivated modifications recalculated"),
+    MODIFICATIONS_ADDED: ("buff_id", "Modifications added by activations"),
+    MODIFICATIONS_REMOVED: ("buff_id", "Modifications removed by inactivations"),
+    CONDITIONS_EVALUATED: ("buff_id", "Buff conditions evaluated"),
+    PROPAGATIONS: ("buff_id", "Buff propagations triggered"),
+    PROPAGATION_FANOUT: ("buff_id", "Targets reached by buff propagations"),
+}
+
+# Upper bounds of the timing histogram buckets, in nanoseconds
+DEFAULT_BUCKETS_NS = (
+    1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+    1000000, 2500000, 5000000, 10000000, 25000000, 50000000, 100000000
+)
+
+PROMETHEUS_PREFIX = "buffs_"
+
+
+class Histogram(object):
+    __slots__ = ("bucket_counts", "count", "sum_ns")
+
+    def __init__(self, bucket_amount):
+        # The last bucket counts what's above all bounds
+        self.bucket_counts = [0] * (bucket_amount + 1)
+        self.count = 0
+        self.sum_ns = 0
+
+
+class MetricsCollector(object):
+    """ Holds the counters and timing histograms of every metric and key.
+
+    :param tuple[int] buckets_ns: Sorted upper bounds of the timing histogram buckets, in nanoseconds
+    """
+    def __init__(self, buckets_ns=DEFAULT_BUCKETS_NS):
+        self.buckets_ns = tuple(buckets_ns)
+        # Map of (metric, key) to its count
+        self.counters = {}
+        # Map of (metric, key) to its Histogram
+        self.histograms = {}
+
+    def increment(self, metric, key, amount=1):
+        counter_key = (metric, key)
+        self.counters[counter_key] = self.counters.get(counter_key, 0) + amount
+
+    def observe(self, metric, key, start_ns):
+        """ Counts a call and records the time it took.
+
+        :param str metric:
+        :param key: Buff id or event name
+        :param int start_ns: time.perf_counter_ns() when the call started
+        """
+        duration_ns = time.perf_counter_ns() - start_ns
+        counter_key = (metric, key)
+        self.counters[counter_key] = self.counters.get(counter_key, 0) + 1
+
+        histogram = self.histograms.get(counter_key)
+        if histogram is None:
+            histogram = self.histograms[counter_key] = Histogram(len(self.buckets_ns))
+        histogram.bucket_counts[bisect.bisect_left(self.buckets_ns, duration_ns)] += 1
+        histogram.count += 1
+        histogram.sum_ns += duration_ns
+
+    def get_count(self, metric, key):
+        return self.counters.get((metric, key), 0)
+
+    def get_histogram(self, metric, key):
+        """
+        :rtype: Histogram
+        :returns The histogram or None if the call was never measured
+        """
+        return self.histograms.get((metric, key))
+
+    def snapshot(self):
+        """ Copies the current values of all metrics.
+
+        :rtype: dict
+        :returns Map of metric name to a map of key to its count, and its histogram as the count, sum and
+            cumulative bucket counts with their upper bounds in seconds when the call is timed
+        """
+        snapshot = {}
+        for (metric, key), count in self.counters.items():
+            values = {"count": count}
+            histogram = self.histograms.get((metric, key))
+            if histogram is not None:
+                values["sum_seconds"] = histogram.sum_ns / 1e9
+                values["buckets"] = self._cumulative_buckets(histogram)
+            snapshot.setdefault(metric, {})[key] = values
+        return snapshot
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def _cumulative_buckets(self, histogram):
+        buckets = []
+        cumulative_count = 0
+        for bound_ns, bucket_count in zip(self.buckets_ns + (None,), histogram.bucket_counts):
+            cumulative_count += bucket_count
+            buckets.append((bound_ns / 1e9 if bound_ns is not None else float("inf"), cumulative_count))
+        return buckets
+
+
+_collector = None
+
+
+def enable_metrics(buckets_ns=DEFAULT_BUCKETS_NS):
+    """ Starts collecting metrics of buff calls in a global collector.
+
+    :param tuple[int] buckets_ns: Upper bounds of the timing histogram buckets, only used by a new collector
+    :rtype: MetricsCollector
+    """
+    global _collector
+    if _collector is None:
+        _collector = MetricsCollector(buckets_ns)
+    return _collector
+
+
+def disable_metrics():
+    global _collector
+    _collector = None
+
+
+def get_collector():
+    """
+    :rtype: MetricsCollector
+    :returns The global collector or None if metrics are not enabled
+    """
+    return _collector
+
+
+def to_prometheus_text(collector=None):
+    """ Exports the metrics in the Prometheus text exposition format. Counters are exported as <metric>_total and
+    timings as the <metric>_duration_seconds histogram.
+
+    :param MetricsCollector collector: Defaults to the global collector
+    :rtype: str
+    """
+    collector = collector or _collector
+    if collector is None:
+        return ""
+
+    lines = []
+    snapshot = collector.snapshot()
+    for metric in sorted(snapshot):
+        label, description = METRICS.get(metric, ("key", metric))
+        values_by_key = snapshot[metric]
+        keys = sorted(values_by_key, key=str)
+
+        name = PROMETHEUS_PREFIX + metric + "_total"
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} counter".format(name))
+        for key in keys:
+            lines.append("{}{{{}}} {}".format(name, _label(label, key), values_by_key[key]["count"]))
+
+        timed_keys = [key for key in keys if "buckets" in values_by_key[key]]
+        if not timed_keys:
+            continue
+        name = PROMETHEUS_PREFIX + metric + "_duration_seconds"
+        lines.append("# HELP {} Duration of {}".format(name, description[0].lower() + description[1:]))
+        lines.append("# TYPE {} histogram".format(name))
+        for key in timed_keys:
+            values = values_by_key[key]
+            labels = _label(label, key)
+            for bound, cumulative_count in values["buckets"]:
+                lines.append("{}_bucket{{{},le=\"{}\"}} {}".format(
+                    name, labels, _format_bound(bound), cumulative_count
+                ))
+            lines.append("{}_sum{{{}}} {}".format(name, labels, repr(values["sum_seconds"])))
+            lines.append("{}_count{{{}}} {}".format(name, labels, values["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_text(path, collector=None):
+    """ Writes the metrics in the Prometheus text exposition format, to be read by the node exporter textfile
+    collector or pushed to a gateway.
+
+    :param str path:
+    :param MetricsCollector collector: Defaults to the global collector
+    """
+    with open(path, "w") as metrics_file:
+        metrics_file.write(to_prometheus_text(collector))
+
+
+def _label(label, key):
+    value = str(key).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{}=\"{}\"".format(label, value)
+
+
+def _format_bound(bound):
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(bound)
@@ -1,17 +1,30 @@
+from array import array
 from collections import defaultdict
-from utils.dict_magic import defaultdictlist
+from collections.abc import Mapping
+from types import MappingProxyType
+from utils.dict_magic import defaultdictlist, defaultdictset
+from errors import BuffException, BuffErrorCodes
 import buffspecs
+import itertools
 import uuid
 
-# Warm UUID generator
-uuid.uuid1()
+# Shared read-only mapping returned when an attribute has no derivations allocated
+_NO_DERIVATIONS = MappingProxyType({})
+
+# Max amount of events walked in an event chain, longer chains are considered broken (IE events triggering themselves)
+MAX_EVENT_CHAIN_DEPTH = 1000
 
 
 class Attribute(object):
+	__slots__ = ("mod_add", "mod_mult", "mod_pct", "final_value", "dirty", "history", "derivations")
+
 	def __init__(self, mod_add=0, mod_mult=0):
 		self.mod_add = mod_add
 		self.mod_mult = mod_mult
 		self.final_value = 0
+
+		# In deferred calculation, the final value is outdated until calculated again
+		self.dirty = False
 		self.history = {}
 
 		# We keep a map of derivations per attribute for performance boost
@@ -19,14 +32,21 @@ class Attribute(object):
 
 	def calculate(self):
 		self.final_value = self.mod_add * (1 + self.mod_mult)
+		self.dirty = False
 
 
 class BuffableAttributes(object):
 	def __init__(self):
 		self.attribute_data = defaultdict(Attribute)
 
+		# Index of modifications per buff id and stack, so buffs can find their modifications without scanning history
+		self.buff_modifications = {}
+
 	def __getitem__(self, attribute_id):
-		return self.attribute_data[attribute_id].final_value
+		attribute = self.attribute_data[attribute_id]
+		if attribute.dirty:
+			attribute.calculate()
+		return attribute.final_value
 
 	def __setitem__(self, attribute_id, raw_value):
 		self.attribute_data[attribute_id].mod_add = raw_value
@@ -36,9 +56,127 @@ class BuffableAttributes(object):
 	def get_data(self, attribute_id):
 		return self.attribute_data[attribute_id]
 
+	def get_derivations(self, attribute_id):
+		return self.attribute_data[attribute_id].derivations
+
+
+class AttributeColumns(object):
+	""" Values of a closed attribute set stored in contiguous columns, indexed by the attribute ordinal.
+	History and derivations are only allocated for attributes that use them.
+	"""
+	__slots__ = ("indexes", "mod_add", "mod_mult", "final_value", "dirty", "histories", "derivations")
+
+	def __init__(self, indexes):
+		zeros = [0.0] * len(indexes)
+		self.indexes = indexes
+		self.mod_add = array("d", zeros)
+		self.mod_mult = array("d", zeros)
+		self.final_value = array("d", zeros)
+		# Indexes of attributes with outdated final values, in deferred calculation
+		self.dirty = set()
+		self.histories = {}
+		self.derivations = {}
+
+	def __getitem__(self, attribute_id):
+		return ArrayAttribute(self, self.indexes[attribute_id])
+
+
+class ArrayAttribute(object):
+	""" Attribute view over one row of AttributeColumns, behaving as an Attribute. """
+	__slots__ = ("columns", "index")
+
+	def __init__(self, columns, index):
+		self.columns = columns
+		self.index = index
+
+	@property
+	def mod_add(self):
+		return self.columns.mod_add[self.index]
+
+	@mod_add.setter
+	def mod_add(self, value):
+		self.columns.mod_add[self.index] = value
+
+	@property
+	def mod_mult(self):
+		return self.columns.mod_mult[self.index]
+
+	@mod_mult.setter
+	def mod_mult(self, value):
+		self.columns.mod_mult[self.index] = value
+
+	@property
+	def final_value(self):
+		return self.columns.final_value[self.index]
+
+	@final_value.setter
+	def final_value(self, value):
+		self.columns.final_value[self.index] = value
+
+	@property
+	def dirty(self):
+		return self.index in self.columns.dirty
+
+	@dirty.setter
+	def dirty(self, dirty):
+		if dirty:
+			self.columns.dirty.add(self.index)
+		else:
+			self.columns.dirty.discard(self.index)
+
+	@property
+	def history(self):
+		history = self.columns.histories.get(self.index)
+		if history is None:
+			history = self.columns.histories[self.index] = {}
+		return history
+
+	@property
+	def derivations(self):
+		derivations = self.columns.derivations.get(self.index)
+		if derivations is None:
+			derivations = self.columns.derivations[self.index] = defaultdictlist()
+		return derivations
+
+	def calculate(self):
+		columns = self.columns
+		columns.final_value[self.index] = columns.mod_add[self.index] * (1 + columns.mod_mult[self.index])
+		columns.dirty.discard(self.index)
+
+
+class ArrayBuffableAttributes(BuffableAttributes):
+	""" Buffable attributes for a closed attribute set, like an Enum, backed by AttributeColumns. """
+	def __init__(self, attribute_set):
+		super(ArrayBuffableAttributes, self).__init__()
+		self.attribute_data = AttributeColumns(buffspecs.get_attribute_indexes(attribute_set))
+
+	def __getitem__(self, attribute_id):
+		columns = self.attribute_data
+		index = columns.indexes[attribute_id]
+		if index in columns.dirty:
+			columns.final_value[index] = columns.mod_add[index] * (1 + columns.mod_mult[index])
+			columns.dirty.discard(index)
+		return columns.final_value[index]
+
+	def __setitem__(self, attribute_id, raw_value):
+		columns = self.attribute_data
+		index = columns.indexes[attribute_id]
+		columns.mod_add[index] = raw_value
+		columns.final_value[index] = raw_value * (1 + columns.mod_mult[index])
+		columns.dirty.discard(index)
+
+	def get_derivations(self, attribute_id):
+		columns = self.attribute_data
+		return columns.derivations.get(columns.indexes[attribute_id], _NO_DERIVATIONS)
+
 
 class BuffSpec(object):
+	""" Buff configuration. It is compiled into an immutable buffspecs.CompiledBuffSpec on its first use (or on
+	buffspecs.finalize), after that it is frozen and changing it raises SPEC_FROZEN.
+	"""
 	def __init__(self, spec_id=None, name=None):
+		self.frozen = False
+
 		self.buff_id = spec_id or buffspecs.IDGen.next()
 
 		# Changes this buff will apply
@@ -47,7 +185,7 @@ class BuffSpec(object):
 		# Condition strings for the activation triggers
 		self.conditions = []
 
-		# Triggers to activate/deactivate or propagate the buff
+		# Triggers to activate/deactivate or propagate the buff, as event classes or event class names
 		self.activation_triggers = []
 		self.deactivation_triggers = []
 		self.propagation_triggers = []
@@ -59,7 +197,7 @@ class BuffSpec(object):
 		# IE 50% of source buffable atk goes to destination buffable DEF
 		self.propagates_to_attribute = None
 
-		# Buffable class names this buff can propagate to
+		# Buffable classes or buffable class names this buff can propagate to, subclasses included
 		self.propagates_to = []
 
 		# Conditions that shall be met for the propagation to happen
@@ -74,6 +212,22 @@ class BuffSpec(object):
 		self.name = name
 		buffspecs.register_buff(self)
 
+	def __setattr__(self, name, value):
+		if self.__dict__.get("frozen"):
+			raise BuffException(BuffErrorCodes.SPEC_FROZEN)
+		super(BuffSpec, self).__setattr__(name, value)
+
+	def freeze(self):
+		""" Makes this spec immutable, its lists become tuples. """
+		if self.frozen:
+			return
+		for field in (
+			"modifiers", "conditions", "activation_triggers", "deactivation_triggers", "propagation_triggers",
+			"propagates_to", "propagation_conditions"
+		):
+			setattr(self, field, tuple(getattr(self, field)))
+		self.frozen = True
+
 	@property
 	def propagates(self):
 		return len(self.propagates_to) > 0
@@ -82,31 +236,54 @@ class BuffSpec(object):
 	def auto_triggers(self):
 		return len(self.activation_triggers) == 0
 
-	def can_be_reactivated(self):
-		return (self.activation_triggers and self.conditions) or self.conditions or self.deactivation_triggers
+	def can_target(self, buffable):
+		return buffspecs.get_compiled_spec(self.buff_id).can_target(buffable)
 
-	def can_target(self, target_name):
-		return not self.propagates or target_name in self.propagates_to
+	def is_target(self, buffable):
+		return buffspecs.get_compiled_spec(self.buff_id).is_target(buffable)
+
+	# Kept for callers from before compiled specs, they compile the spec like any other use of it
+	def can_be_reactivated(self):
+		return buffspecs.get_compiled_spec(self.buff_id).can_be_reactivated
 
 	def get_remove_triggers(self):
-		if len(self.conditions) > 0 and len(self.deactivation_triggers) == 0:
-			return self.activation_triggers  # if i have conditions by default my remove trigger is the activation trigger
-		return self.deactivation_triggers
+		return list(buffspecs.get_compiled_spec(self.buff_id).remove_triggers)
 
 	def get_triggers(self):
-		if len(self.activation_triggers) == 0:
-			return ["AddBuffEvent"]
-		return self.activation_triggers
+		return list(buffspecs.get_compiled_spec(self.buff_id).triggers)
 
 	def get_propagation_triggers(self):
-		if len(self.propagation_triggers) == 0:
-			return ["AddBuffEvent"]  # Default trigger, buff is triggered as soon its added
-		return self.propagation_triggers
+		return list(buffspecs.get_compiled_spec(self.buff_id).propagation_triggers)
+
+
+class ModificationIds(object):
+	""" Strategy generating buff modification ids. Ids are only keys in attribute history and derivations,
+	so by default they come from a cheap process-local counter. Use uuids if they have to be unique across processes.
+	"""
+	def __init__(self):
+		self.next = None
+		self.use_counter()
+
+	def use_counter(self):
+		self.next = itertools.count(1).__next__
+
+	def use_uuid(self):
+		# Warm UUID generator
+		uuid.uuid1()
+		self.next = uuid.uuid1
+
+	def use(self, id_function):
+		self.next = id_function
+
+
+modification_ids = ModificationIds()
 
 
 class BuffModification(object):
+	__slots__ = ("id", "buff_id", "source_event", "stack_count", "modifier", "derivated_modifier")
+
 	def __init__(self, modifier, source_event=None, buff_id=None, derivated_modifier=None):
-		self.id = uuid.uuid1()
+		self.id = modification_ids.next()
 		self.buff_id = buff_id
 		self.source_event = source_event
 
@@ -125,6 +302,8 @@ class BuffModification(object):
 
 
 class ActiveBuff(object):
+	__slots__ = ("source_event", "buff_id", "stack")
+
 	def __init__(self, buff_id, source_event):
 		self.source_event = source_event
 		self.buff_id = buff_id
@@ -138,19 +317,40 @@ class BuffCondition(object):
 
 
 class Buffable(object):
+	# Closed set of attributes (like an Enum) to store attributes in columns instead of one object per attribute
+	attribute_set = None
+	# Set by buffspecs.register_buffable_type, used to find propagation targets
+	buffable_type_id = None
+	buffable_type_ids = ()
+	buffable_type_mask = 0
+
+	def __init_subclass__(cls, **kwargs):
+		super(Buffable, cls).__init_subclass__(**kwargs)
+		buffspecs.register_buffable_type(cls)
+
 	def __init__(self):
 		self.id = 0  # your game identification
 
-		self._attributes = BuffableAttributes()
+		if self.attribute_set is None:
+			self._attributes = BuffableAttributes()
+		else:
+			self._attributes = ArrayBuffableAttributes(self.attribute_set)
 
 		self.active_buffs = {}
 
-		# Fifo list of tuples (expiry_time, buff_id)
+		# Heap of tuples (expiry_time, buff_id, generation)
 		self.expiry_times = []
 
-		self.activation_triggers = defaultdictlist()
-		self.deactivation_triggers = defaultdictlist()
-		self.propagation_triggers = defaultdictlist()
+		# Expiry generation of each buff id with pending expiry times, expiry times from other generations were cancelled
+		self.expiry_generations = {}
+
+		# Map of source attribute id to the active buff ids propagating a derivation of it
+		self.propagated_derivations = {}
+
+		# Map of trigger event type id to the buff ids it triggers, ordered from oldest to newest
+		self.activation_triggers = defaultdictset()
+		self.deactivation_triggers = defaultdictset()
+		self.propagation_triggers = defaultdictset()
 
 	@property
 	def attributes(self):
@@ -163,7 +363,12 @@ class Buffable(object):
 		return self.__class__.__name__
 
 
+buffspecs.register_buffable_type(Buffable)
+
+
 class Modifier(object):
+	__slots__ = ("attribute_id", "value", "operator")
+
 	def __init__(self, operator, value, attribute_id):
 		self.attribute_id = attribute_id
 		self.value = value
@@ -171,6 +376,17 @@ class Modifier(object):
 
 
 class BuffEvent(object):
+	# Events defined by the game still get a __dict__ unless they declare their own slots
+	__slots__ = ("buffable",)
+	# Set by buffspecs.register_event_type, used as the key of buffable triggers
+	event_type_id = None
+	# Buffable that propagated the buff this event comes from, resolved when internal chain events are built
+	propagation_source = None
+
+	def __init_subclass__(cls, **kwargs):
+		super(BuffEvent, cls).__init_subclass__(**kwargs)
+		buffspecs.register_event_type(cls)
+
 	def __init__(self, buffable):
 		self.buffable = buffable
 
@@ -178,28 +394,50 @@ class BuffEvent(object):
 		return self.__class__.__name__
 
 	def get_event_chain(self, event_chain=None):
-		if not isinstance(self, _InternalChainEvent):
-			return [self]
-
-		if not event_chain:
-			event_chain = [self]
-		if self.trigger_event:
-			event_chain.append(self.trigger_event)
-			self = self.trigger_event
-			self.get_event_chain(event_chain)
+		if event_chain is None:
+			event_chain = []
+		event_chain.extend(self.iter_event_chain())
 		return event_chain
 
+	def iter_event_chain(self, max_depth=MAX_EVENT_CHAIN_DEPTH):
+		""" Walks the event chain from this event to the event that started it, without building it.
+
+		:param int max_depth: Max amount of events to walk
+		:rtype: generator[BuffEvent]
+		:raises BuffException: EVENT_CHAIN_TOO_DEEP if the chain has more events than max_depth
+		"""
+		event = self
+		depth = 0
+		while event is not None:
+			depth += 1
+			if depth > max_depth:
+				raise BuffException(BuffErrorCodes.EVENT_CHAIN_TOO_DEEP)
+			yield event
+			if not isinstance(event, _InternalChainEvent):
+				return
+			event = event.trigger_event
+
+
+buffspecs.register_event_type(BuffEvent)
+
 
 class _InternalChainEvent(BuffEvent):
 	""" Only to be used by the buff lib. This type of events keep track of the whole chain.
 	"""
+	__slots__ = ("trigger_event", "propagation_source")
+
 	def __init__(self, buffable, trigger_event):
 		super(_InternalChainEvent, self).__init__(buffable)
 		self.trigger_event = trigger_event
+		# The closest propagation up the chain, so it's not searched on every derivation update
+		self.propagation_source = getattr(trigger_event, "propagation_source", None)
 
 
 class AddBuffEvent(_InternalChainEvent):
 	""" Whenever a buff is added """
+	__slots__ = ("buff_id",)
+	event_type_id = buffspecs.get_event_type_id("AddBuffEvent")
+
 	def __init__(self, buffable, buff_id, trigger_event):
 		super(AddBuffEvent, self).__init__(buffable, trigger_event)
 		self.buff_id = buff_id
@@ -207,6 +445,9 @@ class AddBuffEvent(_InternalChainEvent):
 
 class BuffExpiredEvent(_InternalChainEvent):
 	""" Whenever a buff is added """
+	__slots__ = ("buff_id",)
+	event_type_id = buffspecs.get_event_type_id("BuffExpiredEvent")
+
 	def __init__(self, buffable, buff_id, trigger_event):
 		super(BuffExpiredEvent, self).__init__(buffable, trigger_event)
 		self.buff_id = buff_id
@@ -214,10 +455,14 @@ class BuffExpiredEvent(_InternalChainEvent):
 
 class BuffPropagatedEvent(_InternalChainEvent):
 	""" Whenever a buff is propagated """
+	__slots__ = ("buff_id", "source_buffable")
+	event_type_id = buffspecs.get_event_type_id("BuffPropagatedEvent")
+
 	def __init__(self, buffable, source_buffable, buff_id, trigger_event):
 		super(BuffPropagatedEvent, self).__init__(buffable, trigger_event)
 		self.buff_id = buff_id
 		self.source_buffable = source_buffable
+		self.propagation_source = source_buffable
 
 
 class EventResult(object):
@@ -225,3 +470,61 @@ class EventResult(object):
         self.added_modifications = []
         self.removed_modifications = []
         self.propagated_modifications = defaultdict(list)
+
+    def merge(self, event_result):
+        """ Accumulates the modifications of another event result into this one.
+
+        :param EventResult event_result:
+        :rtype: EventResult
+        """
+        self.added_modifications += event_result.added_modifications
+        self.removed_modifications += event_result.removed_modifications
+        for buffable_id, propagated_results in event_result.propagated_modifications.items():
+            self.propagated_modifications[buffable_id] += propagated_results
+        return self
+
+
+class _EmptyPropagatedModifications(Mapping):
+    """ Read-only propagated modifications of the empty event result, every buffable id gives an empty tuple """
+    def __getitem__(self, buffable_id):
+        return ()
+
+    def __contains__(self, buffable_id):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def get(self, buffable_id, default=None):
+        return default
+
+
+class _EmptyEventResult(EventResult):
+    """ Result of an event that triggered nothing, shared by all those events to avoid allocations.
+    Its modification lists are new empty lists on every read, so changing them can't leak into other results, but
+    it can't be assigned to or merged into. Merge it into a new EventResult to accumulate results.
+    """
+    propagated_modifications = _EmptyPropagatedModifications()
+
+    def __init__(self):
+        pass
+
+    @property
+    def added_modifications(self):
+        return []
+
+    @property
+    def removed_modifications(self):
+        return []
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The empty event result is shared and can't be modified")
+
+    def merge(self, event_result):
+        raise AttributeError("The empty event result is shared and can't be modified")
+
+
+EMPTY_EVENT_RESULT = _EmptyEventResult()
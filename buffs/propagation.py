@@ -24,20 +24,42 @@ def get_propagated_targets_of_given_attribute(buffable, attribute_id):
     :param int attribute_id:
     :rtype: generator[Buffable]
     """
-    for active_buff_id in buffable.active_buffs:
-        buff_spec = buffspecs.get_buff_spec(active_buff_id)
+    # Only buffs that propagate a derivation of this attribute, as indexed on activation
+    buff_ids = buffable.propagated_derivations.get(attribute_id)
+    if not buff_ids:
+        return
 
-        # If i have a buff that propagates to an attribute
-        if buff_spec.propagates_to_attribute:
-            targets = get_propagation_target_buffables(buffable, buff_spec)
-            for source_modifier in buff_spec.modifiers:
+    for buff_id in list(buff_ids):
+        buff_spec = buffspecs.get_compiled_spec(buff_id)
+        for target in get_propagation_target_buffables(buffable, buff_spec):
+            yield target
 
-                # In case the target attribute i propagate comes from this attribute that im changing
-                if source_modifier.attribute_id == attribute_id:
-                    for target in targets:
 
-                        # Need to track that for that target because he will be affected
-                        yield target
+def index_propagated_derivations(buffable, buff_spec):
+    """ Indexes, by source attribute, a buff that became active and propagates a derivation of that attribute.
+
+    :param Buffable buffable:
+    :param BuffSpec buff_spec:
+    """
+    if buff_spec.propagates_to_attribute:
+        for source_modifier in buff_spec.modifiers:
+            buff_ids = buffable.propagated_derivations.setdefault(source_modifier.attribute_id, {})
+            buff_ids[buff_spec.buff_id] = None
+
+
+def unindex_propagated_derivations(buffable, buff_spec):
+    """ Removes from the index a buff that is no longer active.
+
+    :param Buffable buffable:
+    :param BuffSpec buff_spec:
+    """
+    if buff_spec.propagates_to_attribute:
+        for source_modifier in buff_spec.modifiers:
+            buff_ids = buffable.propagated_derivations.get(source_modifier.attribute_id)
+            if buff_ids and buff_spec.buff_id in buff_ids:
+                del buff_ids[buff_spec.buff_id]
+                if not buff_ids:
+                    del buffable.propagated_derivations[source_modifier.attribute_id]
 
 
 def get_propagation_source(event):
@@ -46,9 +68,7 @@ def get_propagation_source(event):
     :param BuffEvent event:
     :rtype Buffable | None
     """
-    for chain_event in event.get_event_chain():
-        if isinstance(chain_event, BuffPropagatedEvent):
-            return chain_event.source_buffable
+    return event.propagation_source
 
 
 def get_propagation_target_buffables_including_self(buffable, buff_spec):
@@ -66,8 +86,8 @@ def get_propagation_target_buffables(buffable, buff_spec):
     :rtype: generator[Buffable]
     """
     if buff_spec.propagates:
-        for target in buff_spec.propagates_to:
-            for buffable_target in buffspecs.get_propagation_targets(buffable, target):
+        for target_type_id in buff_spec.target_type_ids:
+            for buffable_target in buffspecs.get_propagation_targets(buffable, target_type_id):
                 yield buffable_target
     else:
         yield buffable
@@ -0,0 +1,280 @@
+import struct
+
+from debug import strack_tracer
+import buffspecs
+
+from models import AddBuffEvent, BuffPropagatedEvent, AttributeColumns
+from utils.arrays import copy_triggers
+
+from api import buff_transaction
+from buffable import activate_buff
+from expiry import add_expiry_time, cancel_expiry_times, get_pending_expiry_times, get_timestamp
+from errors import BuffException, BuffErrorCodes
+
+"""
+Compact binary snapshots of buffables. A snapshot keeps the base attribute values, the active buffs with their stacks
+and remaining expiry times, and the buffs waiting for triggers. Modifications are not stored, restoring rebuilds them
+from the buff specs, so specs must be registered with the same ids before restoring.
+
+All values are little-endian:
+
+    header      magic "BUFS", version (uint8), amount of buffables (uint32)
+    buffable    id (int64), amount of attributes (uint16), amount of buffs (uint16)
+    attribute   index in the attribute ids (uint16), base add (double), base multiplier (double)
+    buff        buff id (uint32), stack (uint16), trigger flags (uint8),
+                index of the propagation source in the snapshot or -1 (int32), amount of expiry times (uint16)
+    expiry      remaining seconds (double)
+"""
+
+SNAPSHOT_MAGIC = b"BUFS"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<4sBI")
+_BUFFABLE = struct.Struct("<qHH")
+_ATTRIBUTE = struct.Struct("<Hdd")
+_BUFF = struct.Struct("<IHBiH")
+_EXPIRY = struct.Struct("<d")
+
+# Trigger flags of a buff
+_WAITING_ACTIVATION = 1
+_WAITING_PROPAGATION = 2
+
+
+@strack_tracer.Track
+def save_buffables(buffables, attribute_ids, now=None):
+    """ Saves the buff state of buffables in a compact binary snapshot.
+
+    :param list[Buffable] buffables:
+    :param list attribute_ids: Every attribute id the buffables use, in the same order when restoring
+    :param float now: Timestamp the remaining expiry times are relative to, read from the clock if not given
+    :rtype: bytes
+    """
+    if now is None:
+        now = get_timestamp()
+
+    attribute_indexes = {attribute_id: index for index, attribute_id in enumerate(attribute_ids)}
+    buffable_indexes = {id(buffable): index for index, buffable in enumerate(buffables)}
+
+    parts = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(buffables))]
+    for buffable in buffables:
+        attribute_parts = []
+        for attribute_id, base_add, base_mult in _get_base_attributes(buffable._attributes):
+            attribute_index = attribute_indexes.get(attribute_id)
+            if attribute_index is None:
+                raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+            attribute_parts.append(_ATTRIBUTE.pack(attribute_index, base_add, base_mult))
+
+        remaining_times = {}
+        for expiry_time, buff_id in get_pending_expiry_times(buffable):
+            remaining_times.setdefault(buff_id, []).append(expiry_time - now)
+
+        buff_flags = {buff_id: 0 for buff_id in buffable.active_buffs}
+        for trigger_buff_ids in buffable.activation_triggers.values():
+            for buff_id in trigger_buff_ids:
+                buff_flags[buff_id] = buff_flags.get(buff_id, 0) | _WAITING_ACTIVATION
+        for trigger_buff_ids in buffable.propagation_triggers.values():
+            for buff_id in trigger_buff_ids:
+                buff_flags[buff_id] = buff_flags.get(buff_id, 0) | _WAITING_PROPAGATION
+
+        buff_parts = []
+        for buff_id, flags in buff_flags.items():
+            active_buff = buffable.active_buffs.get(buff_id)
+            stack = 0
+            source_index = -1
+            if active_buff is not None:
+                stack = active_buff.stack
+                source_index = _get_source_index(active_buff, buffable_indexes)
+            buff_remaining_times = sorted(remaining_times.get(buff_id, ()))
+            buff_parts.append(_BUFF.pack(buff_id, stack, flags, source_index, len(buff_remaining_times)))
+            for remaining_time in buff_remaining_times:
+                buff_parts.append(_EXPIRY.pack(remaining_time))
+
+        parts.append(_BUFFABLE.pack(buffable.id, len(attribute_parts), len(buff_flags)))
+        parts.extend(attribute_parts)
+        parts.extend(buff_parts)
+    return b"".join(parts)
+
+
+@strack_tracer.Track
+def restore_buffables(data, buffables, attribute_ids, now=None):
+    """ Restores a snapshot into new buffables, rebuilding the modifications of active buffs from their specs.
+    Buffables propagating buffs are restored before their targets, so propagated derivations read restored values.
+
+    :param bytes data: A snapshot from save_buffables
+    :param list[Buffable] buffables: New buffables, the same amount and in the same order they were saved
+    :param list attribute_ids: The attribute ids the snapshot was saved with
+    :param float now: Timestamp the remaining expiry times are relative to, read from the clock if not given
+    """
+    if now is None:
+        now = get_timestamp()
+
+    records = _read_records(data)
+    if len(records) != len(buffables):
+        raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+
+    for buffable, (buffable_id, attributes, _) in zip(buffables, records):
+        buffable.id = buffable_id
+        attribute_data = buffable._attributes.attribute_data
+        for attribute_index, base_add, base_mult in attributes:
+            attribute = attribute_data[attribute_ids[attribute_index]]
+            attribute.mod_add = base_add
+            attribute.mod_mult = base_mult
+            attribute.calculate()
+
+    with buff_transaction():
+        for index in _get_restore_order(records):
+            _restore_buffs(buffables[index], records[index][2], buffables, now)
+
+
+def _get_base_attributes(buffable_attributes):
+    """ Gets the attribute values without the modifications of buffs.
+
+    :param BuffableAttributes buffable_attributes:
+    :rtype: generator[tuple]
+    :returns Tuples of (attribute id, base add, base multiplier) of attributes that are not zero
+    """
+    attribute_data = buffable_attributes.attribute_data
+    if isinstance(attribute_data, AttributeColumns):
+        attributes = (
+            (attribute_id, attribute_data.mod_add[index], attribute_data.mod_mult[index],
+             attribute_data.histories.get(index))
+            for attribute_id, index in attribute_data.indexes.items()
+        )
+    else:
+        attributes = (
+            (attribute_id, attribute.mod_add, attribute.mod_mult, attribute.history)
+            for attribute_id, attribute in attribute_data.items()
+        )
+
+    for attribute_id, base_add, base_mult, history in attributes:
+        for modification in (history or {}).values():
+            modifier = modification.applied_modifier
+            if modifier.operator == "+":
+                base_add -= modifier.value
+            elif modifier.operator == "%":
+                base_mult -= modifier.value
+        if base_add or base_mult:
+            yield attribute_id, base_add, base_mult
+
+
+def _get_source_index(active_buff, buffable_indexes):
+    """ Gets the index in the snapshot of the buffable that propagated a buff.
+
+    :param ActiveBuff active_buff:
+    :param dict buffable_indexes: Map of id() of each saved buffable to its index
+    :rtype: int
+    :returns The index or -1 if the buff was not propagated, or its source is not in the snapshot
+    """
+    source_buffable = active_buff.source_event.propagation_source if active_buff.source_event else None
+    if source_buffable is None:
+        return -1
+
+    source_index = buffable_indexes.get(id(source_buffable))
+    if source_index is None:
+        # Propagated derivations can't be rebuilt without their source, other buffs are restored as not propagated
+        if buffspecs.get_compiled_spec(active_buff.buff_id).propagates_to_attribute:
+            raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+        return -1
+    return source_index
+
+
+def _read_records(data):
+    """ Parses a snapshot.
+
+    :param bytes data:
+    :rtype: list[tuple]
+    :returns One tuple of (buffable id, attributes, buffs) per buffable, buffs as tuples of
+        (buff id, stack, flags, source index, remaining times)
+    """
+    try:
+        magic, version, amount = _HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+        offset = _HEADER.size
+
+        records = []
+        for _ in range(amount):
+            buffable_id, attribute_amount, buff_amount = _BUFFABLE.unpack_from(data, offset)
+            offset += _BUFFABLE.size
+
+            attributes = []
+            for _ in range(attribute_amount):
+                attributes.append(_ATTRIBUTE.unpack_from(data, offset))
+                offset += _ATTRIBUTE.size
+
+            buffs = []
+            for _ in range(buff_amount):
+                buff_id, stack, flags, source_index, expiry_amount = _BUFF.unpack_from(data, offset)
+                offset += _BUFF.size
+                remaining_times = []
+                for _ in range(expiry_amount):
+                    remaining_times.append(_EXPIRY.unpack_from(data, offset)[0])
+                    offset += _EXPIRY.size
+                buffs.append((buff_id, stack, flags, source_index, remaining_times))
+
+            records.append((buffable_id, attributes, buffs))
+    except struct.error:
+        raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+
+    if offset != len(data):
+        raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+    return records
+
+
+def _get_restore_order(records):
+    """ Orders the buffables so each one comes after the buffables that propagated buffs to it.
+
+    :param list[tuple] records:
+    :rtype: list[int]
+    """
+    order = []
+    visited = set()
+    for root_index in range(len(records)):
+        if root_index in visited:
+            continue
+        visited.add(root_index)
+        # Stack of (buffable index, iterator over its source indexes)
+        to_visit = [(root_index, iter(buff[3] for buff in records[root_index][2]))]
+        while to_visit:
+            index, source_indexes = to_visit[-1]
+            for source_index in source_indexes:
+                if source_index == -1 or source_index in visited:
+                    continue
+                if not 0 <= source_index < len(records):
+                    raise BuffException(BuffErrorCodes.INVALID_SNAPSHOT)
+                visited.add(source_index)
+                to_visit.append((source_index, iter(buff[3] for buff in records[source_index][2])))
+                break
+            else:
+                to_visit.pop()
+                order.append(index)
+    return order
+
+
+def _restore_buffs(buffable, buffs, buffables, now):
+    for buff_id, stack, flags, source_index, remaining_times in buffs:
+        buff_spec = buffspecs.get_compiled_spec(buff_id)
+
+        if stack:
+            source_event = AddBuffEvent(buffable, buff_id, None)
+            if source_index != -1:
+                source_buffable = buffables[source_index]
+                source_event = BuffPropagatedEvent(
+                    buffable, source_buffable, buff_id, AddBuffEvent(source_buffable, buff_id, None)
+                )
+            for _ in range(stack):
+                activate_buff(buffable, buff_spec, source_event)
+
+        # Activating used the triggers, they are copied back if the buff was still waiting for them
+        if flags & _WAITING_ACTIVATION:
+            copy_triggers(buff_id, buff_spec.triggers, buffable.activation_triggers)
+        if flags & _WAITING_PROPAGATION:
+            copy_triggers(buff_id, buff_spec.propagation_triggers, buffable.propagation_triggers)
+
+    # Expiry times registered when activating are cancelled, also in the global scheduler, and replaced by the
+    # remaining ones
+    for buff_id, _, _, _, _ in buffs:
+        cancel_expiry_times(buffable, buff_id)
+    for buff_id, _, _, _, remaining_times in buffs:
+        for remaining_time in remaining_times:
+            add_expiry_time(buffable, buff_id, now + remaining_time)
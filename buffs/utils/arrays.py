@@ -2,9 +2,9 @@
 
 def copy_triggers(buff_id, spec_triggers, buffable_triggers):
     for trigger in spec_triggers:
-        buffable_triggers[trigger].append(buff_id)
+        buffable_triggers.add_to_set(trigger, buff_id)
 
 
 def delete_triggers(buff_id, spec_triggers, buffable_triggers):
     for trigger in spec_triggers:
-        buffable_triggers.remove_from_list(trigger, buff_id)
+        buffable_triggers.remove_from_set(trigger, buff_id)
@@ -9,4 +9,22 @@ class defaultdictlist(defaultdict):
         if value in self[key]:
             self[key].remove(value)
             if len(self[key]) == 0:
-                del self[key]
\ No newline at end of file
+                del self[key]
+
+
+class defaultdictset(defaultdict):
+    """ A defaultdict of insertion ordered sets, stored as dicts with None values, so values can be added and
+    removed in constant time and still be iterated in the order they were added.
+    """
+    def __init__(self):
+        super(defaultdictset, self).__init__(dict)
+
+    def add_to_set(self, key, value):
+        self[key][value] = None
+
+    def remove_from_set(self, key, value):
+        values = self.get(key)
+        if values is not None and value in values:
+            del values[value]
+            if len(values) == 0:
+                del self[key]
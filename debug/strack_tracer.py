@@ -1,5 +1,7 @@
-from functools import wraps
+import json
+import os
 import types
+import weakref
 
 from models import *
 
@@ -11,44 +13,200 @@ import time
 This module is simply for help debugging. It allows to track function performance bottlenecks and code stack.
 """
 
-# TODO: Read env variable or config
+TRACKING_ENV_VARIABLE = "BUFFS_TRACKING"
+SAMPLE_RATE_ENV_VARIABLE = "BUFFS_TRACKING_SAMPLE_RATE"
+
 _tracking = False
+# The entered TrackStack while tracking is enabled, None otherwise. It's the only thing checked by untracked calls.
+_active_context = None
+# Only 1 in every _sample_rate calls of TrackSampled functions is tracked
+_sample_rate = 1
 
 
 class FunctionTracker(object):
     def __init__(self):
         self.context = None
 
+    def update(self):
+        global _active_context
+        _active_context = self.context if _tracking else None
+
+    def pause(self):
+        global _active_context
+        _active_context = None
+
 
 _tracker = FunctionTracker()
 
 
+def enable_tracking(sample_rate=None):
+    """ Starts tracking calls of decorated functions made inside a TrackStack.
+
+    :param int sample_rate: If given, only 1 in every sample_rate calls of TrackSampled functions is tracked
+    """
+    global _tracking
+    if sample_rate is not None:
+        set_sample_rate(sample_rate)
+    if not _tracking:
+        _tracking = True
+        for func, tracked_function in list(_tracked_functions.items()):
+            tracked_function.track(func)
+    _tracker.update()
+
+
+def disable_tracking():
+    global _tracking
+    if _tracking:
+        _tracking = False
+        for func, tracked_function in list(_tracked_functions.items()):
+            tracked_function.untrack(func)
+    _tracker.update()
+
+
+def is_tracking():
+    return _tracking
+
+
+def set_sample_rate(sample_rate):
+    global _sample_rate
+    _sample_rate = max(1, int(sample_rate))
+
+
+def configure_from_env(environ=None):
+    """ Reads if tracking is enabled and its sample rate from the BUFFS_TRACKING and BUFFS_TRACKING_SAMPLE_RATE
+    environment variables. An invalid sample rate falls back to 1, tracking every call.
+
+    :param dict environ: Defaults to os.environ
+    """
+    if environ is None:
+        environ = os.environ
+    try:
+        set_sample_rate(environ.get(SAMPLE_RATE_ENV_VARIABLE) or 1)
+    except ValueError:
+        set_sample_rate(1)
+    if environ.get(TRACKING_ENV_VARIABLE, "").lower() in ("1", "true", "yes", "on"):
+        enable_tracking()
+    else:
+        disable_tracking()
+
+
 class FunctionStack(object):
+    __slots__ = (
+        "function_reference", "function_name", "value", "args", "kwargs", "start_ns", "end_ns", "children_ns",
+        "called"
+    )
+
     def __init__(self, func, args, kwargs):
         self.function_reference = func
         self.function_name = func.__name__
         self.value = None
         self.args = args
         self.kwargs = kwargs
-        self.delay = 0
+        self.start_ns = 0
+        self.end_ns = 0
+        # Time spent in tracked functions called by this one
+        self.children_ns = 0
         self.called = []
 
+    @property
+    def duration_ns(self):
+        return self.end_ns - self.start_ns
+
+    @property
+    def self_ns(self):
+        return self.duration_ns - self.children_ns
+
+    @property
+    def delay(self):
+        """ Duration in milliseconds """
+        return self.duration_ns / 1e6
+
+
+class FunctionStats(object):
+    """ Aggregated timings of every tracked call of a function, in nanoseconds. """
+    __slots__ = ("function_name", "count", "total_ns", "self_ns", "max_ns")
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.count = 0
+        self.total_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+
+    def add(self, stack):
+        duration_ns = stack.duration_ns
+        self.count += 1
+        self.total_ns += duration_ns
+        self.self_ns += duration_ns - stack.children_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
 
 class TrackStack(object):
-    def __init__(self):
+    """ Tracks calls of functions decorated with Track while in context.
+
+    :param bool keep_args: If the args and return values of the calls are kept, holding references to them
+    """
+    def __init__(self, keep_args=True):
+        self.keep_args = keep_args
+        self.previous_context = None
+        # Calls of TrackSampled functions, including the ones skipped by sampling
+        self.sampled_calls = 0
         self.root_functions = []
+        # Calls being executed, from the outermost to the innermost
         self.current_stack = []
-        self.active_parent = None
+        # Map of function name to its FunctionStats
+        self.stats = {}
+        self.start_ns = 0
 
     def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.previous_context = _tracker.context
         _tracker.context = self
+        _tracker.update()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        _tracker.context = None
-        if exception_type:
-            raise
-        return self
+        _tracker.context = self.previous_context
+        self.previous_context = None
+        _tracker.update()
+
+    def push(self, func, args, kwargs):
+        """ Starts tracking a call, as a child of the call being executed if there's one.
+
+        :rtype: FunctionStack
+        """
+        if self.keep_args:
+            stack = FunctionStack(func, args, kwargs)
+        else:
+            stack = FunctionStack(func, (), None)
+
+        if self.current_stack:
+            self.current_stack[-1].called.append(stack)
+        else:
+            self.root_functions.append(stack)
+        self.current_stack.append(stack)
+        stack.start_ns = time.perf_counter_ns()
+        return stack
+
+    def pop(self, value):
+        """ Finishes tracking the innermost call being executed.
+
+        :rtype: FunctionStack
+        """
+        end_ns = time.perf_counter_ns()
+        stack = self.current_stack.pop()
+        stack.end_ns = end_ns
+        if self.keep_args:
+            stack.value = value
+        if self.current_stack:
+            self.current_stack[-1].children_ns += stack.duration_ns
+
+        stats = self.stats.get(stack.function_name)
+        if stats is None:
+            stats = self.stats[stack.function_name] = FunctionStats(stack.function_name)
+        stats.add(stack)
+        return stack
 
     def print_stack(self):
         for stack in self.root_functions:
@@ -57,6 +215,86 @@ class TrackStack(object):
             if string:
                 print(string)
 
+    def print_stats(self):
+        print("{:<40} {:>8} {:>12} {:>12} {:>12}".format("function", "count", "total ms", "self ms", "max ms"))
+        for stats in sorted(self.stats.values(), key=lambda stats: stats.total_ns, reverse=True):
+            print("{:<40} {:>8} {:>12.3f} {:>12.3f} {:>12.3f}".format(
+                stats.function_name, stats.count, stats.total_ns / 1e6, stats.self_ns / 1e6, stats.max_ns / 1e6
+            ))
+
+    def to_chrome_trace(self):
+        """ Exports the tracked calls in the Chrome trace event format, readable by chrome://tracing or Perfetto.
+
+        :rtype: dict
+        """
+        events = []
+        for stack in _walk_stacks(self.root_functions):
+            events.append({
+                "name": stack.function_name,
+                "ph": "X",
+                "ts": (stack.start_ns - self.start_ns) / 1e3,
+                "dur": stack.duration_ns / 1e3,
+                "pid": 0,
+                "tid": 0,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ns"}
+
+    def to_speedscope(self, name="buffs"):
+        """ Exports the tracked calls as an evented speedscope profile, readable by https://www.speedscope.app
+
+        :param str name: Name of the profile
+        :rtype: dict
+        """
+        frames = []
+        frame_indexes = {}
+        events = []
+        end_ns = self.start_ns
+
+        def add_events(stack):
+            frame_index = frame_indexes.get(stack.function_name)
+            if frame_index is None:
+                frame_index = frame_indexes[stack.function_name] = len(frames)
+                frames.append({"name": stack.function_name})
+            events.append({"type": "O", "frame": frame_index, "at": stack.start_ns - self.start_ns})
+            for called_stack in stack.called:
+                add_events(called_stack)
+            events.append({"type": "C", "frame": frame_index, "at": stack.end_ns - self.start_ns})
+
+        for stack in self.root_functions:
+            add_events(stack)
+            end_ns = max(end_ns, stack.end_ns)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "evented",
+                "name": name,
+                "unit": "nanoseconds",
+                "startValue": 0,
+                "endValue": end_ns - self.start_ns,
+                "events": events,
+            }],
+            "name": name,
+            "exporter": "strack_tracer",
+        }
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+    def save_speedscope(self, path):
+        with open(path, "w") as profile_file:
+            json.dump(self.to_speedscope(), profile_file)
+
+
+def _walk_stacks(stacks):
+    to_visit = list(reversed(stacks))
+    while to_visit:
+        stack = to_visit.pop()
+        yield stack
+        to_visit.extend(reversed(stack.called))
+
 
 def stack_to_string(stack, level):
     string = ""
@@ -93,7 +331,7 @@ def stack_to_string(stack, level):
             function_str += ", "
 
     function_str += ")"
-    string += "{} - {}ms".format(function_str, stack.delay)
+    string += "{} - {:.3f}ms".format(function_str, stack.delay)
 
     if stack.called:
         level += 1
@@ -104,44 +342,125 @@ def stack_to_string(stack, level):
     return string
 
 
-def Track(func):
+class _TrackedFunction(object):
+    """ Code of a decorated function, untracked and tracked. Decorated functions are the undecorated ones, so
+    untracked calls cost nothing. Tracking swaps their code for a trampoline calling the tracking wrapper, so every
+    reference to them is tracked, including the ones imported before tracking was enabled.
+    """
+    __slots__ = ("code", "kwdefaults", "tracked_code", "tracked_kwdefaults")
 
-    if not _tracking:
-        return func
+    def __init__(self, func, make_wrapper):
+        self.code = func.__code__
+        self.kwdefaults = func.__kwdefaults__
 
-    @wraps(func)
-    def wrapper(*args, **kw):
-        if not _tracking or not _tracker.context:
-            return func(*args, **kw)
+        # Copy of the undecorated function, the one called by the wrapper
+        original = types.FunctionType(func.__code__, func.__globals__, func.__name__, func.__defaults__,
+                                      func.__closure__)
+        original.__kwdefaults__ = func.__kwdefaults__
+        original.__qualname__ = func.__qualname__
 
-        # Create the track object
-        stack = FunctionStack(func, args, kw)
+        self.tracked_code = _get_trampoline_code(len(func.__code__.co_freevars)).replace(co_name=func.__name__)
+        self.tracked_kwdefaults = {_TRAMPOLINE_WRAPPER: make_wrapper(original)}
 
-        context = _tracker.context
+    def track(self, func):
+        func.__code__ = self.tracked_code
+        func.__kwdefaults__ = self.tracked_kwdefaults
 
-        # If i got the stack open, add this as a child
-        if context.current_stack:
-            last_stack = context.current_stack[-1]
-            last_stack.called.append(stack)
-        else:
-            context.root_functions.append(stack)
+    def untrack(self, func):
+        func.__code__ = self.code
+        func.__kwdefaults__ = self.kwdefaults
 
-        context.current_stack.append(stack)
 
-        # Run the function
-        start_time = _get_timestamp_ms()
-        ret_value = func(*args, **kw)
-        end_time = _get_timestamp_ms()
+# Map of every decorated function to its _TrackedFunction
+_tracked_functions = weakref.WeakKeyDictionary()
 
-        stack.value = ret_value
+_TRAMPOLINE_WRAPPER = "_strack_wrapper"
 
-        context.current_stack.remove(stack)
+# Map of amount of closure variables to the trampoline code for functions with that amount
+_trampoline_codes = {}
 
-        # Record the delay
-        stack.delay = end_time - start_time
-        return ret_value
-    return wrapper
 
+def _get_trampoline_code(free_variable_amount):
+    """ Code calling the wrapper received as a keyword default. Function code can only be swapped by code with the
+    same amount of closure variables, so the trampoline declares unused ones.
 
-def _get_timestamp_ms():
-    return int(round(time.time() * 1000))
\ No newline at end of file
+    :param int free_variable_amount:
+    :rtype: types.CodeType
+    """
+    code = _trampoline_codes.get(free_variable_amount)
+    if code is None:
+        names = ["_strack_free_{}".format(i) for i in range(free_variable_amount)]
+        source = "def make_trampoline():\n"
+        for name in names:
+            source += "    {} = None\n".format(name)
+        source += "    def trampoline(*args, {}=None, **kw):\n".format(_TRAMPOLINE_WRAPPER)
+        if names:
+            source += "        if 0:\n            {}\n".format(", ".join(names))
+        source += "        return {}(*args, **kw)\n".format(_TRAMPOLINE_WRAPPER)
+        source += "    return trampoline\n"
+        namespace = {}
+        exec(source, namespace)
+        code = _trampoline_codes[free_variable_amount] = namespace["make_trampoline"]().__code__
+    return code
+
+
+def _register_tracked_function(func, make_wrapper):
+    tracked_function = _TrackedFunction(func, make_wrapper)
+    _tracked_functions[func] = tracked_function
+    if _tracking:
+        tracked_function.track(func)
+    return func
+
+
+def Track(func):
+    """ Tracks calls of the function while tracking is enabled and inside a TrackStack. While tracking is disabled,
+    the function is left as it is.
+    """
+    def make_wrapper(original):
+        def wrapper(*args, **kw):
+            context = _active_context
+            if context is None:
+                return original(*args, **kw)
+
+            context.push(original, args, kw)
+            ret_value = None
+            try:
+                ret_value = original(*args, **kw)
+            finally:
+                context.pop(ret_value)
+            return ret_value
+        return wrapper
+    return _register_tracked_function(func, make_wrapper)
+
+
+def TrackSampled(func):
+    """ Like Track, but only 1 in every sample rate calls not made from another tracked call is tracked, with every
+    tracked call it makes. Skipped calls track nothing.
+    """
+    def make_wrapper(original):
+        def wrapper(*args, **kw):
+            context = _active_context
+            if context is None:
+                return original(*args, **kw)
+
+            if not context.current_stack:
+                context.sampled_calls += 1
+                if (context.sampled_calls - 1) % _sample_rate:
+                    _tracker.pause()
+                    try:
+                        return original(*args, **kw)
+                    finally:
+                        _tracker.update()
+
+            context.push(original, args, kw)
+            ret_value = None
+            try:
+                ret_value = original(*args, **kw)
+            finally:
+                context.pop(ret_value)
+            return ret_value
+        return wrapper
+    return _register_tracked_function(func, make_wrapper)
+
+
+configure_from_env()
@@ -1,4 +1,9 @@
-from debug.strack_tracer import TrackStack, Track
+from debug import strack_tracer
+from debug.strack_tracer import TrackStack, Track, TrackSampled
+
+import json
+import os
+import tempfile
 
 import unittest
 from time import sleep
@@ -30,6 +35,11 @@ def parent_function():
 
 class Test_Function_Tracking(unittest.TestCase):
 
+    def setUp(self):
+        strack_tracer.enable_tracking()
+
+    def tearDown(self):
+        strack_tracer.configure_from_env()
 
     def test_propagating_a_derivation_buff(self):
 
@@ -48,4 +58,192 @@ class Test_Function_Tracking(unittest.TestCase):
             assert root_calls[0].called[1].function_name == "heavy_function"
 
             # TODO: Finish this test
-            # track.print_stack()
\ No newline at end of file
+            # track.print_stack()
+
+
+class Test_Tracked_Stats(unittest.TestCase):
+
+    def setUp(self):
+        strack_tracer.enable_tracking()
+
+        def leaf(value):
+            return value
+
+        def branch(value):
+            leaf(value)
+            return leaf(value + 1)
+
+        def root():
+            branch(1)
+            return branch(2)
+
+        # Rebinding the names makes the closures call the tracked functions
+        leaf, branch, root = Track(leaf), Track(branch), Track(root)
+        self.root = root
+
+    def tearDown(self):
+        strack_tracer.configure_from_env()
+
+    def test_calls_are_nested(self):
+        with TrackStack() as track:
+            self.root()
+
+        root_call = track.root_functions[0]
+        assert root_call.value == 3
+        assert [stack.function_name for stack in root_call.called] == ["branch", "branch"]
+        assert [stack.args for stack in root_call.called[1].called] == [(2,), (3,)]
+        assert track.current_stack == []
+
+    def test_aggregated_stats(self):
+        with TrackStack() as track:
+            self.root()
+
+        assert track.stats["root"].count == 1
+        assert track.stats["branch"].count == 2
+        assert track.stats["leaf"].count == 4
+
+        root_stats = track.stats["root"]
+        branch_stats = track.stats["branch"]
+        assert root_stats.max_ns == root_stats.total_ns
+        assert root_stats.self_ns == root_stats.total_ns - branch_stats.total_ns
+        assert branch_stats.self_ns == branch_stats.total_ns - track.stats["leaf"].total_ns
+
+    def test_not_keeping_args(self):
+        with TrackStack(keep_args=False) as track:
+            self.root()
+
+        root_call = track.root_functions[0]
+        assert root_call.value is None
+        assert root_call.called[0].args == ()
+        assert track.stats["leaf"].count == 4
+
+    def test_call_raising_is_popped(self):
+        @Track
+        def failing():
+            raise ValueError()
+
+        with TrackStack() as track:
+            with self.assertRaises(ValueError):
+                failing()
+
+        assert track.current_stack == []
+        assert track.stats["failing"].count == 1
+
+    def test_speedscope_export(self):
+        with TrackStack() as track:
+            self.root()
+
+        profile = track.to_speedscope()
+        frames = [frame["name"] for frame in profile["shared"]["frames"]]
+        events = profile["profiles"][0]["events"]
+        assert frames == ["root", "branch", "leaf"]
+        assert len(events) == 14
+        assert [event["type"] for event in events[:3]] == ["O", "O", "O"]
+        assert events[-1] == {"type": "C", "frame": 0, "at": profile["profiles"][0]["endValue"]}
+        assert [event["at"] for event in events] == sorted(event["at"] for event in events)
+
+    def test_chrome_trace_export(self):
+        with TrackStack() as track:
+            self.root()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            track.save_chrome_trace(path)
+            with open(path) as trace_file:
+                trace = json.load(trace_file)
+
+        names = [event["name"] for event in trace["traceEvents"]]
+        assert names == ["root", "branch", "leaf", "leaf", "branch", "leaf", "leaf"]
+        assert all(event["ph"] == "X" for event in trace["traceEvents"])
+
+
+class Test_Tracking_Toggle(unittest.TestCase):
+
+    def setUp(self):
+        @Track
+        def leaf():
+            return 1
+
+        @TrackSampled
+        def sampled():
+            return leaf()
+
+        self.leaf = leaf
+        self.sampled = sampled
+
+    def tearDown(self):
+        strack_tracer.configure_from_env()
+
+    def test_enabling_and_disabling_at_runtime(self):
+        strack_tracer.disable_tracking()
+        with TrackStack() as track:
+            self.leaf()
+            strack_tracer.enable_tracking()
+            self.leaf()
+            strack_tracer.disable_tracking()
+            self.leaf()
+
+        assert track.stats["leaf"].count == 1
+
+    def test_untracked_functions_are_not_wrapped(self):
+        def untracked(value, increment=1, *, multiplier=2):
+            return (value + increment) * multiplier
+        code = untracked.__code__
+
+        strack_tracer.disable_tracking()
+        assert Track(untracked) is untracked
+        assert untracked.__code__ is code
+
+        strack_tracer.enable_tracking()
+        with TrackStack() as track:
+            assert untracked(1, multiplier=3) == 6
+        assert track.stats["untracked"].count == 1
+
+        strack_tracer.disable_tracking()
+        assert untracked.__code__ is code
+        assert untracked(1) == 4
+
+    def test_references_taken_before_enabling_are_tracked(self):
+        leaf = self.leaf
+        strack_tracer.enable_tracking()
+        with TrackStack() as track:
+            leaf()
+
+        assert track.stats["leaf"].count == 1
+
+    def test_calls_outside_track_stack_are_not_tracked(self):
+        strack_tracer.enable_tracking()
+        with TrackStack() as track:
+            pass
+        self.leaf()
+
+        assert track.root_functions == []
+
+    def test_sampling_calls(self):
+        strack_tracer.enable_tracking(sample_rate=3)
+        with TrackStack() as track:
+            for _ in range(7):
+                self.sampled()
+
+        assert track.sampled_calls == 7
+        assert track.stats["sampled"].count == 3
+        # Calls made by skipped calls are skipped too
+        assert track.stats["leaf"].count == 3
+        assert [stack.called[0].function_name for stack in track.root_functions] == ["leaf"] * 3
+
+    def test_configuring_from_env(self):
+        strack_tracer.configure_from_env({"BUFFS_TRACKING": "1", "BUFFS_TRACKING_SAMPLE_RATE": "2"})
+        assert strack_tracer.is_tracking()
+        with TrackStack() as track:
+            for _ in range(4):
+                self.sampled()
+        assert track.stats["sampled"].count == 2
+
+        strack_tracer.configure_from_env({})
+        assert not strack_tracer.is_tracking()
+        assert strack_tracer._sample_rate == 1
+
+    def test_invalid_sample_rate_in_env(self):
+        strack_tracer.configure_from_env({"BUFFS_TRACKING": "1", "BUFFS_TRACKING_SAMPLE_RATE": "abc"})
+        assert strack_tracer.is_tracking()
+        assert strack_tracer._sample_rate == 1
@@ -2,6 +2,11 @@
 
 class BuffErrorCodes(object):
     REMOVING_BUFF_NOT_FROM_SOURCE = 1
+    DERIVATION_LOOP = 2
+    EVENT_CHAIN_TOO_DEEP = 3
+    SPEC_FROZEN = 4
+    INVALID_SNAPSHOT = 5
+    AMBIGUOUS_TYPE_NAME = 6
 
 
 class BuffException(Exception):
@@ -0,0 +1,666 @@
+""" Benchmark suite of the buff calls over a seeded random world of castles, players and equipments.
+
+Every benchmark times each call on its own, reporting ops/sec and p50/p99 latencies. Results can be saved as a JSON
+baseline and later runs compared against it to catch regressions. Micro benchmarks measure single features on their
+own, most of them against the alternative they replaced, along with the memory used per buffable. From the repository
+root:
+
+    PYTHONPATH=.:buffs python -m test.benchmark_suite --scale 10 --save baseline.json
+    PYTHONPATH=.:buffs python -m test.benchmark_suite --scale 10 --compare baseline.json
+    PYTHONPATH=.:buffs python -m test.benchmark_suite --micro
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import buffspecs
+import metrics
+
+from api import add_buff, add_buff_many, call_event, remove_buff
+from attributes import set_deferred_calculation
+from buffable import expire_buffs
+from expiry import FixedTime, get_timestamp
+from models import Buffable, AddBuffEvent, BuffPropagatedEvent, modification_ids
+from propagation import get_propagation_source
+from snapshot import save_buffables, restore_buffables
+from utils.arrays import copy_triggers, delete_triggers
+from utils.dict_magic import defaultdictlist, defaultdictset
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Castle, Player, Equipment, CompleteBuildingEvent, FartEvent, DamageEvent
+
+from test.test_data.specs import (
+    Attributes
+)
+
+
+class ScenarioConfig(object):
+    """ Size of the benchmark world. Scaling it multiplies the amount of buffables, specs and calls. """
+    def __init__(self, castles=2, players_per_castle=5, equipments_per_player=2, specs=20, derivation_depth=3,
+                 max_stack=3, expiry_pct=25, events=200, reads=1000, seed=1234):
+        self.castles = castles
+        self.players_per_castle = players_per_castle
+        self.equipments_per_player = equipments_per_player
+        self.specs = specs
+        self.derivation_depth = derivation_depth
+        self.max_stack = max_stack
+        self.expiry_pct = expiry_pct
+        self.events = events
+        self.reads = reads
+        self.seed = seed
+
+    def scaled(self, scale):
+        """ Copies this config multiplying the amount of buffables, specs and calls, keeping the propagation fan-out.
+
+        :param float scale:
+        :rtype: ScenarioConfig
+        """
+        return ScenarioConfig(
+            castles=max(1, int(self.castles * scale)),
+            players_per_castle=self.players_per_castle,
+            equipments_per_player=self.equipments_per_player,
+            specs=max(1, int(self.specs * scale)),
+            derivation_depth=self.derivation_depth,
+            max_stack=self.max_stack,
+            expiry_pct=self.expiry_pct,
+            events=max(1, int(self.events * scale)),
+            reads=max(1, int(self.reads * scale)),
+            seed=self.seed,
+        )
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class Scenario(object):
+    """ A seeded random world of buffables and the buffs each one of them will get. Its buff specs are registered
+    along with the ones already registered.
+    """
+    def __init__(self, config):
+        self.config = config
+        # Own generator, so the scenario neither depends on nor changes the global random state
+        self.random = random.Random(config.seed)
+
+        self.castles = []
+        self.players = []
+        self.equipments = []
+        for _ in range(config.castles):
+            castle = Castle()
+            for _ in range(config.players_per_castle):
+                player = Player()
+                player.castle = castle
+                castle.players.append(player)
+                for _ in range(config.equipments_per_player):
+                    equipment = Equipment()
+                    equipment.owner = player
+                    self.equipments.append(equipment)
+                self.players.append(player)
+            self.castles.append(castle)
+        self.buffables = self.castles + self.players + self.equipments
+
+        for buffable in self.buffables:
+            for attribute_id in Attributes:
+                buffable.attributes[attribute_id] = self.random.randrange(1, 100)
+
+        # List of (owner buffable, buff spec, amount of times it's added)
+        self.buffs = []
+        for _ in range(config.specs):
+            self.buffs.append(self._random_buff())
+        for depth in range(min(config.derivation_depth, len(Attributes) - 1)):
+            self.buffs.append(self._derivation_buff(depth))
+
+        self.max_duration = max([buff_spec.duration_seconds for _, buff_spec, _ in self.buffs] + [0])
+
+    def _random_buff(self):
+        builder = BuffBuilder()
+        modifier = random_modifier(self.random)
+        builder.modify(*modifier)
+
+        apply_on, propagate_to = random_targets(self.random)
+        if propagate_to is not None:
+            builder.propagates_to(propagate_to)
+
+        # Propagated derivations need the propagation source, so they can't be triggered by other events
+        if propagate_to is not None and chance_pct(self.random, 25):
+            builder.propagates_to_attribute(random_attribute(self.random))
+        elif chance_pct(self.random, 50):
+            builder.whenever(FartEvent)
+
+        stacks = self.random.randrange(1, self.config.max_stack + 1)
+        builder.stacks(stacks)
+
+        if chance_pct(self.random, self.config.expiry_pct):
+            builder.buff_spec.duration_seconds = self.random.randrange(1, 60)
+
+        return self._random_buffable(apply_on), builder.build(), stacks
+
+    def _derivation_buff(self, depth):
+        # Each derivation buff derivates an attribute into the next one, so they chain without loops
+        attributes = list(Attributes)
+        buff_spec = BuffBuilder().modify("%", 0.1, attributes[depth]).to_attribute(attributes[depth + 1]).build()
+        return self.random.choice(self.players), buff_spec, 1
+
+    def _random_buffable(self, buffable_class):
+        if buffable_class == Castle:
+            return self.random.choice(self.castles)
+        if buffable_class == Player:
+            return self.random.choice(self.players)
+        return self.random.choice(self.equipments)
+
+
+class BenchmarkResult(object):
+    def __init__(self, name, latencies_ns):
+        self.name = name
+        self.count = len(latencies_ns)
+        latencies_ns = sorted(latencies_ns)
+        total_ns = sum(latencies_ns)
+        self.ops_per_sec = self.count / (total_ns / 1e9) if total_ns else 0.0
+        self.p50_us = percentile(latencies_ns, 50) / 1e3
+        self.p99_us = percentile(latencies_ns, 99) / 1e3
+
+    def to_dict(self):
+        return {"count": self.count, "ops_per_sec": self.ops_per_sec, "p50_us": self.p50_us, "p99_us": self.p99_us}
+
+    def __str__(self):
+        return "{:<24} {:>8} calls {:>12.0f} ops/sec  p50 {:>9.2f}us  p99 {:>9.2f}us".format(
+            self.name, self.count, self.ops_per_sec, self.p50_us, self.p99_us
+        )
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def timed_calls(calls):
+    """ Times each call on its own.
+
+    :param iterable calls: Callables without arguments
+    :rtype: list[int]
+    :returns The latency of each call in nanoseconds
+    """
+    clock = time.perf_counter_ns
+    latencies = []
+    for call in calls:
+        start = clock()
+        call()
+        latencies.append(clock() - start)
+    return latencies
+
+
+def run_suite(config, repeat=1, warmup=0):
+    """ Builds the scenario and benchmarks, in order, add_buff, call_event, attribute reads, expiry sweeps and
+    remove_buff over it. Every run builds the same scenario again, latencies of all runs but the warmups are pooled.
+
+    :param ScenarioConfig config:
+    :param int repeat: Amount of measured runs
+    :param int warmup: Amount of runs done before measuring
+    :rtype: list[BenchmarkResult]
+    """
+    pooled_latencies = {}
+    for run in range(warmup + repeat):
+        # Specs of the previous runs are not used anymore
+        buffspecs.clear()
+        latencies = _run_scenario(config)
+        if run < warmup:
+            continue
+        for name, run_latencies in latencies:
+            pooled_latencies.setdefault(name, []).extend(run_latencies)
+    return [BenchmarkResult(name, latencies) for name, latencies in pooled_latencies.items()]
+
+
+def _run_scenario(config):
+    """ Runs all benchmarks once over a new scenario.
+
+    :param ScenarioConfig config:
+    :rtype: list[tuple[str, list[int]]]
+    """
+    scenario = Scenario(config)
+    rng = scenario.random
+    results = []
+    now = get_timestamp()
+
+    with FixedTime(now):
+        add_calls = []
+        for owner, buff_spec, stacks in scenario.buffs:
+            for _ in range(stacks):
+                add_calls.append(lambda owner=owner, buff_spec=buff_spec: add_buff(
+                    owner, buff_spec, CompleteBuildingEvent()
+                ))
+        results.append(("add_buff", timed_calls(add_calls)))
+
+        event_calls = []
+        for _ in range(config.events):
+            event_class = FartEvent if chance_pct(rng, 50) else DamageEvent
+            event = event_class(rng.choice(scenario.buffables))
+            event_calls.append(lambda event=event: call_event(event))
+        results.append(("call_event", timed_calls(event_calls)))
+
+        attributes = list(Attributes)
+        read_calls = []
+        for _ in range(config.reads):
+            buffable = rng.choice(scenario.buffables)
+            attribute_id = rng.choice(attributes)
+            read_calls.append(lambda buffable=buffable, attribute_id=attribute_id: buffable.attributes[attribute_id])
+        results.append(("attribute_read", timed_calls(read_calls)))
+
+    expired_at = now + scenario.max_duration
+    with FixedTime(expired_at):
+        sweep_calls = [
+            lambda buffable=buffable: expire_buffs(buffable, expired_at)
+            for buffable in scenario.buffables if buffable.expiry_times
+        ]
+        results.append(("expiry_sweep", timed_calls(sweep_calls)))
+
+        remove_calls = [
+            lambda owner=owner, buff_id=buff_spec.buff_id: remove_buff(owner, buff_id)
+            for owner, buff_spec, _ in scenario.buffs
+        ]
+        results.append(("remove_buff", timed_calls(remove_calls)))
+
+    return results
+
+
+def run_micro_benchmarks(scale=1):
+    """ Runs every micro benchmark once, each one over its own specs.
+
+    :param float scale: Multiplies the amount of calls of each benchmark
+    :rtype: list[BenchmarkResult]
+    """
+    results = []
+    for benchmark, iterations in MICRO_BENCHMARKS:
+        buffspecs.clear()
+        for name, latencies in benchmark(max(1, int(iterations * scale))):
+            results.append(BenchmarkResult(name, latencies))
+    return results
+
+
+def measure_memory(amount=500):
+    """ Measures the memory allocated per buffable and per active buff, for buffables storing their attributes in a
+    dict and in columns.
+
+    :param int amount: Amount of buffables created for each measure
+    :rtype: list[tuple[str, float]]
+    :returns Tuples of (measure name, bytes)
+    """
+    buffspecs.clear()
+    buffs = [
+        BuffBuilder().modify("+", 10, Attributes.ATK).modify("%", 0.1, Attributes.DEF).build()
+        for _ in range(5)
+    ]
+
+    class ColumnBuffable(Buffable):
+        attribute_set = Attributes
+
+    def create_buffables(buffable_class, with_buffs):
+        buffables = []
+        for _ in range(amount):
+            buffable = buffable_class()
+            for attribute_id in Attributes:
+                buffable.attributes[attribute_id] = 100
+            if with_buffs:
+                for buff_spec in buffs:
+                    add_buff(buffable, buff_spec, CompleteBuildingEvent())
+            buffables.append(buffable)
+        return buffables
+
+    measures = []
+    for name, buffable_class in (("dict", Buffable), ("column", ColumnBuffable)):
+        bytes_per_buffable = allocated_bytes(create_buffables, buffable_class, False) / amount
+        bytes_with_buffs = allocated_bytes(create_buffables, buffable_class, True) / amount
+        measures.append(("{}_buffable".format(name), bytes_per_buffable))
+        measures.append(("{}_active_buff".format(name), (bytes_with_buffs - bytes_per_buffable) / len(buffs)))
+    return measures
+
+
+def allocated_bytes(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return allocated
+
+
+def _bench_modification_ids(iterations):
+    buff_spec = BuffBuilder().modify("+", 10, Attributes.ATK).modify("%", 0.1, Attributes.DEF).build()
+
+    def add_and_remove():
+        buffable = Buffable()
+        add_buff(buffable, buff_spec, CompleteBuildingEvent())
+        remove_buff(buffable, buff_spec.buff_id)
+
+    try:
+        modification_ids.use_uuid()
+        uuid_latencies = timed_calls([add_and_remove] * iterations)
+    finally:
+        modification_ids.use_counter()
+    return [
+        ("activation_uuid_ids", uuid_latencies),
+        ("activation_counter_ids", timed_calls([add_and_remove] * iterations)),
+    ]
+
+
+def _bench_bulk_add(iterations):
+    # add_buff_many is timed per batch of 100 buffables, add_buff per buffable
+    buff_spec = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+    loop_calls = [
+        lambda buffable=Buffable(): add_buff(buffable, buff_spec, CompleteBuildingEvent())
+        for _ in range(iterations)
+    ]
+    bulk_calls = [
+        lambda buffables=[Buffable() for _ in range(100)]: add_buff_many(buffables, buff_spec, CompleteBuildingEvent())
+        for _ in range(max(1, iterations // 100))
+    ]
+    return [("add_buff_loop", timed_calls(loop_calls)), ("add_buff_many_100", timed_calls(bulk_calls))]
+
+
+def _bench_deferred_calculation(iterations):
+    buffs = [
+        BuffBuilder().modify("+", 10, Attributes.ATK).modify("%", 0.1, Attributes.ATK).build(),
+        BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build(),
+        BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.HP).build(),
+    ]
+
+    def add_and_read():
+        buffable = Buffable()
+        buffable.attributes[Attributes.ATK] = 100
+        for buff_spec in buffs:
+            add_buff(buffable, buff_spec, CompleteBuildingEvent())
+        return buffable.attributes[Attributes.HP]
+
+    eager_latencies = timed_calls([add_and_read] * iterations)
+    try:
+        set_deferred_calculation(True)
+        deferred_latencies = timed_calls([add_and_read] * iterations)
+    finally:
+        set_deferred_calculation(False)
+    return [("derivation_eager", eager_latencies), ("derivation_deferred", deferred_latencies)]
+
+
+def _bench_derivation_graphs(iterations):
+    deep_edges = [("attribute_{}".format(i), "attribute_{}".format(i + 1)) for i in range(50)]
+    wide_edges = [("attribute_0", "attribute_{}".format(i + 1)) for i in range(50)]
+    # attribute_0 -> 10 middle attributes -> attribute_sink_0 -> 10 deep chain
+    diamond_edges = [("attribute_0", "attribute_middle_{}".format(i)) for i in range(10)]
+    diamond_edges += [("attribute_middle_{}".format(i), "attribute_sink_0") for i in range(10)]
+    diamond_edges += [("attribute_sink_{}".format(i), "attribute_sink_{}".format(i + 1)) for i in range(10)]
+
+    results = []
+    for name, edges in (("derivation_deep_50", deep_edges), ("derivation_wide_50", wide_edges),
+                        ("derivation_diamond", diamond_edges)):
+        # Every graph uses the same attribute names, so their specs can't be registered together
+        buffspecs.clear()
+        buffable = Buffable()
+        buffable.attributes["attribute_0"] = 100
+        for source_attribute_id, derivated_attribute_id in edges:
+            buff_spec = BuffBuilder().modify("%", 0.5, source_attribute_id).to_attribute(derivated_attribute_id).build()
+            add_buff(buffable, buff_spec, CompleteBuildingEvent())
+        bonus = BuffBuilder().modify("+", 10, "attribute_0").build()
+
+        def change_source(buffable=buffable, bonus=bonus):
+            add_buff(buffable, bonus, CompleteBuildingEvent())
+            remove_buff(buffable, bonus.buff_id)
+
+        results.append((name, timed_calls([change_source] * iterations)))
+    return results
+
+
+def _bench_trigger_indexes(iterations):
+    pending = 500
+
+    def list_triggers():
+        triggers = defaultdictlist()
+        for buff_id in range(pending):
+            triggers["FartEvent"].append(buff_id)
+        for buff_id in reversed(range(pending)):
+            triggers.remove_from_list("FartEvent", buff_id)
+
+    def set_triggers():
+        triggers = defaultdictset()
+        for buff_id in range(pending):
+            copy_triggers(buff_id, ["FartEvent"], triggers)
+        for buff_id in reversed(range(pending)):
+            delete_triggers(buff_id, ["FartEvent"], triggers)
+
+    buffable = Buffable()
+    for _ in range(300):
+        add_buff(buffable, BuffBuilder().modify("+", 1, Attributes.ATK).whenever(FartEvent).build(),
+                 CompleteBuildingEvent())
+    buff_spec = BuffBuilder().modify("+", 1, Attributes.DEF).build()
+
+    def add_and_remove():
+        add_buff(buffable, buff_spec, CompleteBuildingEvent())
+        remove_buff(buffable, buff_spec.buff_id)
+
+    # Filling and emptying the indexes is slow, it's done once every 40 calls
+    index_iterations = max(1, iterations // 40)
+    return [
+        ("triggers_list_500", timed_calls([list_triggers] * index_iterations)),
+        ("triggers_set_500", timed_calls([set_triggers] * index_iterations)),
+        ("add_300_pending", timed_calls([add_and_remove] * iterations)),
+    ]
+
+
+def _bench_event_fast_path(iterations):
+    # Buffables only waiting for fart events, so damage events can't trigger anything
+    buffables = [Buffable() for _ in range(100)]
+    for buffable in buffables:
+        add_buff(buffable, BuffBuilder().modify("+", 1, Attributes.ATK).whenever(FartEvent).build(),
+                 CompleteBuildingEvent())
+    event_calls = [
+        lambda event=DamageEvent(buffables[index % len(buffables)]): call_event(event) for index in range(iterations)
+    ]
+    return [("event_fast_path", timed_calls(event_calls))]
+
+
+def _bench_propagation_targets(iterations):
+    castle = Castle()
+    castle.players = [Player() for _ in range(200)]
+    buff_spec = BuffBuilder().modify("+", 1, Attributes.ATK).propagates_to(Equipment, Player).build()
+
+    def add_and_remove():
+        add_buff(castle, buff_spec, CompleteBuildingEvent())
+        remove_buff(castle, buff_spec.buff_id)
+
+    return [("propagate_200", timed_calls([add_and_remove] * iterations))]
+
+
+def _bench_propagation_source(iterations):
+    castle = Castle()
+    event = BuffPropagatedEvent(Player(), castle, 1, CompleteBuildingEvent())
+    for _ in range(50):
+        event = AddBuffEvent(castle, 1, event)
+    return [("propagation_source_50", timed_calls([lambda: get_propagation_source(event)] * iterations))]
+
+
+def _bench_buff_toggle(iterations):
+    def is_farting(event):
+        return isinstance(event, FartEvent)
+    buffspecs.register_condition_function(is_farting)
+
+    buffable = Buffable()
+    buff_spec = BuffBuilder().modify("+", 1, Attributes.ATK).whenever(FartEvent).just_if("is_farting").build()
+    buff_spec.deactivation_triggers = [DamageEvent]
+    buffspecs.finalize()
+    add_buff(buffable, buff_spec, CompleteBuildingEvent())
+    fart_event = FartEvent(buffable)
+    damage_event = DamageEvent(buffable)
+
+    def toggle():
+        call_event(fart_event)
+        call_event(damage_event)
+
+    latencies = timed_calls([toggle] * iterations)
+    try:
+        metrics.enable_metrics()
+        metrics_latencies = timed_calls([toggle] * iterations)
+    finally:
+        metrics.disable_metrics()
+    return [("buff_toggle", latencies), ("buff_toggle_metrics", metrics_latencies)]
+
+
+def _bench_snapshot(iterations):
+    buffs = [BuffBuilder().modify("+", 10, Attributes.ATK).stacks(2).build() for _ in range(3)]
+    buffs.append(BuffBuilder().modify("%", 0.1, Attributes.ATK).to_attribute(Attributes.DEF)
+                 .propagates_to(Player).build())
+    buffs[0].duration_seconds = 60
+
+    def create_world():
+        # Players, each one followed by its equipment
+        buffables = []
+        for _ in range(iterations):
+            player = Player()
+            equipment = Equipment()
+            equipment.owner = player
+            buffables.append(player)
+            buffables.append(equipment)
+        return buffables
+
+    buffables = create_world()
+    for player, equipment in zip(buffables[::2], buffables[1::2]):
+        for attribute_id in Attributes:
+            player.attributes[attribute_id] = 100
+        for buff_spec in buffs[:3]:
+            add_buff(player, buff_spec, CompleteBuildingEvent())
+        add_buff(equipment, buffs[3], CompleteBuildingEvent())
+
+    attribute_ids = list(Attributes)
+    data = save_buffables(buffables, attribute_ids)
+    restored_buffables = create_world()
+    return [
+        ("snapshot_save", timed_calls([lambda: save_buffables(buffables, attribute_ids)])),
+        ("snapshot_restore", timed_calls([lambda: restore_buffables(data, restored_buffables, attribute_ids)])),
+    ]
+
+
+# Micro benchmarks with their amount of calls, the snapshot ones save and restore that many players at once
+MICRO_BENCHMARKS = [
+    (_bench_modification_ids, 2000),
+    (_bench_bulk_add, 2000),
+    (_bench_deferred_calculation, 1000),
+    (_bench_derivation_graphs, 200),
+    (_bench_trigger_indexes, 2000),
+    (_bench_event_fast_path, 50000),
+    (_bench_propagation_targets, 100),
+    (_bench_propagation_source, 10000),
+    (_bench_buff_toggle, 10000),
+    (_bench_snapshot, 1000),
+]
+
+
+def save_baseline(path, config, results):
+    with open(path, "w") as baseline_file:
+        json.dump({
+            "config": config.to_dict(),
+            "results": {result.name: result.to_dict() for result in results}
+        }, baseline_file, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(path, results, tolerance=0.2):
+    """ Compares results to a saved baseline.
+
+    :param str path:
+    :param list[BenchmarkResult] results:
+    :param float tolerance: Fraction of ops/sec a benchmark can lose before it counts as a regression
+    :rtype: list[str]
+    :returns A description of each regression found
+    """
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get(result.name)
+        if not baseline_result or not baseline_result["ops_per_sec"]:
+            continue
+        ratio = result.ops_per_sec / baseline_result["ops_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append("{} went from {:.0f} to {:.0f} ops/sec ({:.0%})".format(
+                result.name, baseline_result["ops_per_sec"], result.ops_per_sec, ratio - 1
+            ))
+    return regressions
+
+
+def chance_pct(rng, pct):
+    return pct >= rng.randrange(0, 100)
+
+
+def random_targets(rng):
+    possible_targets = [Player, Equipment, Castle]
+    apply_on = rng.choice(possible_targets)
+
+    if apply_on == Player:
+        possible_targets = []
+
+    if apply_on == Castle:
+        possible_targets = [Player, Equipment]
+
+    if apply_on == Equipment:
+        possible_targets = [Player]
+
+    propagate_to = None
+    if possible_targets:
+        propagate_to = rng.choice(possible_targets)
+    return apply_on, propagate_to
+
+
+def random_attribute(rng, exlude=None):
+    attrs = list(Attributes)
+    if exlude:
+        attrs.remove(exlude)
+    return rng.choice(attrs)
+
+
+def random_modifier(rng):
+    op = "+"
+    attribute_id = random_attribute(rng)
+    value = rng.randrange(1, 150)
+    if bool(rng.getrandbits(1)):
+        op = "%"
+        value = value / 100
+    return op, value, attribute_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the buff calls over a seeded random world")
+    parser.add_argument("--scale", type=float, default=1, help="Multiplies the amount of buffables, specs and calls")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=5, help="Amount of measured runs")
+    parser.add_argument("--warmup", type=int, default=1, help="Amount of runs done before measuring")
+    parser.add_argument("--save", help="Saves the results as a JSON baseline")
+    parser.add_argument("--compare", help="Compares the results to a JSON baseline, failing on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Fraction of ops/sec a benchmark can lose")
+    parser.add_argument("--micro", action="store_true", help="Also runs the micro benchmarks and measures memory")
+    args = parser.parse_args(argv)
+
+    config = ScenarioConfig(seed=args.seed).scaled(args.scale)
+    results = run_suite(config, args.repeat, args.warmup)
+    if args.micro:
+        results += run_micro_benchmarks(args.scale)
+    for result in results:
+        print(result)
+
+    if args.micro:
+        for name, allocated in measure_memory():
+            print("{:<24} {:>8.0f} bytes".format(name, allocated))
+
+    if args.save:
+        save_baseline(args.save, config, results)
+
+    if args.compare:
+        regressions = compare_to_baseline(args.compare, results, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,8 @@ from test.test_data.specs import (
 )
 
 
+from attributes import set_deferred_calculation
+
 import unittest
 
 class Test_Buff_Propagation_With_Derivation(unittest.TestCase):
@@ -68,9 +70,13 @@ class Test_Buff_Propagation_With_Derivation(unittest.TestCase):
 		# 50% of the EQUIPMENT ATK (100) should have gone to player DEF
 		assert player.attributes[Attributes.DEF] == equipment.attributes[Attributes.ATK] * 0.5
 
+		# The propagator indexed the buff as depending on its ATK
+		assert equipment.propagated_derivations == {Attributes.ATK: {equipment_buff_2.buff_id: None}}
+
 		# If we remove the propagation source, the propagation targets attributes needs to be updated
 		remove_buff(equipment, equipment_buff_2.buff_id)
 		assert player.attributes[Attributes.DEF] == 0
+		assert equipment.propagated_derivations == {}
 
 	def test_propagating_a_derivation_buff(self):
 		player = Player()
@@ -166,3 +172,12 @@ class Test_Buff_Propagation_With_Derivation(unittest.TestCase):
 		assert player.attributes[Attributes.HP] == 25
 
 
+class Test_Buff_Propagation_With_Derivation_Deferred(Test_Buff_Propagation_With_Derivation):
+	""" Same scenarios calculating the attribute final values only when they are read """
+
+	def setUp(self):
+		super(Test_Buff_Propagation_With_Derivation_Deferred, self).setUp()
+		set_deferred_calculation(True)
+
+	def tearDown(self):
+		set_deferred_calculation(False)
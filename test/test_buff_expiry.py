@@ -44,7 +44,7 @@ class Test_3_Buffs(unittest.TestCase):
 			assert buff.buff_id in buffable.active_buffs
 
 			# Check the expiry time was registered
-			registered_expiry_time, buff_id = buffable.expiry_times[0]
+			registered_expiry_time, buff_id, generation = buffable.expiry_times[0]
 			assert registered_expiry_time == expiry_time
 			assert buff_id == buff.buff_id
 
@@ -157,3 +157,29 @@ class Test_3_Buffs(unittest.TestCase):
 				assert len(buffable.expiry_times) == 0
 
 
+	def test_removing_buff_cancels_expiry(self):
+		buffable = Buffable()
+
+		buff = BuffSpec(1)
+		buff.duration_seconds = 10
+		buff.modifiers = [Modifier("+", 50, Attributes.DEF)]
+
+		with FixedTime(get_timestamp()):
+			expiry_time = get_timestamp() + buff.duration_seconds
+			add_buff(buffable, buff, CompleteBuildingEvent())
+			remove_buff(buffable, buff.buff_id)
+
+			# Adding it again later on, the old expiry time should not expire the new buff
+			with FixedTime(expiry_time - 5):
+				add_buff(buffable, buff, CompleteBuildingEvent())
+
+		with FixedTime(expiry_time):
+			assert buffable.attributes[Attributes.DEF] == 50
+			assert buff.buff_id in buffable.active_buffs
+
+		with FixedTime(expiry_time + 5):
+			assert buffable.attributes[Attributes.DEF] == 0
+			assert buff.buff_id not in buffable.active_buffs
+			# The buff is gone, so is its expiry generation
+			assert buff.buff_id not in buffable.expiry_generations
+
@@ -0,0 +1,112 @@
+import buffspecs
+import expiry
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Attributes, CompleteBuildingEvent
+
+from api import add_buff, remove_buff, tick
+from models import Buffable
+from expiry import get_timestamp, FixedTime, clear_fixed_time
+
+import unittest
+
+
+class Test_Buff_Expiry_Tick(unittest.TestCase):
+
+	def setUp(self):
+		buffspecs.clear()
+		expiry.enable_global_expiry()
+
+	def tearDown(self):
+		expiry.disable_global_expiry()
+		clear_fixed_time()
+
+	def test_tick_expires_buffs_without_reading(self):
+		buffables = [Buffable() for i in range(3)]
+		buff = BuffBuilder().modify("+", 50, Attributes.DEF).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			for buffable in buffables:
+				add_buff(buffable, buff, CompleteBuildingEvent())
+
+		# Nothing to expire yet
+		assert tick(now + 5) == []
+
+		results = tick(now + 10)
+		assert len(results) == 3
+		for result, buffable in zip(results, buffables):
+			assert len(result.removed_modifications) == 1
+
+			# Buffs were expired before anyone read the attributes
+			assert buff.buff_id not in buffable.active_buffs
+			assert len(buffable.expiry_times) == 0
+
+	def test_tick_in_batches(self):
+		buffables = [Buffable() for i in range(5)]
+		buff = BuffBuilder().modify("+", 50, Attributes.DEF).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			for buffable in buffables:
+				add_buff(buffable, buff, CompleteBuildingEvent())
+
+		assert len(tick(now + 10, max_buffables=2)) == 2
+		assert len(tick(now + 10, max_buffables=2)) == 2
+		assert len(tick(now + 10, max_buffables=2)) == 1
+		assert all(buff.buff_id not in buffable.active_buffs for buffable in buffables)
+
+	def test_tick_ignores_buffs_expired_by_reading(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 50, Attributes.DEF).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			add_buff(buffable, buff, CompleteBuildingEvent())
+
+		with FixedTime(now + 10):
+			assert buffable.attributes[Attributes.DEF] == 0
+
+		assert tick(now + 10) == []
+
+	def test_tick_drops_cancelled_expiries(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 50, Attributes.DEF).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			add_buff(buffable, buff, CompleteBuildingEvent())
+		remove_buff(buffable, buff.buff_id)
+
+		assert expiry.get_due_buffables(now + 10) == []
+		assert len(expiry._scheduler) == 0
+
+	def test_tick_drops_expiries_handled_by_a_previous_batch(self):
+		buffables = [Buffable() for i in range(2)]
+		buff = BuffBuilder().modify("+", 50, Attributes.DEF).stacks(2).build()
+		buff.duration_seconds = 10
+		other_buff = BuffBuilder().modify("+", 50, Attributes.ATK).build()
+		other_buff.duration_seconds = 20
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			# The first buffable expiry times are due before the second one, and it has one due later
+			add_buff(buffables[0], buff, CompleteBuildingEvent())
+			add_buff(buffables[0], buff, CompleteBuildingEvent())
+			add_buff(buffables[1], buff, CompleteBuildingEvent())
+			add_buff(buffables[0], other_buff, CompleteBuildingEvent())
+
+		results = tick(now + 10, max_buffables=1)
+		assert len(results) == 1
+		assert len(results[0].removed_modifications) == 2
+
+		# The second stack expiry of the first buffable was handled with the first one
+		assert expiry.get_due_buffables(now + 10) == [buffables[1]]
+
+		results = tick(now + 20)
+		assert len(results) == 1
+		assert other_buff.buff_id not in buffables[0].active_buffs
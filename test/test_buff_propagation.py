@@ -2,9 +2,10 @@ import buffspecs
 
 from test.test_data.buff_builder import BuffBuilder
 
-from api import call_event, add_buff, pull_propagated_buffs, remove_buff
+from api import call_event, add_buff, add_buff_many, pull_propagated_buffs, remove_buff
 from models import Buffable, BuffSpec, Modifier, BuffEvent, BuffModification, BuffPropagatedEvent, AddBuffEvent
 from test.test_data.specs import Player, Castle, CompleteBuildingEvent, Equipment, RecruitPlayerEvent
+from errors import BuffException
 
 from test.test_data.specs import (
 	Attributes
@@ -163,8 +164,8 @@ class Test_Buff_Propagation(unittest.TestCase):
 		add_buff(castle, castle_buff, CompleteBuildingEvent())
 
 		# Castle should have a propagation trigger not a activation trigger
-		assert castle_buff.buff_id not in castle.activation_triggers["RecruitPlayerEvent"]
-		assert castle_buff.buff_id in castle.propagation_triggers["RecruitPlayerEvent"]
+		assert castle_buff.buff_id not in castle.activation_triggers[RecruitPlayerEvent.event_type_id]
+		assert castle_buff.buff_id in castle.propagation_triggers[RecruitPlayerEvent.event_type_id]
 
 		# Event was not triggered, so player should not get modified
 		assert player.attributes[Attributes.ATK] == 100
@@ -178,7 +179,7 @@ class Test_Buff_Propagation(unittest.TestCase):
 		assert castle_buff.buff_id in castle.active_buffs
 
 		# The propagation trigger should not consumed
-		assert castle_buff.buff_id in castle.propagation_triggers["RecruitPlayerEvent"]
+		assert castle_buff.buff_id in castle.propagation_triggers[RecruitPlayerEvent.event_type_id]
 
 	def test_pulling_propagated_buffs(self):
 		player = Player()
@@ -222,4 +223,117 @@ class Test_Buff_Propagation(unittest.TestCase):
 
 		# The propagation should have happened only once
 		assert len(player.active_buffs) == 1
-		assert player.attributes[Attributes.ATK] == 150
\ No newline at end of file
+		assert player.attributes[Attributes.ATK] == 150
+
+	def test_adding_buff_to_many_propagators(self):
+		castles = []
+		for i in range(3):
+			castle = Castle()
+			castle.players = [Player(), Player()]
+			castles.append(castle)
+
+		castle_buff = BuffBuilder().modify("+", 10, Attributes.ATK).propagates_to(Player).build()
+		result = add_buff_many(castles, castle_buff, CompleteBuildingEvent())
+
+		# Same as adding the buff to each castle, all players got the buff
+		for castle in castles:
+			assert castle_buff.buff_id in castle.active_buffs
+			assert castle.attributes[Attributes.ATK] == 0
+			for player in castle.players:
+				assert player.attributes[Attributes.ATK] == 10
+
+		# And the result aggregates all propagations
+		assert len(result.propagated_modifications[castles[0].id]) == 6
+
+	def test_propagation_targets_cache(self):
+		castle = Castle()
+		player_1 = Player()
+		castle.players.append(player_1)
+
+		buffspecs.set_propagation_cache(True)
+		try:
+			assert buffspecs.get_propagation_targets(castle, Player.buffable_type_id) == [player_1]
+
+			# Membership changed but cached targets are kept until invalidated
+			player_2 = Player()
+			castle.players.append(player_2)
+			assert buffspecs.get_propagation_targets(castle, Player.buffable_type_id) == [player_1]
+
+			buffspecs.invalidate_propagation(castle)
+			assert buffspecs.get_propagation_targets(castle, Player.buffable_type_id) == [player_1, player_2]
+		finally:
+			buffspecs.set_propagation_cache(False)
+
+	def test_propagation_targets_context(self):
+		castle = Castle()
+		castle.players.append(Player())
+
+		castle_buff = BuffBuilder().modify("+", 10, Attributes.ATK).propagates_to(Player).build()
+
+		with buffspecs.PropagationTargets():
+			add_buff(castle, castle_buff, CompleteBuildingEvent())
+			assert castle in buffspecs._cache.propagation_targets
+
+		# Leaving the context drops the cache
+		assert buffspecs._cache.propagation_targets is None
+		assert castle.players[0].attributes[Attributes.ATK] == 10
+
+	def test_propagation_to_subclass(self):
+		class KnightPlayer(Player):
+			pass
+
+		knight = KnightPlayer()
+		castle = Castle()
+		castle.players.append(knight)
+
+		castle_buff = BuffBuilder().modify("+", 10, Attributes.ATK).propagates_to(Player).build()
+		add_buff(castle, castle_buff, CompleteBuildingEvent())
+
+		# Buffs targeting players also target its subclasses
+		assert knight.attributes[Attributes.ATK] == 10
+		assert castle_buff.is_target(knight)
+		assert not castle_buff.is_target(castle)
+
+		# Buffs targeting the subclass do not target other players
+		knight_buff = BuffBuilder().modify("+", 10, Attributes.ATK).propagates_to(KnightPlayer).build()
+		assert knight_buff.is_target(knight)
+		assert not knight_buff.is_target(Player())
+
+	def test_propagation_functions_of_base_classes(self):
+		class KnightPlayer(Player):
+			pass
+
+		class EnchantedEquipment(Equipment):
+			pass
+
+		# Equipment -> Player propagation function, with an enchanted equipment as the source
+		knight = KnightPlayer()
+		equipment = EnchantedEquipment()
+		equipment.owner = knight
+		equipment_buff = BuffBuilder().modify("+", 5, Attributes.ATK).propagates_to(Player).build()
+		add_buff(equipment, equipment_buff, CompleteBuildingEvent())
+		assert knight.attributes[Attributes.ATK] == 5
+
+		# Castle -> Player propagation function, finding only the knights for a buff targeting them
+		player = Player()
+		castle = Castle()
+		castle.players = [knight, player]
+		knight_buff = BuffBuilder().modify("+", 10, Attributes.DEF).propagates_to(KnightPlayer).build()
+		add_buff(castle, knight_buff, CompleteBuildingEvent())
+		assert knight.attributes[Attributes.DEF] == 10
+		assert player.attributes[Attributes.DEF] == 0
+
+	def test_propagation_target_names(self):
+		player = Player()
+		castle = Castle()
+		castle.players.append(player)
+
+		# Specs loaded from data can refer buffables by class name
+		castle_buff = BuffSpec()
+		castle_buff.modifiers = [Modifier("+", 10, Attributes.ATK)]
+		castle_buff.propagates_to = ["Player"]
+		add_buff(castle, castle_buff, CompleteBuildingEvent())
+
+		assert player.attributes[Attributes.ATK] == 10
+		with self.assertRaises(BuffException):
+			remove_buff(player, castle_buff.buff_id)
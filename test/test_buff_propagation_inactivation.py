@@ -81,7 +81,7 @@ class Test_Buff_Propagation_Inactivation(unittest.TestCase):
 		assert castle_buff.buff_id not in player.active_buffs
 
 		# Activation trigger should be registered because buff had a condition that can change
-		assert len(player.activation_triggers["FartEvent"]) == 1
+		assert len(player.activation_triggers[FartEvent.event_type_id]) == 1
 
 
 
@@ -42,8 +42,8 @@ class Test_Buff_Propagation_triggers(unittest.TestCase):
 		assert castle_buff.buff_id not in player1.active_buffs
 
 		# Castle should have registered the trigger
-		assert "RecruitPlayerEvent" not in castle.activation_triggers
-		assert "RecruitPlayerEvent" in castle.propagation_triggers
+		assert RecruitPlayerEvent.event_type_id not in castle.activation_triggers
+		assert RecruitPlayerEvent.event_type_id in castle.propagation_triggers
 
 		# add another player to the castle
 		player2 = Player()
@@ -0,0 +1,74 @@
+import buffspecs
+import derivation
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Attributes, CompleteBuildingEvent, Castle, Player
+
+from api import add_buff, buff_transaction
+from models import Buffable
+
+from mock import patch
+
+import unittest
+
+
+class Test_Buff_Transaction(unittest.TestCase):
+
+	def setUp(self):
+		buffspecs.clear()
+
+	def test_transaction_coalesces_derivation_updates(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 100
+
+		add_buff(buffable, BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build(),
+				 CompleteBuildingEvent())
+		add_buff(buffable, BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.HP).build(),
+				 CompleteBuildingEvent())
+
+		atk_buffs = [BuffBuilder().modify("+", 10, Attributes.ATK).build() for i in range(5)]
+
+		with patch.object(derivation, "create_derivation_modifier", wraps=derivation.create_derivation_modifier) as calls:
+			with buff_transaction() as transaction:
+				for buff in atk_buffs:
+					add_buff(buffable, buff, CompleteBuildingEvent())
+
+				# Derivations are not updated yet
+				assert calls.call_count == 0
+
+		# Updated once when the transaction finished, once for DEF and once for HP
+		assert calls.call_count == 2
+		assert buffable.attributes[Attributes.ATK] == 150
+		assert buffable.attributes[Attributes.DEF] == 75
+		assert buffable.attributes[Attributes.HP] == 37.5
+
+		# All calls results are merged in the transaction result
+		assert len(transaction.result.added_modifications) == 5
+
+	def test_transaction_with_propagated_derivations(self):
+		player = Player()
+		castle = Castle()
+		castle.players = [player]
+
+		castle_buff = BuffBuilder().modify("%", 0.5, Attributes.DEF).propagates_to_attribute(Attributes.DEF)\
+			.propagates_to(Player).build()
+
+		with buff_transaction():
+			add_buff(castle, castle_buff, CompleteBuildingEvent())
+			add_buff(castle, BuffBuilder().modify("+", 80, Attributes.DEF).build(), CompleteBuildingEvent())
+			add_buff(castle, BuffBuilder().modify("+", 20, Attributes.DEF).build(), CompleteBuildingEvent())
+
+		assert castle.attributes[Attributes.DEF] == 100
+		assert player.attributes[Attributes.DEF] == 50
+
+	def test_failed_call_does_not_stop_merging_results(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+
+		with buff_transaction() as transaction:
+			with self.assertRaises(AttributeError):
+				add_buff(buffable, None, CompleteBuildingEvent())
+			add_buff(buffable, buff, CompleteBuildingEvent())
+
+		assert transaction.depth == 0
+		assert len(transaction.result.added_modifications) == 1
@@ -0,0 +1,68 @@
+import buffspecs
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Attributes, CompleteBuildingEvent
+
+from api import add_buff
+from buffable import get_attributes_batch
+from models import Buffable
+from expiry import get_timestamp, FixedTime, clear_fixed_time
+
+import unittest
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+class ColumnBuffable(Buffable):
+	attribute_set = Attributes
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class Test_Attributes_Batch(unittest.TestCase):
+
+	def setUp(self):
+		buffspecs.clear()
+
+	def tearDown(self):
+		clear_fixed_time()
+
+	def test_batch_matches_single_reads(self):
+		buffables = [Buffable(), ColumnBuffable(), Buffable()]
+		for value, buffable in enumerate(buffables):
+			buffable.attributes[Attributes.ATK] = 100 + value
+			buffable.attributes[Attributes.DEF] = 10
+
+		buff = BuffBuilder().modify("%", 0.5, Attributes.ATK).modify("+", 5, Attributes.DEF).build()
+		add_buff(buffables[0], buff, CompleteBuildingEvent())
+		add_buff(buffables[1], buff, CompleteBuildingEvent())
+
+		attribute_ids = [Attributes.ATK, Attributes.DEF, Attributes.CRIT_CHANCE]
+		values = get_attributes_batch(buffables, attribute_ids)
+
+		assert values.shape == (3, 3)
+
+		# Reading a batch should not create attributes
+		assert Attributes.CRIT_CHANCE not in buffables[0].attributes.attribute_data
+
+		for row, buffable in enumerate(buffables):
+			for column, attribute_id in enumerate(attribute_ids):
+				assert values[row, column] == buffable.attributes[attribute_id]
+
+	def test_batch_expires_buffs(self):
+		buffables = [Buffable(), ColumnBuffable()]
+		buff = BuffBuilder().modify("+", 50, Attributes.ATK).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(get_timestamp()):
+			now = get_timestamp()
+			for buffable in buffables:
+				add_buff(buffable, buff, CompleteBuildingEvent())
+
+		with FixedTime(now + 5):
+			assert get_attributes_batch(buffables, [Attributes.ATK]).tolist() == [[50], [50]]
+
+		with FixedTime(now + 10):
+			assert get_attributes_batch(buffables, [Attributes.ATK]).tolist() == [[0], [0]]
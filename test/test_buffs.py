@@ -1,10 +1,11 @@
 import buffspecs
 
 from test.test_data.buff_builder import BuffBuilder
-from test.test_data.specs import CompleteBuildingEvent, FartEvent
+from test.test_data.specs import CompleteBuildingEvent, FartEvent, DamageEvent
 
 from buffs.api import call_event, add_buff, remove_buff
-from buffs.models import Buffable, BuffSpec, Modifier, BuffEvent
+from buffs.models import Buffable, BuffSpec, Modifier, BuffEvent, EventResult, AddBuffEvent
+from errors import BuffException, BuffErrorCodes
 
 from test.test_data.specs import (
 	Attributes
@@ -101,7 +102,7 @@ class Test_3_Buffs(unittest.TestCase):
 		# The buff was not triggered yet as "FartEvent" was not called
 		assert buffable.attributes[Attributes.DEF] == 0
 		# Instead, we did not added a buff, we just added a trigger for a buff
-		assert "FartEvent" in buffable.activation_triggers
+		assert FartEvent.event_type_id in buffable.activation_triggers
 
 		# Now we call the event
 		call_event(FartEvent(buffable))
@@ -109,7 +110,7 @@ class Test_3_Buffs(unittest.TestCase):
 		# Now the buff should be added
 		assert buffable.attributes[Attributes.DEF] == 30
 		# And the trigger removed
-		assert "FartEvent" not in buffable.activation_triggers
+		assert FartEvent.event_type_id not in buffable.activation_triggers
 
 	def test_buff_event_modifications_log(self):
 		buffable = Buffable()
@@ -128,4 +129,75 @@ class Test_3_Buffs(unittest.TestCase):
 		assert modifications[0].source_event == fart_event
 		assert modifications[0].modifier.operator == "+"
 		assert modifications[0].modifier.value == 5
-		assert modifications[0].modifier.attribute_id == Attributes.ATK
\ No newline at end of file
+		assert modifications[0].modifier.attribute_id == Attributes.ATK
+
+	def test_event_without_triggers(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 5, Attributes.ATK).whenever(FartEvent).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+
+		first_result = call_event(DamageEvent(buffable))
+		second_result = call_event(DamageEvent(Buffable()))
+
+		# Events that trigger nothing share the same empty result
+		assert first_result is second_result
+		assert len(first_result.added_modifications) == 0
+		assert len(first_result.propagated_modifications) == 0
+		# And do not leave empty triggers behind
+		assert DamageEvent.event_type_id not in buffable.activation_triggers
+		assert DamageEvent.event_type_id not in buffable.deactivation_triggers
+		assert DamageEvent.event_type_id not in buffable.propagation_triggers
+
+		with self.assertRaises(AttributeError):
+			first_result.added_modifications = []
+
+		# It reads like any other result, without sharing changes
+		assert first_result.propagated_modifications[buffable.id] == ()
+		assert first_result.propagated_modifications.get(buffable.id) is None
+		assert buffable.id not in first_result.propagated_modifications
+		first_result.added_modifications.append(1)
+		first_result.removed_modifications.extend([1])
+		assert first_result.added_modifications == []
+		assert second_result.removed_modifications == []
+		assert len(EventResult().merge(first_result).added_modifications) == 0
+
+	def test_compiling_buff_spec(self):
+		buff = BuffBuilder().modify("+", 5, Attributes.ATK).whenever(FartEvent).build()
+		buff.deactivation_triggers = [DamageEvent]
+		not_compiled_buff = BuffBuilder().modify("+", 5, Attributes.ATK).build()
+
+		compiled = buffspecs.compile_buff(buff)
+
+		assert compiled.triggers == (FartEvent.event_type_id,)
+		assert compiled.remove_triggers == (DamageEvent.event_type_id,)
+		assert not compiled.auto_triggers
+		assert compiled.can_be_reactivated
+		assert not compiled.propagates
+		assert buffspecs.get_compiled_spec(buff.buff_id) is compiled
+		assert not not_compiled_buff.frozen
+
+		# The spec methods from before compiled specs read the compiled spec
+		assert buff.get_triggers() == [FartEvent.event_type_id]
+		assert buff.get_remove_triggers() == [DamageEvent.event_type_id]
+		assert buff.get_propagation_triggers() == [AddBuffEvent.event_type_id]
+		assert buff.can_be_reactivated()
+
+		buffspecs.finalize()
+		assert not_compiled_buff.frozen
+		assert buffspecs.get_compiled_spec(not_compiled_buff.buff_id).auto_triggers
+
+	def test_compiled_buff_spec_is_immutable(self):
+		buff = BuffBuilder().modify("+", 5, Attributes.ATK).build()
+		buffable = Buffable()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+
+		# Using the buff compiled it, so it can't be changed anymore
+		with self.assertRaises(BuffException) as context:
+			buff.max_stack = 3
+		assert context.exception.error == BuffErrorCodes.SPEC_FROZEN
+		with self.assertRaises(AttributeError):
+			buff.modifiers.append(Modifier("+", 5, Attributes.DEF))
+		with self.assertRaises(BuffException):
+			buffspecs.get_compiled_spec(buff.buff_id).max_stack = 3
+
+		assert buffable.attributes[Attributes.ATK] == 5
@@ -3,6 +3,7 @@ import buffspecs
 from buffs.api import call_event, add_buff
 from buffs.models import Buffable, BuffSpec, Modifier, BuffEvent
 from test.test_data.buff_builder import BuffBuilder
+from errors import BuffException, BuffErrorCodes
 
 from test.test_data.specs import (
 	Attributes
@@ -67,8 +68,8 @@ class Test_4_Conditions(unittest.TestCase):
 	def test_condition_switching_buff(self):
 		buffable = Buffable()
 		buff = BuffSpec()
-		buff.activation_triggers = ["DamageEvent"]
-		buff.deactivation_triggers = ["DamageEvent"]
+		buff.activation_triggers = [DamageEvent]
+		buff.deactivation_triggers = [DamageEvent]
 		buff.conditions = ["is_burning"]
 		buff.buff_id = 5
 		buff.modifiers = [Modifier("+", 30, Attributes.DEF)]
@@ -97,7 +98,7 @@ class Test_4_Conditions(unittest.TestCase):
 		assert buffable.attributes[Attributes.DEF] == 30
 
 		# And we should have added the remove trigger
-		assert buff.buff_id in buffable.deactivation_triggers["DamageEvent"]
+		assert buff.buff_id in buffable.deactivation_triggers[DamageEvent.event_type_id]
 		# Buff history contains this modification
 		assert len(buffable.attributes.get_data(Attributes.DEF).history) == 1
 
@@ -111,8 +112,8 @@ class Test_4_Conditions(unittest.TestCase):
 		assert buffable.attributes[Attributes.DEF] == 0
 
 		# And the trigger should be added again and the remove trigger should be removed
-		assert buff.buff_id not in buffable.deactivation_triggers["DamageEvent"]
-		assert buff.buff_id in buffable.activation_triggers["DamageEvent"]
+		assert buff.buff_id not in buffable.deactivation_triggers[DamageEvent.event_type_id]
+		assert buff.buff_id in buffable.activation_triggers[DamageEvent.event_type_id]
 		# Also the modification history is removed because this buff is inactive and not modifyng anything
 		assert len(buffable.attributes.get_data(Attributes.DEF).history) == 0
 		
@@ -124,11 +125,35 @@ class Test_4_Conditions(unittest.TestCase):
 		assert buff.buff_id in buffable.active_buffs
 		assert buffable.attributes[Attributes.DEF] == 30
 
-	def test_condition_parameters(self):
+	def test_condition_switching_buff_by_ambiguous_event_name(self):
 		buffable = Buffable()
 		buff = BuffSpec()
+		# The test data also has a DamageEvent, the name can't tell which one it is
 		buff.activation_triggers = ["DamageEvent"]
 		buff.deactivation_triggers = ["DamageEvent"]
+		buff.conditions = ["is_burning"]
+		buff.modifiers = [Modifier("+", 30, Attributes.DEF)]
+		buffspecs.register_buff(buff)
+
+		with self.assertRaises(BuffException) as context:
+			add_buff(buffable, buff, CompleteBuildingEvent())
+		assert context.exception.error == BuffErrorCodes.AMBIGUOUS_TYPE_NAME
+
+		# Nothing was added and the spec can still be fixed
+		assert buff.buff_id not in buffable.active_buffs
+		assert not buffable.activation_triggers
+		buff.activation_triggers = [DamageEvent]
+		buff.deactivation_triggers = [DamageEvent]
+		buff.conditions = []
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		call_event(DamageEvent(buffable, 5))
+		assert buffable.attributes[Attributes.DEF] == 30
+
+	def test_condition_parameters(self):
+		buffable = Buffable()
+		buff = BuffSpec()
+		buff.activation_triggers = [DamageEvent]
+		buff.deactivation_triggers = [DamageEvent]
 		buff.conditions = ["is_damage_higher_then 10"]  # condition parameters after condition name
 		buff.buff_id = 5
 		buff.modifiers = [Modifier("+", 30, Attributes.DEF)]
@@ -216,3 +241,43 @@ class Test_4_Conditions(unittest.TestCase):
 		call_event(PlayerLootEnemyEvent(buffable, "silver", 10))
 		assert bonus_loot_copper_silver_buff.buff_id in buffable.active_buffs
 
+
+	def test_conditions_are_compiled_once(self):
+		buff = BuffBuilder().modify("+", 5, Attributes.DEF).just_if("is_damage_higher_then 10").build()
+
+		@buffspecs.AddConditionFor([DamageEvent])
+		def is_damage_higher_then(event, param):
+			return event.damage > param
+
+		compiled = buffspecs.get_compiled_conditions(buff)
+
+		# The condition string got parsed into the function and its arguments
+		assert compiled[0].condition_function.__name__ == "is_damage_higher_then"
+		assert compiled[0].condition_args == [10.0]
+		assert compiled[0].should_be_true
+
+		# Further calls reuse the compiled conditions
+		assert buffspecs.get_compiled_conditions(buff) is compiled
+
+	def test_compiled_conditions_invalidation(self):
+		buff = BuffBuilder().modify("+", 5, Attributes.DEF).just_if("not is_damage_higher_then 10").build()
+
+		@buffspecs.AddConditionFor([DamageEvent])
+		def is_damage_higher_then(event, param):
+			return event.damage > param
+
+		compiled = buffspecs.get_compiled_conditions(buff)
+		assert not compiled[0].should_be_true
+		assert compiled[0](DamageEvent(None, 10))
+
+		# Re-registering the condition function should compile the conditions again
+		@buffspecs.AddConditionFor([DamageEvent])
+		def is_damage_higher_then(event, param):
+			return event.damage >= param
+
+		assert not buffspecs.get_compiled_conditions(buff)[0](DamageEvent(None, 10))
+
+		# Compiled specs are frozen, so their conditions can't change anymore
+		with self.assertRaises(BuffException) as context:
+			buff.conditions = ["is_damage_higher_then 20"]
+		assert context.exception.error == BuffErrorCodes.SPEC_FROZEN
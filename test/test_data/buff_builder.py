@@ -12,7 +12,7 @@ class BuffBuilder():
         return self
 
     def whenever(self, event_class):
-        self.buff_spec.activation_triggers.append(event_class.__name__)
+        self.buff_spec.activation_triggers.append(event_class)
         return self
 
     def to_attribute(self, attribute):
@@ -36,12 +36,12 @@ class BuffBuilder():
         return self
 
     def propagates_when(self, event_class):
-        self.buff_spec.propagation_triggers.append(event_class.__name__)
+        self.buff_spec.propagation_triggers.append(event_class)
         return self
 
     def propagates_to(self, *buffable_classes):
         for buffable_class in buffable_classes:
-            self.buff_spec.propagates_to.append(buffable_class.__name__)
+            self.buff_spec.propagates_to.append(buffable_class)
         return self
 
     def build(self):
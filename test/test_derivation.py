@@ -11,6 +11,12 @@ from test.test_data.specs import (
 	Attributes
 )
 
+from attributes import set_deferred_calculation
+from errors import BuffException, BuffErrorCodes
+
+from mock import patch
+import derivation
+
 import unittest
 
 class Test_Buff_Derivations(unittest.TestCase):
@@ -108,3 +114,132 @@ class Test_Buff_Derivations(unittest.TestCase):
 		assert buffable.attributes[Attributes.DEF] == 100
 		assert buffable.attributes[Attributes.HP] == 50
 
+
+	def test_derivation_with_array_attributes(self):
+		class ColumnBuffable(Buffable):
+			attribute_set = Attributes
+
+		buffable = ColumnBuffable()
+		buffable.attributes[Attributes.ATK] = 100
+		buffable.attributes[Attributes.DEF] = 100
+
+		buff = BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		buff_2 = BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.HP).build()
+		add_buff(buffable, buff_2, CompleteBuildingEvent())
+
+		assert buffable.attributes[Attributes.DEF] == 150
+		assert buffable.attributes[Attributes.HP] == 75
+
+		remove_buff(buffable, buff.buff_id)
+
+		assert buffable.attributes[Attributes.DEF] == 100
+		assert buffable.attributes[Attributes.HP] == 50
+
+
+	def test_derivation_loop_is_refused(self):
+		BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build()
+		BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.HP).build()
+
+		# HP -> ATK would close the loop ATK -> DEF -> HP -> ATK
+		with self.assertRaises(BuffException) as context:
+			BuffBuilder().modify("%", 0.5, Attributes.HP).to_attribute(Attributes.ATK).build()
+		assert context.exception.error == BuffErrorCodes.DERIVATION_LOOP
+
+	def test_derivation_loop_set_after_registering_is_refused_on_compile(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 100
+		buffable.attributes[Attributes.DEF] = 100
+
+		# Specs register themselves when created, their derivations are only known once compiled
+		atk_to_def = BuffSpec()
+		atk_to_def.modifiers = [Modifier("%", 0.5, Attributes.ATK)]
+		atk_to_def.to_attribute = Attributes.DEF
+		def_to_atk = BuffSpec()
+		def_to_atk.modifiers = [Modifier("%", 0.5, Attributes.DEF)]
+		def_to_atk.to_attribute = Attributes.ATK
+
+		add_buff(buffable, atk_to_def, CompleteBuildingEvent())
+		with self.assertRaises(BuffException) as context:
+			add_buff(buffable, def_to_atk, CompleteBuildingEvent())
+		assert context.exception.error == BuffErrorCodes.DERIVATION_LOOP
+
+		assert def_to_atk.buff_id not in buffable.active_buffs
+		assert buffable.attributes[Attributes.ATK] == 100
+		assert buffable.attributes[Attributes.DEF] == 150
+
+	def test_changing_a_derivation_replaces_its_edges(self):
+		buff = BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build()
+		other_buff = BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.HP).build()
+
+		# DEF -> ATK only loops through the ATK -> DEF edge this same spec is replacing
+		buff.modifiers = [Modifier("%", 0.5, Attributes.DEF)]
+		buff.to_attribute = Attributes.ATK
+		buffspecs.register_buff(buff)
+
+		# CRIT_CHANCE -> DEF is fine, but HP -> DEF closes DEF -> HP, so none of the spec edges are kept
+		with self.assertRaises(BuffException):
+			BuffBuilder().modify("%", 0.5, Attributes.CRIT_CHANCE).modify("%", 0.5, Attributes.HP)\
+				.to_attribute(Attributes.DEF).build()
+		BuffBuilder().modify("%", 0.5, Attributes.DEF).to_attribute(Attributes.CRIT_CHANCE).build()
+
+	def test_derivation_loop_is_refused_on_finalize(self):
+		atk_to_def = BuffSpec()
+		atk_to_def.modifiers = [Modifier("%", 0.5, Attributes.ATK)]
+		atk_to_def.to_attribute = Attributes.DEF
+		def_to_atk = BuffSpec()
+		def_to_atk.modifiers = [Modifier("%", 0.5, Attributes.DEF)]
+		def_to_atk.to_attribute = Attributes.ATK
+
+		with self.assertRaises(BuffException) as context:
+			buffspecs.finalize()
+		assert context.exception.error == BuffErrorCodes.DERIVATION_LOOP
+
+	def test_diamond_derivation_recalculates_once(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 100
+
+		# ATK -> DEF and ATK -> HP, both DEF and HP -> CRIT_DAMAGE, and CRIT_DAMAGE -> CRIT_CHANCE
+		for source, target in [
+			(Attributes.ATK, Attributes.DEF), (Attributes.ATK, Attributes.HP), (Attributes.DEF, Attributes.CRIT_DAMAGE),
+			(Attributes.HP, Attributes.CRIT_DAMAGE), (Attributes.CRIT_DAMAGE, Attributes.CRIT_CHANCE)
+		]:
+			buff = BuffBuilder().modify("%", 0.5, source).to_attribute(target).build()
+			add_buff(buffable, buff, CompleteBuildingEvent())
+
+		assert buffable.attributes[Attributes.CRIT_DAMAGE] == 50
+		assert buffable.attributes[Attributes.CRIT_CHANCE] == 25
+
+		with patch.object(derivation, "create_derivation_modifier", wraps=derivation.create_derivation_modifier) as calls:
+			add_buff(buffable, BuffBuilder().modify("+", 100, Attributes.ATK).build(), CompleteBuildingEvent())
+
+		# CRIT_CHANCE only derivates from CRIT_DAMAGE, that changed twice in a recursive update
+		crit_damage_calls = [call for call in calls.call_args_list if call[0][1].attribute_id == Attributes.CRIT_DAMAGE]
+		assert len(crit_damage_calls) == 1
+		assert buffable.attributes[Attributes.CRIT_DAMAGE] == 100
+		assert buffable.attributes[Attributes.CRIT_CHANCE] == 50
+
+	def test_removed_derivation_is_unlinked_from_source(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 100
+
+		buff = BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		remove_buff(buffable, buff.buff_id)
+
+		assert len(buffable.attributes.get_data(Attributes.ATK).derivations) == 0
+
+		# Changing the source attribute should not look for the removed derivation
+		add_buff(buffable, BuffBuilder().modify("+", 100, Attributes.ATK).build(), CompleteBuildingEvent())
+		assert buffable.attributes[Attributes.DEF] == 0
+
+
+class Test_Buff_Derivations_Deferred(Test_Buff_Derivations):
+	""" Same scenarios calculating the attribute final values only when they are read """
+
+	def setUp(self):
+		super(Test_Buff_Derivations_Deferred, self).setUp()
+		set_deferred_calculation(True)
+
+	def tearDown(self):
+		set_deferred_calculation(False)
@@ -0,0 +1,139 @@
+import buffspecs
+import metrics
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import CompleteBuildingEvent, DamageEvent, FartEvent, Castle, Player
+
+from api import call_event, add_buff, add_buff_many
+from models import Buffable, BuffSpec, Modifier
+
+from test.test_data.specs import (
+	Attributes
+)
+
+import os
+import tempfile
+import unittest
+
+
+class Test_Metrics(unittest.TestCase):
+
+	def setUp(self):
+		buffspecs.clear()
+		self.collector = metrics.enable_metrics()
+
+	def tearDown(self):
+		metrics.disable_metrics()
+
+	def test_metrics_are_not_collected_when_disabled(self):
+		metrics.disable_metrics()
+		buffable = Buffable()
+		add_buff(buffable, BuffBuilder().modify("+", 10, Attributes.ATK).build(), CompleteBuildingEvent())
+
+		assert metrics.get_collector() is None
+		assert self.collector.counters == {}
+		assert metrics.to_prometheus_text() == ""
+
+	def test_counting_calls_by_buff_and_event(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).whenever(FartEvent).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		call_event(FartEvent(buffable))
+		call_event(FartEvent(buffable))
+
+		assert self.collector.get_count(metrics.ADD_BUFF, buff.buff_id) == 1
+		assert self.collector.get_count(metrics.ACTIVATE_BUFF, buff.buff_id) == 1
+		assert self.collector.get_count(metrics.MODIFICATIONS_ADDED, buff.buff_id) == 1
+		assert self.collector.get_count(metrics.CALL_EVENT, "FartEvent") == 2
+		assert self.collector.get_count(metrics.CALL_EVENT, "AddBuffEvent") == 1
+
+		histogram = self.collector.get_histogram(metrics.CALL_EVENT, "FartEvent")
+		assert histogram.count == 2
+		assert sum(histogram.bucket_counts) == 2
+		assert histogram.sum_ns > 0
+
+	def test_counting_bulk_adds_per_buffable(self):
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+		add_buff_many([Buffable() for i in range(3)], buff, CompleteBuildingEvent())
+
+		assert self.collector.get_count(metrics.ADD_BUFF, buff.buff_id) == 3
+		assert self.collector.get_histogram(metrics.ADD_BUFF, buff.buff_id).count == 3
+		assert self.collector.get_count(metrics.ACTIVATE_BUFF, buff.buff_id) == 3
+
+	def test_counting_inactivations(self):
+		buffable = Buffable()
+		buffable.attributes["Burning"] = 1
+		buff = BuffSpec()
+		buff.activation_triggers = [DamageEvent]
+		buff.deactivation_triggers = [DamageEvent]
+		buff.conditions = ["is_metered_burning"]
+		buff.modifiers = [Modifier("+", 30, Attributes.DEF)]
+		buffspecs.register_buff(buff)
+
+		@buffspecs.AddConditionFor([DamageEvent])
+		def is_metered_burning(event):
+			return event.buffable.attributes["Burning"] == 1
+
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		call_event(DamageEvent(buffable))
+		buffable.attributes["Burning"] = 0
+		call_event(DamageEvent(buffable))
+
+		assert buff.buff_id not in buffable.active_buffs
+		assert self.collector.get_count(metrics.INACTIVATE_BUFF, buff.buff_id) == 1
+		assert self.collector.get_count(metrics.MODIFICATIONS_REMOVED, buff.buff_id) == 1
+		# Checked for activation and inactivation on the first damage event, then for inactivation on the second
+		assert self.collector.get_count(metrics.CONDITIONS_EVALUATED, buff.buff_id) == 3
+
+	def test_counting_propagation_fanout(self):
+		castle = Castle()
+		castle.players = [Player(), Player(), Player()]
+		buff = BuffBuilder().modify("+", 10, Attributes.DEF).propagates_to(Player).build()
+		add_buff(castle, buff, CompleteBuildingEvent())
+
+		assert self.collector.get_count(metrics.PROPAGATIONS, buff.buff_id) == 1
+		assert self.collector.get_count(metrics.PROPAGATION_FANOUT, buff.buff_id) == 3
+		# Buffs without conditions are not counted
+		assert self.collector.get_count(metrics.CONDITIONS_EVALUATED, buff.buff_id) == 0
+
+	def test_counting_derivation_recalculations(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 100
+		derivation = BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF).build()
+		add_buff(buffable, derivation, CompleteBuildingEvent())
+		add_buff(buffable, BuffBuilder().modify("+", 10, Attributes.ATK).build(), CompleteBuildingEvent())
+
+		assert buffable.attributes[Attributes.DEF] == 55
+		assert self.collector.get_count(metrics.DERIVATION, derivation.buff_id) == 1
+
+	def test_snapshot(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+
+		snapshot = self.collector.snapshot()
+		add_buff_values = snapshot[metrics.ADD_BUFF][buff.buff_id]
+		assert add_buff_values["count"] == 1
+		assert add_buff_values["buckets"][-1] == (float("inf"), 1)
+		assert "buckets" not in snapshot[metrics.MODIFICATIONS_ADDED][buff.buff_id]
+
+		self.collector.reset()
+		assert self.collector.snapshot() == {}
+
+	def test_prometheus_export(self):
+		buffable = Buffable()
+		call_event(FartEvent(buffable))
+
+		text = metrics.to_prometheus_text()
+		lines = text.splitlines()
+		assert "# TYPE buffs_call_event_total counter" in lines
+		assert 'buffs_call_event_total{event="FartEvent"} 1' in lines
+		assert "# TYPE buffs_call_event_duration_seconds histogram" in lines
+		assert 'buffs_call_event_duration_seconds_bucket{event="FartEvent",le="+Inf"} 1' in lines
+		assert 'buffs_call_event_duration_seconds_count{event="FartEvent"} 1' in lines
+
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "buffs.prom")
+			metrics.write_prometheus_text(path)
+			with open(path) as metrics_file:
+				assert metrics_file.read() == text
@@ -1,106 +1,67 @@
 import buffspecs
 
-from models import *
-
-from test.test_data.buff_builder import BuffBuilder
-from test.test_data.specs import Castle, Player, Equipment, CompleteBuildingEvent
-
-from api import call_event, add_buff, remove_buff
-
-from test.test_data.specs import (
-    Attributes
+from test.benchmark_suite import (
+    Scenario, ScenarioConfig, run_suite, run_micro_benchmarks, measure_memory, save_baseline, compare_to_baseline
 )
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Attributes
 
-import unittest
 import random
+import unittest
+import os
+import tempfile
 
-class Test_Buff_Propagation_With_Derivation(unittest.TestCase):
+class Test_Benchmark_Suite(unittest.TestCase):
 
     def setUp(self):
         buffspecs.clear()
 
-    def test_performance(self):
-
-        player1 = Player()
-        player1_equips = []
-        for i in range(10):
-          equip = Equipment()
-          equip.owner = player1
-          player1_equips.append(equip)
-
-        player2 = Player()
-        player2_equips = []
-        for i in range(10):
-          equip = Equipment()
-          equip.owner = player2
-          player2_equips.append(equip)
-
-        castle = Castle()
-        castle.players = [player1, player2]
-
-        seed = 1234
-
-        random.seed(seed)
-
-        buff_targets = {}
-
-        for i in range(10):
-
-            builder = BuffBuilder()
-            modifier = random_modifier()
-            builder.modify(*modifier)
-
-            propagates = False
-
-            apply_to, propagate_to = random_targets()
-
-            if chance_pct(25):
-                builder.to_attribute(random_attribute(exlude=modifier[2]))
-
-            if chance_pct(25):
-                propagates = True
-                builder.propagates_to_attribute(random_attribute())
-
-            #builder.propagates_to()
-
-
-def chance_pct(pct):
-    return pct >= random.randrange(0, 100)
-
-
-def random_targets():
-    possible_targets = [Player, Equipment, Castle]
-    apply_on = random.choice(possible_targets)
-
-    if apply_on == Player:
-        possible_targets = []
-
-    if apply_on == Castle:
-        possible_targets = [Player, Equipment]
-
-    if apply_on == Equipment:
-        possible_targets = [Player]
-
-    propagate_to = None
-    if possible_targets:
-        propagate_to = random.choice(possible_targets)
-    return apply_on, propagate_to
-
-def random_attribute(exlude=None):
-    attrs = list(Attributes)
-    if exlude:
-        attrs.remove(exlude)
-    return random.choice(attrs)
-
-
-def random_modifier():
-    op = "+"
-    attribute_id = random_attribute()
-    value = random.randrange(1, 150)
-    if bool(random.getrandbits(1)):
-        op = "%"
-        value = value / 100
-    return op, value, attribute_id
-
-
-
+    def test_benchmark_suite(self):
+        config = ScenarioConfig().scaled(0.5)
+        results = run_suite(config, repeat=2)
+
+        for result in results:
+            assert result.count > 0
+            assert result.ops_per_sec > 0
+            assert 0 <= result.p50_us <= result.p99_us
+        assert [result.name for result in results] == [
+            "add_buff", "call_event", "attribute_read", "expiry_sweep", "remove_buff"
+        ]
+
+        with tempfile.TemporaryDirectory() as baseline_dir:
+            baseline_path = os.path.join(baseline_dir, "baseline.json")
+            save_baseline(baseline_path, config, results)
+            assert compare_to_baseline(baseline_path, results) == []
+
+            # A much slower run is reported as a regression
+            for result in results:
+                result.ops_per_sec /= 2
+            assert len(compare_to_baseline(baseline_path, results)) == len(results)
+
+    def test_scenario_keeps_global_state(self):
+        buff = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+        random.seed(42)
+        random_state = random.getstate()
+
+        scenario = Scenario(ScenarioConfig())
+        assert random.getstate() == random_state
+        assert buffspecs.get_buff_spec(buff.buff_id) is buff
+
+        # Same seed, same scenario
+        buffspecs.clear()
+        same_scenario = Scenario(ScenarioConfig())
+        assert [spec.modifiers[0].value for _, spec, _ in scenario.buffs] == [
+            spec.modifiers[0].value for _, spec, _ in same_scenario.buffs
+        ]
+
+    def test_micro_benchmarks(self):
+        results = run_micro_benchmarks(scale=0.01)
+
+        names = [result.name for result in results]
+        assert len(set(names)) == len(names)
+        for result in results:
+            assert result.count > 0
+
+        measures = dict(measure_memory(amount=20))
+        assert measures["dict_buffable"] > 0
+        assert measures["column_buffable"] > 0
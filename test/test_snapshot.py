@@ -0,0 +1,195 @@
+import buffspecs
+import expiry
+
+from test.test_data.buff_builder import BuffBuilder
+from test.test_data.specs import Player, Equipment, Castle, CompleteBuildingEvent, FartEvent
+
+from api import call_event, add_buff, remove_buff, tick
+from models import Buffable
+from expiry import FixedTime, clear_fixed_time
+from snapshot import save_buffables, restore_buffables
+from errors import BuffException, BuffErrorCodes
+
+from test.test_data.specs import (
+	Attributes
+)
+
+import unittest
+
+ATTRIBUTE_IDS = list(Attributes)
+
+
+class Test_Snapshot(unittest.TestCase):
+
+	def setUp(self):
+		buffspecs.clear()
+
+	def tearDown(self):
+		clear_fixed_time()
+
+	def assert_same_attributes(self, buffables, restored_buffables):
+		for buffable, restored_buffable in zip(buffables, restored_buffables):
+			for attribute_id in Attributes:
+				assert restored_buffable.attributes[attribute_id] == buffable.attributes[attribute_id]
+
+	def test_restoring_active_buffs_and_stacks(self):
+		buffable = Buffable()
+		buffable.id = 42
+		buffable.attributes[Attributes.ATK] = 100
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).modify("%", 0.5, Attributes.ATK).stacks(3).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		add_buff(buffable, buff, CompleteBuildingEvent())
+		assert buffable.attributes[Attributes.ATK] == 240
+
+		restored = Buffable()
+		restore_buffables(save_buffables([buffable], ATTRIBUTE_IDS), [restored], ATTRIBUTE_IDS)
+
+		assert restored.id == 42
+		assert restored.active_buffs[buff.buff_id].stack == 2
+		assert restored.attributes[Attributes.ATK] == 240
+
+		# Modifications were rebuilt, so the buff stacks and is removed as usual
+		add_buff(restored, buff, CompleteBuildingEvent())
+		assert restored.attributes[Attributes.ATK] == 325
+		remove_buff(restored, buff.buff_id)
+		assert restored.attributes[Attributes.ATK] == 100
+
+	def test_restoring_buffs_waiting_for_triggers(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).whenever(FartEvent).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+
+		restored = Buffable()
+		restore_buffables(save_buffables([buffable], ATTRIBUTE_IDS), [restored], ATTRIBUTE_IDS)
+
+		assert buff.buff_id not in restored.active_buffs
+		call_event(FartEvent(restored))
+		assert restored.attributes[Attributes.ATK] == 10
+
+	def test_restoring_remaining_expiry_time(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(1000):
+			add_buff(buffable, buff, CompleteBuildingEvent())
+		data = save_buffables([buffable], ATTRIBUTE_IDS, now=1004)
+
+		restored = Buffable()
+		with FixedTime(5000):
+			restore_buffables(data, [restored], ATTRIBUTE_IDS)
+			assert restored.attributes[Attributes.ATK] == 10
+
+		# 6 seconds were remaining when saved
+		with FixedTime(5005):
+			assert restored.attributes[Attributes.ATK] == 10
+		with FixedTime(5006):
+			assert restored.attributes[Attributes.ATK] == 0
+			assert buff.buff_id not in restored.active_buffs
+
+	def test_restoring_expiry_times_in_global_scheduler(self):
+		buffable = Buffable()
+		buff = BuffBuilder().modify("+", 10, Attributes.ATK).stacks(2).build()
+		buff.duration_seconds = 10
+
+		with FixedTime(1000):
+			add_buff(buffable, buff, CompleteBuildingEvent())
+		with FixedTime(1002):
+			add_buff(buffable, buff, CompleteBuildingEvent())
+		data = save_buffables([buffable], ATTRIBUTE_IDS, now=1004)
+
+		restored = Buffable()
+		scheduler = expiry.enable_global_expiry()
+		try:
+			with FixedTime(5000):
+				restore_buffables(data, [restored], ATTRIBUTE_IDS)
+
+			# Only the remaining expiry times are live, not the ones registered when activating the stacks
+			live_expiry_times = sorted(
+				expires_at for expires_at, _, _, buff_id, generation in scheduler.expiry_times
+				if restored.expiry_generations.get(buff_id) == generation
+			)
+			assert live_expiry_times == [5006, 5008]
+
+			for now, expired_amount, stack in [(5006, 1, 1), (5007, 0, 1), (5008, 1, 0), (5010, 0, 0)]:
+				with FixedTime(now):
+					assert len(tick(now)) == expired_amount
+					assert restored.attributes[Attributes.ATK] == 10 * stack
+		finally:
+			expiry.disable_global_expiry()
+
+	def test_restoring_propagated_derivations(self):
+		player = Player()
+		player.attributes[Attributes.ATK] = 200
+		equipment = Equipment()
+		equipment.owner = player
+
+		derivation = BuffBuilder().modify("%", 0.5, Attributes.ATK).to_attribute(Attributes.DEF) \
+			.propagates_to(Player).build()
+		add_buff(equipment, derivation, CompleteBuildingEvent())
+		add_buff(player, BuffBuilder().modify("+", 100, Attributes.ATK).build(), CompleteBuildingEvent())
+		assert player.attributes[Attributes.DEF] == 150
+
+		# The player is saved first, but its propagation source is restored before it
+		data = save_buffables([player, equipment], ATTRIBUTE_IDS)
+		restored_player = Player()
+		restored_equipment = Equipment()
+		restored_equipment.owner = restored_player
+		restore_buffables(data, [restored_player, restored_equipment], ATTRIBUTE_IDS)
+
+		self.assert_same_attributes([player, equipment], [restored_player, restored_equipment])
+		propagation_event = restored_player.active_buffs[derivation.buff_id].source_event
+		assert propagation_event.propagation_source is restored_equipment
+
+	def test_restoring_propagations(self):
+		castle = Castle()
+		players = [Player(), Player()]
+		for player in players:
+			player.castle = castle
+			castle.players.append(player)
+
+		buff = BuffBuilder().modify("+", 10, Attributes.DEF).propagates_to(Player).build()
+		add_buff(castle, buff, CompleteBuildingEvent())
+
+		data = save_buffables([castle] + players, ATTRIBUTE_IDS)
+		restored_castle = Castle()
+		restored_players = [Player(), Player()]
+		for player in restored_players:
+			player.castle = restored_castle
+			restored_castle.players.append(player)
+		restore_buffables(data, [restored_castle] + restored_players, ATTRIBUTE_IDS)
+
+		self.assert_same_attributes(players, restored_players)
+		assert restored_players[0].attributes[Attributes.DEF] == 10
+
+	def test_restoring_column_buffables(self):
+		class ColumnBuffable(Buffable):
+			attribute_set = Attributes
+
+		buffable = ColumnBuffable()
+		buffable.attributes[Attributes.HP] = 50
+		buff = BuffBuilder().modify("%", 0.1, Attributes.HP).build()
+		add_buff(buffable, buff, CompleteBuildingEvent())
+
+		restored = ColumnBuffable()
+		restore_buffables(save_buffables([buffable], ATTRIBUTE_IDS), [restored], ATTRIBUTE_IDS)
+
+		self.assert_same_attributes([buffable], [restored])
+
+	def test_invalid_snapshots(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 1
+		data = save_buffables([buffable], ATTRIBUTE_IDS)
+
+		for invalid_data, buffables in [
+			(b"NOPE" + data[4:], [Buffable()]),
+			(data[:-1], [Buffable()]),
+			(data, [Buffable(), Buffable()]),
+		]:
+			with self.assertRaises(BuffException) as context:
+				restore_buffables(invalid_data, buffables, ATTRIBUTE_IDS)
+			assert context.exception.error == BuffErrorCodes.INVALID_SNAPSHOT
+
+		# Attributes must be in the attribute ids to be saved
+		with self.assertRaises(BuffException):
+			save_buffables([buffable], [Attributes.DEF])
@@ -6,7 +6,8 @@ from test.test_data.specs import (
 	Attributes
 )
 
-from buffs.models import Attribute
+from buffs.models import Attribute, ArrayBuffableAttributes
+from buffs.attributes import apply_attributes_modification, remove_attribute_modification, set_deferred_calculation
 
 import unittest
 
@@ -24,6 +25,22 @@ class Test_Attributes(unittest.TestCase):
 		assert attr_data.mod_add == 10  # Automatically granted 10 of the add modifier
 		assert attr_data.mod_pct == 0   # no bonus pct
 
+	def test_deferred_calculation(self):
+		buffable = Buffable()
+		buffable.attributes[Attributes.ATK] = 10
+		set_deferred_calculation(True)
+		try:
+			apply_attributes_modification(buffable.attributes, BuffModification(Modifier("%", 0.5, Attributes.ATK)))
+
+			# Final value is only calculated when read
+			attr_data = buffable.attributes.get_data(Attributes.ATK)
+			assert attr_data.dirty
+			assert attr_data.final_value == 10
+			assert buffable.attributes[Attributes.ATK] == 15
+			assert not attr_data.dirty
+		finally:
+			set_deferred_calculation(False)
+
 	def test_pct_modifier(self):
 		buffable = Buffable()
 		buffable.attributes[Attributes.MAX_HP] = 10
@@ -39,3 +56,53 @@ class Test_Attributes(unittest.TestCase):
 		assert attr_data.final_value == 15
 		assert attr_data.mod_add == 10
 		assert attr_data.mod_mult == 0.5
+
+
+class ColumnBuffable(Buffable):
+	attribute_set = Attributes
+
+
+class Test_Array_Attributes(unittest.TestCase):
+
+	def test_buffable_with_attribute_set_uses_columns(self):
+		buffable = ColumnBuffable()
+		assert isinstance(buffable.attributes, ArrayBuffableAttributes)
+
+		buffable.attributes[Attributes.MAX_HP] = 10
+		assert buffable.attributes[Attributes.MAX_HP] == 10
+		assert buffable.attributes.get_data(Attributes.MAX_HP).mod_add == 10
+
+		# Other attributes are in the same columns, with no history or derivations allocated
+		assert buffable.attributes[Attributes.ATK] == 0
+		assert buffable.attributes.attribute_data.histories == {}
+		assert buffable.attributes.attribute_data.derivations == {}
+
+	def test_array_attributes_modifications(self):
+		attributes = ColumnBuffable().attributes
+		attributes[Attributes.ATK] = 10
+
+		modification = BuffModification(Modifier("%", 0.5, Attributes.ATK), buff_id=1)
+		apply_attributes_modification(attributes, modification)
+
+		# +10 + 50% of that (5) is 15
+		assert attributes[Attributes.ATK] == 15
+		assert attributes.get_data(Attributes.ATK).mod_mult == 0.5
+		assert list(attributes.get_data(Attributes.ATK).history.values()) == [modification]
+
+		remove_attribute_modification(attributes, modification)
+		assert attributes[Attributes.ATK] == 10
+		assert len(attributes.get_data(Attributes.ATK).history) == 0
+
+	def test_deferred_calculation(self):
+		attributes = ColumnBuffable().attributes
+		attributes[Attributes.ATK] = 10
+		set_deferred_calculation(True)
+		try:
+			apply_attributes_modification(attributes, BuffModification(Modifier("%", 0.5, Attributes.ATK), buff_id=1))
+
+			# Final value is only calculated when read
+			assert attributes.get_data(Attributes.ATK).dirty
+			assert attributes[Attributes.ATK] == 15
+			assert not attributes.get_data(Attributes.ATK).dirty
+		finally:
+			set_deferred_calculation(False)
@@ -0,0 +1,45 @@
+from models import Buffable, AddBuffEvent, BuffPropagatedEvent
+from propagation import get_propagation_source
+from errors import BuffException, BuffErrorCodes
+
+from test.test_data.specs import CompleteBuildingEvent
+
+import unittest
+
+
+class Test_Event_Chain(unittest.TestCase):
+
+	def test_walking_event_chain(self):
+		source_event = CompleteBuildingEvent()
+		add_event = AddBuffEvent(Buffable(), 1, source_event)
+		propagated_event = BuffPropagatedEvent(Buffable(), Buffable(), 1, add_event)
+		last_event = AddBuffEvent(Buffable(), 1, propagated_event)
+
+		assert list(last_event.iter_event_chain()) == [last_event, propagated_event, add_event, source_event]
+		assert last_event.get_event_chain() == [last_event, propagated_event, add_event, source_event]
+		assert list(source_event.iter_event_chain()) == [source_event]
+
+	def test_propagation_source_is_the_closest_propagation(self):
+		castle = Buffable()
+		player = Buffable()
+		add_event = AddBuffEvent(castle, 1, CompleteBuildingEvent())
+		first_propagation = BuffPropagatedEvent(player, castle, 1, add_event)
+		second_propagation = BuffPropagatedEvent(castle, player, 1, AddBuffEvent(player, 1, first_propagation))
+		last_event = AddBuffEvent(castle, 1, second_propagation)
+
+		assert get_propagation_source(add_event) is None
+		assert get_propagation_source(CompleteBuildingEvent()) is None
+		assert get_propagation_source(AddBuffEvent(player, 1, first_propagation)) is castle
+		assert get_propagation_source(last_event) is player
+
+	def test_long_event_chain(self):
+		buffable = Buffable()
+		event = CompleteBuildingEvent()
+		for _ in range(5000):
+			event = AddBuffEvent(buffable, 1, event)
+
+		# Walking does not recurse, but has a depth guard
+		assert len(list(event.iter_event_chain(max_depth=10000))) == 5001
+		with self.assertRaises(BuffException) as context:
+			list(event.iter_event_chain())
+		assert context.exception.error == BuffErrorCodes.EVENT_CHAIN_TOO_DEEP
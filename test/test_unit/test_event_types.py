@@ -0,0 +1,47 @@
+import buffspecs
+
+from models import BuffEvent, AddBuffEvent
+from errors import BuffException, BuffErrorCodes
+
+import unittest
+
+
+class Test_Event_Types(unittest.TestCase):
+
+	def test_event_classes_get_type_ids(self):
+		class SneezeEvent(BuffEvent):
+			pass
+
+		class StrongSneezeEvent(SneezeEvent):
+			pass
+
+		assert isinstance(SneezeEvent.event_type_id, int)
+		assert SneezeEvent.event_type_id != StrongSneezeEvent.event_type_id
+		assert StrongSneezeEvent(None).event_type_id == StrongSneezeEvent.event_type_id
+
+	def test_event_classes_with_same_name_do_not_collide(self):
+		def create_event_class():
+			class HiccupEvent(BuffEvent):
+				pass
+			return HiccupEvent
+
+		first_class = create_event_class()
+		second_class = create_event_class()
+
+		assert first_class.event_type_id != second_class.event_type_id
+		# Names used when loading specs can't tell which class they mean
+		with self.assertRaises(BuffException) as context:
+			buffspecs.get_event_type_id("HiccupEvent")
+		assert context.exception.error == BuffErrorCodes.AMBIGUOUS_TYPE_NAME
+
+	def test_event_name_before_class_exists(self):
+		type_id = buffspecs.get_event_type_id("YawnEvent")
+
+		class YawnEvent(BuffEvent):
+			pass
+
+		assert YawnEvent.event_type_id == type_id
+
+	def test_buff_lib_events_are_found_by_name(self):
+		assert buffspecs.get_event_type_id("AddBuffEvent") == AddBuffEvent.event_type_id
+		assert buffspecs.get_event_type_ids([AddBuffEvent, "AddBuffEvent"]) == [AddBuffEvent.event_type_id] * 2
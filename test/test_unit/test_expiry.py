@@ -1,8 +1,9 @@
+import heapq
 import unittest
 import buffspecs
 
 from mock import Mock
-from expiry import register_expiry_time, get_timestamp, get_expired_buffs, FixedTime, _add_expiry_time_to_fifo_list
+from expiry import register_expiry_time, get_timestamp, get_expired_buffs, FixedTime, _push_expiry_time, cancel_expiry_times
 
 
 class Test_Expiry(unittest.TestCase):
@@ -11,16 +12,18 @@ class Test_Expiry(unittest.TestCase):
         buffspecs.clear()
         self.buffable = Mock()
         self.buffable.expiry_times = []
+        self.buffable.expiry_generations = {}
 
         self.buff_spec = Mock()
         self.buff_spec.buff_id = 1
         self.buff_spec.duration_seconds = 15
+        self.buff_spec.to_attribute = None
         buffspecs.register_buff(self.buff_spec)
 
     def test_registering_expiries(self):
         register_expiry_time(self.buffable, self.buff_spec)
 
-        next_expiry_time, buff_id = self.buffable.expiry_times[0]
+        next_expiry_time, buff_id, generation = self.buffable.expiry_times[0]
 
         assert next_expiry_time == get_timestamp() + self.buff_spec.duration_seconds
         assert buff_id == self.buff_spec.buff_id
@@ -45,17 +48,44 @@ class Test_Expiry(unittest.TestCase):
 
             assert len(self.buffable.expiry_times) == 0
 
-    def test_expiry_time_is_fifo(self):
+    def test_expiry_time_is_ordered(self):
 
         expiry_times_to_add = [1, 6, 3, 5, 2, 4, 7, 9, 0, 8]
 
         for i in range(len(expiry_times_to_add)):
             buff_id = i + 100
             expiry_time = expiry_times_to_add[i]
-            _add_expiry_time_to_fifo_list(self.buffable, expiry_time, buff_id)
+            _push_expiry_time(self.buffable, expiry_time, buff_id)
 
-        # Check if we stored in FIFO order (lowest expiry first)
+        # Check if we pop them in order (lowest expiry first)
         for i in range(len(expiry_times_to_add)):
-            expiry_time, buff_id = self.buffable.expiry_times[i]
+            expiry_time, buff_id, generation = heapq.heappop(self.buffable.expiry_times)
             assert expiry_time == i
 
+    def test_cancelled_expiry_times_are_discarded(self):
+        register_expiry_time(self.buffable, self.buff_spec)
+        cancel_expiry_times(self.buffable, self.buff_spec.buff_id)
+
+        # Registered again after cancelling, only this one should expire
+        with FixedTime(get_timestamp() + 5):
+            register_expiry_time(self.buffable, self.buff_spec)
+
+        with FixedTime(get_timestamp() + self.buff_spec.duration_seconds):
+            assert len(get_expired_buffs(self.buffable)) == 0
+            # The cancelled expiry time was reached and discarded
+            assert len(self.buffable.expiry_times) == 1
+
+        with FixedTime(get_timestamp() + self.buff_spec.duration_seconds + 5):
+            assert len(get_expired_buffs(self.buffable)) == 1
+
+    def test_cancelling_drops_the_generation(self):
+        register_expiry_time(self.buffable, self.buff_spec)
+        cancelled_generation = self.buffable.expiry_generations[self.buff_spec.buff_id]
+        cancel_expiry_times(self.buffable, self.buff_spec.buff_id)
+
+        assert self.buffable.expiry_generations == {}
+
+        # A buff registered again never gets a cancelled generation back
+        register_expiry_time(self.buffable, self.buff_spec)
+        assert self.buffable.expiry_generations[self.buff_spec.buff_id] != cancelled_generation
+
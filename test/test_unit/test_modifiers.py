@@ -2,7 +2,7 @@ from buffs.models import Buffable, Modifier, BuffModification
 
 from test.test_data.specs import CompleteBuildingEvent
 
-from attributes import apply_attributes_modification
+from attributes import apply_attributes_modification, remove_attribute_modification, get_all_buff_modifications
 
 from test.test_data.specs import (
 	Attributes
@@ -61,3 +61,26 @@ class Test_2_Modifiers(unittest.TestCase):
 		assert attribute_history[2].modifier.value == 1.00
 		assert attribute_history[2].modifier.attribute_id == Attributes.ATK
 		assert attribute_history[2].source_event == source_event
+
+	def test_modifications_indexed_by_buff_and_stack(self):
+		buffable = Buffable()
+		attributes = buffable.attributes
+
+		stack_1 = BuffModification(Modifier("+", 25, Attributes.ATK), buff_id=1)
+		stack_2 = BuffModification(Modifier("+", 25, Attributes.ATK), buff_id=1)
+		stack_2.stack_count = 2
+		other_buff = BuffModification(Modifier("+", 10, Attributes.DEF), buff_id=2)
+
+		for modification in (stack_1, stack_2, other_buff):
+			apply_attributes_modification(attributes, modification)
+
+		assert get_all_buff_modifications(attributes, 1) == [stack_1, stack_2]
+		assert get_all_buff_modifications(attributes, 1, stack=2) == [stack_2]
+		assert get_all_buff_modifications(attributes, 2) == [other_buff]
+
+		# Removing modifications also removes them from the index
+		remove_attribute_modification(attributes, stack_2)
+		assert get_all_buff_modifications(attributes, 1, stack=2) == []
+		remove_attribute_modification(attributes, stack_1)
+		assert get_all_buff_modifications(attributes, 1) == []
+		assert 1 not in attributes.buff_modifications
@@ -0,0 +1,36 @@
+from utils.dict_magic import defaultdictset
+from utils.arrays import copy_triggers, delete_triggers
+
+import unittest
+
+
+class Test_Trigger_Index(unittest.TestCase):
+
+	def test_copying_triggers_twice_does_not_duplicate(self):
+		triggers = defaultdictset()
+		copy_triggers(1, ["FartEvent"], triggers)
+		copy_triggers(1, ["FartEvent"], triggers)
+
+		assert list(triggers["FartEvent"]) == [1]
+
+	def test_triggers_keep_insertion_order(self):
+		triggers = defaultdictset()
+		for buff_id in [3, 1, 2]:
+			copy_triggers(buff_id, ["FartEvent"], triggers)
+		delete_triggers(1, ["FartEvent"], triggers)
+
+		assert list(reversed(list(triggers["FartEvent"]))) == [2, 3]
+
+	def test_deleting_last_trigger_removes_key(self):
+		triggers = defaultdictset()
+		copy_triggers(1, ["FartEvent", "SomeEvent"], triggers)
+		delete_triggers(1, ["FartEvent"], triggers)
+
+		assert "FartEvent" not in triggers
+		assert "SomeEvent" in triggers
+
+	def test_deleting_unknown_trigger_does_not_create_key(self):
+		triggers = defaultdictset()
+		delete_triggers(1, ["FartEvent"], triggers)
+
+		assert "FartEvent" not in triggers